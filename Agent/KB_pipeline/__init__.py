@@ -1,2 +1,2 @@
 # KB Pipeline Package
-from .kb_search import kb_searcher as kb_manager
+from .kb_search import kb_searcher as kb_manager, load_kb_searcher
@@ -0,0 +1,773 @@
+#!/usr/bin/env python3
+"""
+KB Benchmarks
+=============
+Micro-benchmarks for the retrieval hot paths. Uses synthetic data only,
+so no OpenAI key or ingested index is required.
+
+Usage:
+    python bench_kb.py dense                          # 10k / 100k / 1M chunks
+    python bench_kb.py dense --sizes 10000,50000 --dim 384
+    python bench_kb.py load --chunks 20000            # index.json vs versioned store
+    python bench_kb.py memory --procs 4               # RSS / shared pages per job process
+    python bench_kb.py sparse --sizes 10000,100000    # inverted-index BM25 vs rank_bm25
+    python bench_kb.py tokenize --chunks 1000000      # domain tokenizer vs lower().split()
+    python bench_kb.py ann --sizes 50000,200000       # IVF recall@k / latency vs exact
+    python bench_kb.py quant --sizes 100000           # int8 / binary first pass + float rescoring
+    python bench_kb.py parents --parents 20000        # parent fetch: .txt per parent vs mmapped blob + LRU
+    python bench_kb.py startup --chunks 50000         # job process ready time / first lookup, eager vs prewarm
+    python bench_kb.py reload --chunks 50000          # lookup latency while new generations are hot-swapped in
+    python bench_kb.py batch --rooms 1,10,25,50       # concurrent rooms: per-lookup scans vs one batched GEMM
+    python bench_kb.py tables                         # lookup-table extraction + fast-path lookups (reads kb_data)
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from kb_common import DenseIndex, DocumentChunk, HybridSearchEngine, SparseIndex
+from kb_ann import IVFIndex, default_nprobe
+from kb_index import IndexStore, StoredIndex, process_memory
+from kb_quant import BinaryCodes, Int8Codes
+from kb_tokenize import tokenize_many
+
+
+def legacy_search_dense(
+    query_embedding: List[float],
+    all_embeddings: Dict[str, List[float]],
+    top_k: int = 10
+) -> List[Tuple[str, float]]:
+    """The original per-chunk loop, kept here as the baseline."""
+    query_vec = np.array(query_embedding)
+    scores = []
+    for chunk_id, embedding in all_embeddings.items():
+        emb_vec = np.array(embedding)
+        similarity = np.dot(query_vec, emb_vec) / (
+            np.linalg.norm(query_vec) * np.linalg.norm(emb_vec) + 1e-8
+        )
+        scores.append((chunk_id, float(similarity)))
+    scores.sort(key=lambda x: x[1], reverse=True)
+    return scores[:top_k]
+
+
+def _time_queries(fn, queries, repeat: int) -> float:
+    """Median seconds per call of fn(query) over the query set."""
+    timings = []
+    for _ in range(repeat):
+        for q in queries:
+            start = time.perf_counter()
+            fn(q)
+            timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def _random_matrix(rng: np.random.Generator, n: int, dim: int) -> np.ndarray:
+    """Random unit vectors, generated in blocks to cap peak memory."""
+    matrix = np.empty((n, dim), dtype=np.float32)
+    block = 50_000
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        matrix[start:end] = rng.standard_normal((end - start, dim), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def bench_dense(args):
+    rng = np.random.default_rng(0)
+    queries = [rng.standard_normal(args.dim).astype(np.float32).tolist() for _ in range(args.queries)]
+
+    print(f"\n⚡ Dense search benchmark (dim={args.dim}, top_k={args.top_k})")
+    print("=" * 60)
+    print(f"  {'chunks':>10} | {'legacy loop':>12} | {'matrix':>10} | {'speedup':>8}")
+    print("  " + "-" * 56)
+
+    for n in args.sizes:
+        matrix = _random_matrix(rng, n, args.dim)
+        ids = [f"doc_p{i // 8:06d}_c{i % 8:03d}" for i in range(n)]
+        index = DenseIndex(ids, matrix)
+
+        fast = _time_queries(lambda q: index.search(q, args.top_k), queries, args.repeat)
+
+        if n <= args.legacy_max:
+            embeddings = {cid: row.tolist() for cid, row in zip(ids, matrix)}
+            slow = _time_queries(lambda q: legacy_search_dense(q, embeddings, args.top_k), queries[:2], 1)
+            # Sanity check: same top hit
+            assert legacy_search_dense(queries[0], embeddings, 1)[0][0] == index.search(queries[0], 1)[0][0]
+            del embeddings
+            print(f"  {n:>10,} | {slow * 1000:>9.1f} ms | {fast * 1000:>7.2f} ms | {slow / fast:>7.0f}x")
+        else:
+            print(f"  {n:>10,} | {'skipped':>12} | {fast * 1000:>7.2f} ms | {'-':>8}")
+
+        del index, matrix
+    print()
+
+
+def _synthetic_index(rng: np.random.Generator, n_children: int, dim: int) -> Dict:
+    """Legacy dict-layout index: one parent per 8 children, embeddings as lists."""
+    vocab = [f"term{i}" for i in range(5000)] + ["ETFE", "PFA", "zone", "die", "nozzle"]
+    index = {"documents": {"doc0": {"doc_id": "doc0", "filename": "synthetic.docx", "summary": ""}},
+             "chunks": {}, "images": {}, "embeddings": {}}
+    matrix = _random_matrix(rng, n_children, dim)
+    for i in range(n_children):
+        parent_id = f"doc0_p{i // 8:06d}"
+        if i % 8 == 0:
+            index["chunks"][parent_id] = DocumentChunk(parent_id, "doc0", "synthetic.docx", "").__dict__
+        emb = matrix[i].tolist()
+        text = " ".join(rng.choice(vocab, 60))
+        chunk = DocumentChunk(f"{parent_id}_c{i % 8:03d}", "doc0", "synthetic.docx", text,
+                              embedding=emb, is_parent=False, parent_id=parent_id)
+        index["chunks"][chunk.chunk_id] = chunk.__dict__
+        index["embeddings"][chunk.chunk_id] = emb
+    return index
+
+
+def _measure(fn) -> Tuple[float, float]:
+    """Seconds for one call of fn(), and peak traced MiB from a second call."""
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak / 2**20
+
+
+def bench_load(args):
+    rng = np.random.default_rng(0)
+    tmp = Path(tempfile.mkdtemp(prefix="kb_bench_"))
+    try:
+        index = _synthetic_index(rng, args.chunks, args.dim)
+        engine = HybridSearchEngine()
+        engine.build_bm25_index([DocumentChunk(**c) for c in index["chunks"].values()])
+
+        with open(tmp / "index.json", 'w') as f:
+            json.dump(index, f, indent=2)
+        IndexStore(tmp / "v2").save(StoredIndex.from_index_dict(index, sparse=engine.sparse_index))
+        del index
+
+        def load_legacy():
+            with open(tmp / "index.json", 'r') as f:
+                data = json.load(f)
+            engine.build_bm25_index([DocumentChunk(**c) for c in data["chunks"].values()])
+            return data, DenseIndex.from_embeddings(data["embeddings"])
+
+        def load_store():
+            stored = IndexStore(tmp / "v2").load()
+            engine.sparse_index = stored.sparse
+            return stored, DenseIndex(stored.chunk_ids, stored.chunk_matrix)
+
+        print(f"\n⚡ Cold-start index load ({args.chunks:,} chunks, dim={args.dim})")
+        print("=" * 60)
+        for name, fn in [("index.json", load_legacy), ("versioned store", load_store)]:
+            elapsed, peak = _measure(fn)
+            print(f"  {name:<16} {elapsed:>8.2f} s   peak {peak:>9.1f} MiB")
+        print()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _memory_worker(store_dir: str, mmap: bool, barrier, results):
+    """One simulated job process: load the index, touch every page, report."""
+    store = IndexStore(Path(store_dir))
+    stored = store.load(mmap=mmap)
+    index = DenseIndex(stored.chunk_ids, stored.chunk_matrix)
+    index.search(np.ones(index.matrix.shape[1], dtype=np.float32), 5)
+    stored.sparse.search(["etfe", "zone", "die"], 5)
+    barrier.wait()  # all processes hold the index at the same time
+    results.put(process_memory(store.index_dir))
+    barrier.wait()
+
+
+def bench_memory(args):
+    tmp = None
+    store_dir = args.store
+    if not store_dir:
+        tmp = Path(tempfile.mkdtemp(prefix="kb_bench_"))
+        index = _synthetic_index(np.random.default_rng(0), args.chunks, args.dim)
+        engine = HybridSearchEngine()
+        engine.build_bm25_index([DocumentChunk(**c) for c in index["chunks"].values()])
+        IndexStore(tmp).save(StoredIndex.from_index_dict(index, sparse=engine.sparse_index))
+        store_dir = str(tmp)
+        del index
+
+    ctx = mp.get_context("spawn")
+    try:
+        print(f"\n⚡ Per-process memory, {args.procs} job processes (KiB)")
+        print("=" * 72)
+        for mmap in (False, True):
+            barrier, results = ctx.Barrier(args.procs), ctx.Queue()
+            procs = [ctx.Process(target=_memory_worker, args=(store_dir, mmap, barrier, results))
+                     for _ in range(args.procs)]
+            for p in procs: p.start()
+            reports = [results.get() for _ in procs]
+            for p in procs: p.join()
+
+            print(f"\n  embeddings {'mmap (shared)' if mmap else 'np.load (private copy)'}")
+            print(f"  {'proc':>4} | {'RSS':>9} | {'PSS':>9} | {'shared':>9} | {'index RSS':>9} | {'index shared':>12}")
+            for i, r in enumerate(reports):
+                print(f"  {i:>4} | {r['rss']:>9,} | {r['pss']:>9,} | {r['shared']:>9,} | "
+                      f"{r['mapped_rss']:>9,} | {r['mapped_shared']:>12,}")
+            print(f"  total PSS: {sum(r['pss'] for r in reports):,} KiB")
+        print()
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _synthetic_corpus(rng: np.random.Generator, n_docs: int, doc_len: int = 60) -> List[List[str]]:
+    """Zipf-distributed vocabulary, roughly like technical prose."""
+    vocab = np.array([f"term{i}" for i in range(50_000)])
+    ranks = np.minimum(rng.zipf(1.2, size=(n_docs, doc_len)), len(vocab)) - 1
+    return [vocab[row].tolist() for row in ranks]
+
+
+def bench_sparse(args):
+    try:
+        from rank_bm25 import BM25Okapi
+    except ImportError:
+        BM25Okapi = None
+        print("  (pip install rank-bm25 to compare against the previous implementation)")
+
+    rng = np.random.default_rng(0)
+    print(f"\n⚡ Sparse (BM25) benchmark, top_k={args.top_k}")
+    print("=" * 72)
+    print(f"  {'docs':>9} | {'rank_bm25 build':>15} | {'postings build':>14} | "
+          f"{'rank_bm25 query':>15} | {'postings query':>14}")
+    print("  " + "-" * 70)
+
+    for n in args.sizes:
+        corpus = _synthetic_corpus(rng, n)
+        ids = [f"c{i}" for i in range(n)]
+        queries = [corpus[rng.integers(n)][:4] + ["term3", "term40000"] for _ in range(args.queries)]
+
+        start = time.perf_counter()
+        sparse = SparseIndex.build(ids, corpus)
+        build_new = time.perf_counter() - start
+        query_new = _time_queries(lambda q: sparse.search(q, args.top_k), queries, args.repeat)
+
+        build_old = query_old = float("nan")
+        if BM25Okapi is not None:
+            start = time.perf_counter()
+            bm25 = BM25Okapi(corpus)
+            build_old = time.perf_counter() - start
+
+            def legacy(q):
+                scores = bm25.get_scores(q)
+                results = sorted(((ids[i], float(s)) for i, s in enumerate(scores)), key=lambda x: x[1], reverse=True)
+                return results[:args.top_k]
+
+            query_old = _time_queries(legacy, queries[:3], 1)
+            # Sanity check: identical top scores
+            assert np.allclose([s for _, s in legacy(queries[0])], [s for _, s in sparse.search(queries[0], args.top_k)], rtol=1e-4)
+
+        print(f"  {n:>9,} | {build_old:>13.2f} s | {build_new:>12.2f} s | "
+              f"{query_old * 1000:>12.1f} ms | {query_new * 1000:>11.2f} ms")
+    print()
+
+
+def _clustered_matrix(rng: np.random.Generator, n: int, dim: int, clusters: int, noise: float) -> np.ndarray:
+    """Normalized rows around `clusters` topics; real embeddings cluster, uniform noise does not."""
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    matrix = centers[rng.integers(clusters, size=n)]
+    matrix += rng.standard_normal((n, dim), dtype=np.float32) * (noise / np.sqrt(dim))
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def bench_ann(args):
+    rng = np.random.default_rng(0)
+    print(f"\n⚡ ANN (IVF) benchmark, dim={args.dim}, recall@{args.top_k} vs exact")
+    print("=" * 72)
+    print(f"  {'chunks':>9} | {'nlist':>5} | {'nprobe':>6} | {'build':>8} | "
+          f"{'exact':>9} | {'ivf':>9} | {'recall':>6}")
+    print("  " + "-" * 70)
+
+    for n in args.sizes:
+        matrix = _clustered_matrix(rng, n, args.dim, max(8, n // 500), args.noise)
+        ids = [f"c{i}" for i in range(n)]
+        start = time.perf_counter()
+        ann, order = IVFIndex.train(matrix)
+        build = time.perf_counter() - start
+        matrix = np.ascontiguousarray(matrix[order])
+        ids = [ids[i] for i in order]
+        index = DenseIndex(ids, matrix, ann=ann)
+
+        # Queries are perturbed documents, like a question about one passage
+        queries = matrix[rng.integers(n, size=args.queries)]
+        queries = queries + rng.standard_normal(queries.shape, dtype=np.float32) * (args.noise / np.sqrt(args.dim))
+        exact = [{cid for cid, _ in index.search(q, args.top_k, exact=True)} for q in queries]
+        exact_s = _time_queries(lambda q: index.search(q, args.top_k, exact=True), queries, args.repeat)
+
+        for nprobe in sorted({max(1, default_nprobe(ann.nlist) // 2), default_nprobe(ann.nlist), min(ann.nlist, default_nprobe(ann.nlist) * 2)}):
+            ann.nprobe = nprobe
+            found = [{cid for cid, _ in index.search(q, args.top_k)} for q in queries]
+            recall = float(np.mean([len(f & e) / len(e) for f, e in zip(found, exact)]))
+            ivf_s = _time_queries(lambda q: index.search(q, args.top_k), queries, args.repeat)
+            print(f"  {n:>9,} | {ann.nlist:>5} | {nprobe:>6} | {build:>6.1f} s | "
+                  f"{exact_s * 1000:>6.2f} ms | {ivf_s * 1000:>6.2f} ms | {recall:>6.3f}")
+    print()
+
+
+def bench_quant(args):
+    rng = np.random.default_rng(0)
+    print(f"\n⚡ Quantized first pass + float32 rescoring, dim={args.dim}, recall@{args.top_k} vs exact")
+    print("=" * 78)
+    print(f"  {'chunks':>9} | {'codes':>6} | {'rescore':>7} | {'bytes/chunk':>11} | "
+          f"{'shrink':>6} | {'latency':>9} | {'recall':>6}")
+    print("  " + "-" * 76)
+
+    for n in args.sizes:
+        matrix = _clustered_matrix(rng, n, args.dim, max(8, n // 500), args.noise)
+        ids = [f"c{i}" for i in range(n)]
+        queries = matrix[rng.integers(n, size=args.queries)]
+        queries = queries + rng.standard_normal(queries.shape, dtype=np.float32) * (args.noise / np.sqrt(args.dim))
+
+        exact_index = DenseIndex(ids, matrix)
+        exact = [{cid for cid, _ in exact_index.search(q, args.top_k)} for q in queries]
+        exact_s = _time_queries(lambda q: exact_index.search(q, args.top_k), queries, args.repeat)
+        print(f"  {n:>9,} | {'f32':>6} | {'-':>7} | {matrix.nbytes / n:>11,.0f} | "
+              f"{1:>5.0f}x | {exact_s * 1000:>6.2f} ms | {1:>6.3f}")
+
+        for codes in (Int8Codes.encode(matrix), BinaryCodes.encode(matrix)):
+            for rescore in args.rescore:
+                index = DenseIndex(ids, matrix, codes=codes, rescore=rescore)
+                found = [{cid for cid, _ in index.search(q, args.top_k)} for q in queries]
+                recall = float(np.mean([len(f & e) / len(e) for f, e in zip(found, exact)]))
+                latency = _time_queries(lambda q: index.search(q, args.top_k), queries, args.repeat)
+                print(f"  {n:>9,} | {codes.mode:>6} | {rescore:>6}x | {codes.nbytes / n:>11,.0f} | "
+                      f"{matrix.nbytes / codes.nbytes:>5.0f}x | {latency * 1000:>6.2f} ms | {recall:>6.3f}")
+    print()
+
+
+_TECH_WORDS = (
+    "the die for wire size 0.35mm use nozzle OD 1.20 at Z3 temperature 320°C see "
+    "TPL/TD/28 ETFE: line speed 150 m/min, PA11 check DDR ratio (0.3-0.35) zone 4 "
+    "preheat 250+/-20degC NPC conductor"
+).split()
+
+
+def bench_tokenize(args):
+    rng = np.random.default_rng(0)
+    words = np.array(_TECH_WORDS + [f"term{i}" for i in range(args.vocab)])
+    # Half domain words, half a Zipf tail so the per-word memo sees realistic misses
+    texts = []
+    for _ in range(args.chunks):
+        picks = np.where(rng.random(args.words) < 0.5,
+                         rng.integers(len(_TECH_WORDS), size=args.words),
+                         len(_TECH_WORDS) + np.minimum(rng.zipf(1.2, size=args.words), args.vocab) - 1)
+        texts.append(" ".join(words[picks]))
+
+    print(f"\n⚡ Tokenizer benchmark, {args.chunks:,} chunks x {args.words} words")
+    print("=" * 60)
+    start = time.perf_counter()
+    baseline = [t.lower().split() for t in texts]
+    split_s = time.perf_counter() - start
+    start = time.perf_counter()
+    tokens = tokenize_many(texts)
+    tok_s = time.perf_counter() - start
+
+    n_tokens = sum(len(t) for t in tokens)
+    print(f"  lower().split()  {split_s:>7.2f} s  ({sum(len(t) for t in baseline) / split_s / 1e6:.1f} M tokens/s)")
+    print(f"  tokenize_many    {tok_s:>7.2f} s  ({n_tokens / tok_s / 1e6:.1f} M tokens/s, "
+          f"{args.chunks / tok_s:,.0f} chunks/s)")
+    print()
+
+
+def bench_parents(args):
+    rng = np.random.default_rng(0)
+    words = np.array(_TECH_WORDS + [f"term{i}" for i in range(5000)])
+    texts = {f"doc{i // 20:05d}_p{i % 20:03d}": " ".join(words[rng.integers(len(words), size=args.words)])
+             for i in range(args.parents)}
+    ids = list(texts)
+    # Zipf-skewed hits: a few parents answer most questions
+    picks = np.minimum(rng.zipf(1.3, size=(args.queries, args.top_k)), len(ids)) - 1
+    lookups = [[ids[(j * 7919) % len(ids)] for j in row] for row in picks]
+
+    print(f"\n⚡ Parent fetch, {args.parents:,} parents x {args.words} words, {args.queries:,} queries x {args.top_k} hits")
+    print("=" * 66)
+    tmp = Path(tempfile.mkdtemp(prefix="kb_bench_"))
+    try:
+        files_dir = tmp / "parents"
+        files_dir.mkdir()
+        for pid, text in texts.items():
+            (files_dir / f"{pid}.txt").write_text(text, encoding="utf-8")
+        chunks = {pid: {"chunk_id": pid, "doc_id": pid[:8], "filename": "f", "text": text, "is_parent": True}
+                  for pid, text in texts.items()}
+        store = IndexStore(tmp / "store", parent_cache_size=args.cache)
+        store.save(StoredIndex(chunks=chunks))
+        parents = store.load(mmap=True).parents
+
+        def from_files(hits):
+            out = []
+            for pid in hits:
+                path = files_dir / f"{pid}.txt"
+                out.append(path.read_text(encoding="utf-8") if path.exists() else "")
+            return out
+
+        def from_blob(hits):
+            return [parents.get(pid) for pid in hits]
+
+        assert from_files(lookups[0]) == from_blob(lookups[0])
+        for name, fn in ((".txt per parent", from_files), ("blob + LRU", from_blob)):
+            start = time.perf_counter()
+            for hits in lookups:
+                fn(hits)
+            per_query = (time.perf_counter() - start) / len(lookups)
+            print(f"  {name:<16} {per_query * 1e6:>8.1f} us/query")
+        stats = parents.stats()
+        print(f"  LRU {args.cache} entries: hit rate {stats['hit_rate']:.2f}; "
+              f"blob {parents.blob_path.stat().st_size / 1e6:.1f} MB in 1 file vs {len(texts):,} files")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    print()
+
+
+def _startup_worker(store_dir: str, mode: str, dim: int, results):
+    """One simulated job process: import, prewarm, then two lookups without the embedding API."""
+    os.environ["KB_QUERY_EXPANSION"] = "off"
+    timings = {}
+    start = time.perf_counter()
+    import kb_search
+    if mode == "eager":  # the old import-time singleton
+        kb_search.load_kb_searcher(store_dir=store_dir)
+    timings["import"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if mode == "prewarm":
+        kb_search.load_kb_searcher(store_dir=store_dir)
+    timings["setup"] = time.perf_counter() - start
+    timings["ready_at"] = time.time()
+
+    embedding = np.random.default_rng(1).standard_normal(dim).tolist()
+    for lookup in ("first", "second"):
+        start = time.perf_counter()
+        searcher = kb_search.load_kb_searcher(store_dir=store_dir)  # what the kb_searcher proxy does
+        searcher._build_context(searcher._hybrid_search("ETFE zone die nozzle", embedding, 6))
+        timings[lookup] = time.perf_counter() - start
+    results.put(timings)
+
+
+def bench_startup(args):
+    tmp = None
+    store_dir = args.store
+    if not store_dir:
+        tmp = Path(tempfile.mkdtemp(prefix="kb_bench_"))
+        index = _synthetic_index(np.random.default_rng(0), args.chunks, args.dim)
+        engine = HybridSearchEngine()
+        engine.build_bm25_index([DocumentChunk(**c) for c in index["chunks"].values()])
+        IndexStore(tmp).save(StoredIndex.from_index_dict(index, sparse=engine.sparse_index))
+        store_dir = str(tmp)
+        del index
+
+    ctx = mp.get_context("spawn")
+    try:
+        print(f"\n⚡ Job process startup and first lookup (ms, median of {args.runs})")
+        print("=" * 72)
+        print(f"  {'mode':<22} | {'import':>7} | {'prewarm':>7} | {'ready':>7} | {'1st lookup':>10} | {'2nd':>6}")
+        print("  " + "-" * 70)
+        modes = (("eager", "import-time singleton"), ("lazy", "lazy, no prewarm"), ("prewarm", "lazy + prewarm"))
+        for mode, label in modes:
+            runs = []
+            for _ in range(args.runs):
+                results = ctx.Queue()
+                started = time.time()
+                proc = ctx.Process(target=_startup_worker, args=(store_dir, mode, args.dim, results))
+                proc.start()
+                timings = results.get()
+                proc.join()
+                timings["ready"] = timings.pop("ready_at") - started
+                runs.append(timings)
+            med = {key: float(np.median([r[key] for r in runs])) * 1000 for key in runs[0]}
+            print(f"  {label:<22} | {med['import']:>7.0f} | {med['setup']:>7.0f} | {med['ready']:>7.0f} | "
+                  f"{med['first']:>10.1f} | {med['second']:>6.1f}")
+        print("\n  ready = spawn until the process could take a job; the embedding request is not included")
+        print()
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _save_synthetic(store_dir: str, n_chunks: int, dim: int, seed: int):
+    index = _synthetic_index(np.random.default_rng(seed), n_chunks, dim)
+    engine = HybridSearchEngine()
+    engine.build_bm25_index([DocumentChunk(**c) for c in index["chunks"].values()])
+    IndexStore(Path(store_dir)).save(StoredIndex.from_index_dict(index, sparse=engine.sparse_index))
+
+
+def _reload_writer(store_dir: str, n_chunks: int, dim: int, generations: int, interval: float):
+    """Stands in for ingest.py: writes a new generation every `interval` seconds."""
+    for gen in range(generations):
+        time.sleep(interval)
+        _save_synthetic(store_dir, n_chunks, dim, seed=gen + 1)
+
+
+def bench_reload(args):
+    import kb_search
+
+    tmp = Path(tempfile.mkdtemp(prefix="kb_bench_"))
+    try:
+        _save_synthetic(str(tmp), args.chunks, args.dim, seed=0)
+        searcher = kb_search.KnowledgeBaseSearcher(
+            store_dir=str(tmp), expansion="off", reload_interval=args.poll,
+        )
+        rng = np.random.default_rng(1)
+        embeddings = [rng.standard_normal(args.dim).tolist() for _ in range(32)]
+
+        writer = mp.get_context("spawn").Process(
+            target=_reload_writer, args=(str(tmp), args.chunks, args.dim, args.generations, args.interval)
+        )
+        writer.start()
+        steady, reloading, reload_ms = [], [], []
+        seen = searcher.reloads
+        while writer.is_alive() or searcher.generation < args.generations + 1:
+            busy = searcher._reload_lock.locked()
+            start = time.perf_counter()
+            results = searcher._hybrid_search("ETFE zone die", embeddings[len(steady) % 32], 6)
+            searcher._build_context(results)
+            elapsed = (time.perf_counter() - start) * 1000
+            (reloading if busy or searcher._reload_lock.locked() else steady).append(elapsed)
+            if searcher.reloads != seen:
+                seen = searcher.reloads
+                reload_ms.append(searcher.last_reload_ms)
+            time.sleep(args.gap / 1000)
+        writer.join()
+        searcher.close()
+
+        print(f"\n⚡ Lookup latency during hot reload ({args.chunks:,} chunks, {len(reload_ms)} reloads)")
+        print("=" * 66)
+        print(f"  {'':<18} | {'lookups':>7} | {'p50 ms':>7} | {'p99 ms':>7} | {'max ms':>7}")
+        for name, values in (("steady", steady), ("while reloading", reloading)):
+            if values:
+                print(f"  {name:<18} | {len(values):>7} | {np.percentile(values, 50):>7.2f} | "
+                      f"{np.percentile(values, 99):>7.2f} | {max(values):>7.2f}")
+        if reload_ms:
+            print(f"\n  background load + warm + swap: {np.median(reload_ms):.0f} ms median; "
+                  f"lookups kept running on the previous snapshot (0 ms unavailable)")
+        print()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+async def _batch_wave(search, queries: np.ndarray) -> Tuple[float, List[float]]:
+    """One lookup per room, all arriving at once; wall time and each lookup's latency (ms)."""
+    latencies = []
+
+    async def lookup(query):
+        start = time.perf_counter()
+        await search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(lookup(q) for q in queries))
+    return (time.perf_counter() - start) * 1000, latencies
+
+
+def bench_batch(args):
+    rng = np.random.default_rng(0)
+    matrix = _random_matrix(rng, args.chunks, args.dim)
+    ids = [f"c{i}" for i in range(args.chunks)]
+    codes = Int8Codes.encode(matrix) if args.codes == "int8" else None
+    index = DenseIndex(ids, matrix, codes=codes)
+
+    print(f"\n⚡ Concurrent rooms: per-lookup scans vs micro-batched scoring "
+          f"({args.chunks:,} chunks, dim={args.dim}, {args.codes}, window {args.window_ms:g} ms)")
+    print("=" * 86)
+    print(f"  {'rooms':>5} | {'mode':<9} | {'wave ms':>8} | {'p50 ms':>7} | {'p99 ms':>7} | "
+          f"{'CPU ms/wave':>11} | {'batches':>7}")
+    print("  " + "-" * 84)
+
+    async def run(rooms: int):
+        engine = HybridSearchEngine()
+        engine.enable_dense_batching(window_ms=args.window_ms, max_batch=args.max_batch)
+        modes = (
+            ("unbatched", lambda q: asyncio.to_thread(index.search, q, args.top_k)),
+            ("batched", lambda q: engine.asearch_dense(q, args.top_k, index)),
+        )
+        for name, search in modes:
+            batches = engine.dense_batcher.batches
+            walls, latencies = [], []
+            cpu_start = time.process_time()
+            for _ in range(args.waves):
+                wall, wave_latencies = await _batch_wave(search, _random_matrix(rng, rooms, args.dim))
+                walls.append(wall)
+                latencies.extend(wave_latencies)
+            cpu_ms = (time.process_time() - cpu_start) * 1000 / args.waves
+            batches = (engine.dense_batcher.batches - batches) / args.waves if name == "batched" else rooms
+            print(f"  {rooms:>5} | {name:<9} | {np.median(walls):>8.2f} | {np.percentile(latencies, 50):>7.2f} | "
+                  f"{np.percentile(latencies, 99):>7.2f} | {cpu_ms:>11.2f} | {batches:>7.1f}")
+
+    for rooms in args.rooms:
+        asyncio.run(run(rooms))
+    print()
+
+
+def bench_tables(args):
+    from kb_tables import LookupTables, extract_tables
+
+    data = Path(args.data) if args.data else Path(__file__).parent / "kb_data"
+    files = [p for p in sorted(data.glob("*")) if p.suffix.lower() in (".xlsx", ".docx")]
+    start = time.perf_counter()
+    tables = {p.name: extract_tables(p) for p in files}
+    extract_ms = (time.perf_counter() - start) * 1000
+    tables = {name: t for name, t in tables.items() if "ddr" in t or "temperature" in t}
+    if not tables:
+        print(f"❌ No DDR chart or temperature sheets found in {data}")
+        return
+
+    start = time.perf_counter()
+    lookup = LookupTables.from_stored(tables, {name: {"filename": name} for name in tables})
+    build_ms = (time.perf_counter() - start) * 1000
+
+    rng = np.random.default_rng(0)
+    sizes = rng.uniform(0.15, 1.05, args.queries).tolist()
+    compounds = [lookup.compounds[i] for i in rng.integers(len(lookup.compounds), size=args.queries)] \
+        if lookup.compounds else []
+    cases = [
+        ("ddr(wire_size)", lambda i: lookup.ddr(sizes[i])),
+        ("ddr(wire_size, thickness)", lambda i: lookup.ddr(sizes[i], 0.25)),
+        ("temperatures(compound)", lambda i: lookup.temperatures(compounds[i])),
+        ("temperatures(compound, machine)", lambda i: lookup.temperatures(compounds[i], "TPL/M/60")),
+    ]
+
+    print(f"\n⚡ Lookup tables from {data} ({', '.join(tables)})")
+    print("=" * 66)
+    print(f"  extracted {lookup.stats()} in {extract_ms:.0f} ms (ingest), indexed in {build_ms:.2f} ms (load)")
+    print(f"\n  {'lookup':<32} | {'calls':>7} | {'p50 µs':>7} | {'p99 µs':>7}")
+    print("  " + "-" * 62)
+    for name, fn in cases:
+        if name.startswith("temperatures") and not compounds:
+            continue
+        latencies = []
+        for i in range(args.queries):
+            start = time.perf_counter_ns()
+            fn(i)
+            latencies.append((time.perf_counter_ns() - start) / 1000)
+        print(f"  {name:<32} | {args.queries:>7,} | {np.percentile(latencies, 50):>7.2f} | "
+              f"{np.percentile(latencies, 99):>7.2f}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KB retrieval benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    dense = sub.add_parser("dense", help="Matrix dense search vs the legacy per-chunk loop")
+    dense.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")],
+                       default=[10_000, 100_000, 1_000_000])
+    dense.add_argument("--dim", type=int, default=1536)
+    dense.add_argument("--top-k", type=int, default=6)
+    dense.add_argument("--queries", type=int, default=5)
+    dense.add_argument("--repeat", type=int, default=3)
+    dense.add_argument("--legacy-max", type=int, default=100_000,
+                       help="Skip the legacy loop above this many chunks (it needs Python lists in RAM)")
+    dense.set_defaults(func=bench_dense)
+
+    load = sub.add_parser("load", help="Cold-start load: legacy index.json vs the versioned store")
+    load.add_argument("--chunks", type=int, default=20_000)
+    load.add_argument("--dim", type=int, default=1536)
+    load.set_defaults(func=bench_load)
+
+    memory = sub.add_parser("memory", help="Per-process RSS and shared pages with and without mmap")
+    memory.add_argument("--procs", type=int, default=4)
+    memory.add_argument("--chunks", type=int, default=20_000)
+    memory.add_argument("--dim", type=int, default=1536)
+    memory.add_argument("--store", type=str, default="",
+                        help="Existing kb_store directory to measure instead of synthetic data")
+    memory.set_defaults(func=bench_memory)
+
+    sparse = sub.add_parser("sparse", help="Inverted-index BM25 vs rank_bm25 (build + query)")
+    sparse.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")],
+                        default=[10_000, 100_000])
+    sparse.add_argument("--top-k", type=int, default=6)
+    sparse.add_argument("--queries", type=int, default=10)
+    sparse.add_argument("--repeat", type=int, default=3)
+    sparse.set_defaults(func=bench_sparse)
+
+    ann = sub.add_parser("ann", help="IVF approximate search: recall@k and latency vs exact")
+    ann.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")],
+                     default=[50_000, 200_000])
+    ann.add_argument("--dim", type=int, default=384)
+    ann.add_argument("--top-k", type=int, default=10)
+    ann.add_argument("--noise", type=float, default=2.0,
+                     help="Spread of rows around their topic (higher = harder for IVF)")
+    ann.add_argument("--queries", type=int, default=50)
+    ann.add_argument("--repeat", type=int, default=3)
+    ann.set_defaults(func=bench_ann)
+
+    quant = sub.add_parser("quant", help="int8 / binary first-pass scan with float32 rescoring vs exact")
+    quant.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[100_000])
+    quant.add_argument("--dim", type=int, default=1536)
+    quant.add_argument("--top-k", type=int, default=10)
+    quant.add_argument("--rescore", type=lambda s: [int(x) for x in s.split(",")], default=[4, 10, 30],
+                       help="Candidates re-scored in float32, as multiples of top-k")
+    quant.add_argument("--noise", type=float, default=2.0)
+    quant.add_argument("--queries", type=int, default=50)
+    quant.add_argument("--repeat", type=int, default=3)
+    quant.set_defaults(func=bench_quant)
+
+    tok = sub.add_parser("tokenize", help="Domain tokenizer throughput vs lower().split()")
+    tok.add_argument("--chunks", type=int, default=200_000)
+    tok.add_argument("--words", type=int, default=60)
+    tok.add_argument("--vocab", type=int, default=50_000)
+    tok.set_defaults(func=bench_tokenize)
+
+    par = sub.add_parser("parents", help="Parent fetch: one .txt per parent vs the mmapped blob + LRU")
+    par.add_argument("--parents", type=int, default=20_000)
+    par.add_argument("--words", type=int, default=1200)
+    par.add_argument("--queries", type=int, default=5000)
+    par.add_argument("--top-k", type=int, default=6)
+    par.add_argument("--cache", type=int, default=512)
+    par.set_defaults(func=bench_parents)
+
+    startup = sub.add_parser("startup", help="Job process ready time and first-lookup latency, eager vs prewarm")
+    startup.add_argument("--chunks", type=int, default=50_000)
+    startup.add_argument("--dim", type=int, default=1536)
+    startup.add_argument("--runs", type=int, default=3)
+    startup.add_argument("--store", type=str, default="",
+                         help="Existing kb_store directory to measure instead of synthetic data")
+    startup.set_defaults(func=bench_startup)
+
+    reload = sub.add_parser("reload", help="Lookup latency while new index generations are hot-swapped in")
+    reload.add_argument("--chunks", type=int, default=50_000)
+    reload.add_argument("--dim", type=int, default=1536)
+    reload.add_argument("--generations", type=int, default=3)
+    reload.add_argument("--interval", type=float, default=2.0, help="Seconds between generations")
+    reload.add_argument("--poll", type=float, default=0.5, help="Searcher manifest poll interval (seconds)")
+    reload.add_argument("--gap", type=float, default=5.0, help="Milliseconds between lookups")
+    reload.set_defaults(func=bench_reload)
+
+    batch = sub.add_parser("batch", help="Concurrent rooms: per-lookup dense scans vs micro-batched GEMM scoring")
+    batch.add_argument("--rooms", type=lambda s: [int(x) for x in s.split(",")], default=[1, 10, 25, 50])
+    batch.add_argument("--chunks", type=int, default=50_000)
+    batch.add_argument("--dim", type=int, default=1536)
+    batch.add_argument("--codes", choices=["none", "int8"], default="none")
+    batch.add_argument("--top-k", type=int, default=12)
+    batch.add_argument("--waves", type=int, default=20)
+    batch.add_argument("--window-ms", type=float, default=3.0)
+    batch.add_argument("--max-batch", type=int, default=64)
+    batch.set_defaults(func=bench_batch)
+
+    tables = sub.add_parser("tables", help="Lookup-table extraction and fast-path lookup latency (reads kb_data)")
+    tables.add_argument("--data", type=str, default="", help="Source directory (default: kb_data)")
+    tables.add_argument("--queries", type=int, default=100_000)
+    tables.set_defaults(func=bench_tables)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
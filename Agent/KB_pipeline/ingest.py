@@ -7,7 +7,9 @@ Command-line interface for knowledge base management.
 Usage:
     python ingest.py                  # Ingest all documents (uses kb_parser)
     python ingest.py --force          # Force re-process all
+    python ingest.py --workers 4      # Parse in 4 processes, overlapped with embedding
     python ingest.py --stats          # Show KB statistics (uses kb_searcher)
+    python ingest.py --memory         # Show per-process RSS / shared pages (uses kb_searcher)
     python ingest.py --query "text"   # Test retrieval (uses kb_searcher)
     python ingest.py --analyze file   # Analyze document content (uses kb_parser)
 """
@@ -37,18 +39,38 @@ def main():
         help="Force re-process all documents"
     )
     
+    parser.add_argument(
+        "--workers", "-w",
+        type=int,
+        default=1,
+        help="Parser processes for pipelined ingestion (1 = sequential)"
+    )
+    
     parser.add_argument(
         "--stats", "-s",
         action="store_true",
         help="Show knowledge base statistics"
     )
     
+    parser.add_argument(
+        "--memory", "-m",
+        action="store_true",
+        help="Show per-process RSS and shared (mmap) pages for the loaded index"
+    )
+    
     parser.add_argument(
         "--query", "-q",
         type=str,
         help="Test retrieval against the knowledge base"
     )
     
+    parser.add_argument(
+        "--deadline-ms",
+        type=float,
+        default=None,
+        help="Latency budget for --query; partial results are returned when it is hit"
+    )
+    
     parser.add_argument(
         "--analyze", "-a",
         type=str,
@@ -78,6 +100,25 @@ def main():
                 if doc.get("has_images"): flags.append("🖼️ images")
                 if doc.get("has_charts"): flags.append("📈 charts")
                 print(f"  • {fname}: {', '.join(flags)}")
+        
+        print("\n🗃️ Query Caches:")
+        for name, cache in kb_searcher.cache_stats().items():
+            print(f"  {name}: {cache['entries']} entries, {cache['hits']} hits, "
+                  f"{cache['misses']} misses ({cache['hit_rate']:.0%})")
+        print()
+        return
+    
+    # Memory report (Lightweight)
+    if args.memory:
+        mem = kb_searcher.memory_stats()
+        if not mem:
+            print("❌ Memory stats need /proc/self/smaps (Linux only)")
+            return
+        print("\n🧠 Process Memory (KiB)")
+        print("=" * 50)
+        print(f"  RSS: {mem['rss']:,}   PSS: {mem['pss']:,}")
+        print(f"  Shared pages: {mem['shared']:,}   Private pages: {mem['private']:,}")
+        print(f"  Index mmap RSS: {mem['mapped_rss']:,} (shared: {mem['mapped_shared']:,})")
         print()
         return
     
@@ -120,11 +161,13 @@ def main():
     if args.query:
         print(f"\n🔍 Querying: \"{args.query}\"")
         print("-" * 50)
-        result = asyncio.run(kb_searcher.query(args.query))
+        result = asyncio.run(kb_searcher.query(args.query, deadline_ms=args.deadline_ms))
         print(f"\n📝 Answer (Raw Context):\n{result.text}")
         print(f"\n📚 Sources: {', '.join(result.sources)}")
         if result.images:
             print(f"🖼️ Images: {', '.join(result.images)}")
+        if result.partial:
+            print("⏱️ Partial result: the deadline was hit before all searches finished")
         print()
         return
     
@@ -133,16 +176,23 @@ def main():
     print("=" * 50)
     print(f"  Data folder: {kb_parser.data_path}")
     print(f"  Force reprocess: {args.force}")
+    print(f"  Workers: {args.workers}")
     print()
     
-    count = kb_parser.ingest_all(force=args.force)
+    count = kb_parser.ingest_all(force=args.force, workers=args.workers)
     
     print(f"\n✅ Ingestion complete!")
-    # Get fresh stats from parser (as it has latest in memory)
-    # Or reload searcher? Parser saves index.
-    # We can just print count.
-    
-    print(f"   Processed {count} documents.")
+    run = kb_parser.last_run
+    print(f"   Processed {count} documents "
+          f"({run.get('unchanged', 0)} unchanged, {run.get('removed', 0)} removed).")
+    seconds = run.get("seconds", 0.0)
+    if count and seconds > 0:
+        print(f"   {seconds:.1f}s: {count / seconds:.2f} docs/sec, {run['chunks'] / seconds:.1f} chunks/sec")
+    if run.get("cached_embeddings"):
+        print(f"   {run['cached_embeddings']} embeddings reused from the cache "
+              f"({run.get('embedding_requests', 0)} API requests)")
+    if run.get("pending_embeddings"):
+        print(f"   ⚠️  {run['pending_embeddings']} embeddings failed; they are retried on the next run")
     print()
 
 
@@ -0,0 +1,138 @@
+"""
+KB ANN
+======
+Approximate nearest-neighbour backend for large knowledge bases.
+
+IVF (inverted file) over the pre-normalized chunk matrix: spherical k-means
+splits the rows into `nlist` clusters at ingest time, and the store writes the
+matrix in cluster order, so each inverted list is a contiguous slice of the
+(mmapped) matrix. A query scores the centroids, then exactly scores only the
+rows in the `nprobe` nearest lists.
+
+Exact search stays the automatic choice below KB_ANN_MIN_CHUNKS rows; the
+index is only built for larger corpora (or always with KB_ANN=ivf).
+"""
+
+import logging
+import numpy as np
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("kb-ann")
+
+ANN_MODES = ("auto", "ivf", "off")
+ANN_MIN_CHUNKS = 20_000
+MAX_LISTS = 4096
+
+
+def default_nlist(n_rows: int) -> int:
+    """~4*sqrt(N) lists, with enough rows per list to train on."""
+    return int(max(1, min(4 * np.sqrt(n_rows), n_rows // 39, MAX_LISTS)))
+
+
+def default_nprobe(nlist: int) -> int:
+    return int(min(nlist, max(8, nlist // 8)))
+
+
+def should_build(mode: str, n_rows: int, min_rows: int = ANN_MIN_CHUNKS) -> bool:
+    if mode not in ANN_MODES:
+        raise ValueError(f"Unknown ANN mode '{mode}', expected one of {ANN_MODES}")
+    if mode == "off" or n_rows == 0:
+        return False
+    return mode == "ivf" or n_rows >= min_rows
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray, batch: int = 65536) -> np.ndarray:
+    """Nearest centroid (max dot product) for every row, in batches."""
+    labels = np.empty(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), batch):
+        labels[start:start + batch] = np.argmax(matrix[start:start + batch] @ centroids.T, axis=1)
+    return labels
+
+
+class IVFIndex:
+    """
+    Centroids plus list boundaries into a cluster-ordered matrix.
+    Rows of list l are matrix[offsets[l]:offsets[l + 1]].
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, nprobe: Optional[int] = None):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.nprobe = nprobe or default_nprobe(self.nlist)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def train(
+        cls,
+        matrix: np.ndarray,
+        nlist: Optional[int] = None,
+        iterations: int = 10,
+        sample_per_list: int = 64,
+        seed: int = 0,
+    ) -> Tuple["IVFIndex", np.ndarray]:
+        """
+        Spherical k-means on a sample of `matrix` (rows L2-normalized).
+        Returns the index and the row permutation the matrix must be stored in.
+        """
+        n = len(matrix)
+        nlist = nlist or default_nlist(n)
+        rng = np.random.default_rng(seed)
+
+        sample_size = min(n, nlist * sample_per_list)
+        sample = np.asarray(matrix[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            # Re-seed empty lists from random sample rows
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-8)
+
+        labels = _assign(matrix, centroids)
+        order = np.argsort(labels, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=nlist), out=offsets[1:])
+        logger.info(f"Trained IVF index: {n} rows, {nlist} lists")
+        return cls(centroids.astype(np.float32), offsets), order
+
+    def search(
+        self,
+        matrix: np.ndarray,
+        query_vec: np.ndarray,
+        top_k: int,
+        nprobe: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (rows, scores) among the nprobe nearest lists; query_vec is normalized."""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = self.centroids @ query_vec
+        if nprobe < self.nlist:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.nlist)
+
+        rows: List[np.ndarray] = []
+        scores: List[np.ndarray] = []
+        for l in probe:
+            start, end = int(self.offsets[l]), int(self.offsets[l + 1])
+            if end > start:
+                rows.append(np.arange(start, end))
+                scores.append(matrix[start:end] @ query_vec)
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        rows_arr, scores_arr = np.concatenate(rows), np.concatenate(scores)
+        k = min(top_k, len(scores_arr))
+        if k < len(scores_arr):
+            top = np.argpartition(-scores_arr, k - 1)[:k]
+        else:
+            top = np.arange(len(scores_arr))
+        top = top[np.argsort(-scores_arr[top], kind="stable")]
+        return rows_arr[top], scores_arr[top]
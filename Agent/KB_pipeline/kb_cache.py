@@ -0,0 +1,421 @@
+"""
+KB Caches
+=========
+In-process caches for the query path.
+
+- EmbeddingCache: bounded LRU + TTL cache of query embeddings keyed on
+  (model, normalized text), optionally backed by SQLite so warm restarts
+  keep their entries.
+- SemanticResultCache: full QueryResults, returned for any new query whose
+  embedding is within a cosine threshold of a cached one. Scoped to one
+  index generation.
+
+And one for ingestion:
+
+- ContentEmbeddingCache: persistent, content-addressed chunk embeddings
+  keyed by sha256(model, exact text), so re-ingesting unchanged text
+  (--force, new chunker settings) makes no embedding requests.
+"""
+
+import atexit
+import hashlib
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+try:
+    from .kb_tokenize import tokenize
+except ImportError:
+    from kb_tokenize import tokenize
+
+logger = logging.getLogger("kb-cache")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_CONTEXT_PREFIX_RE = re.compile(r"^\s*\[([^\]]+)\]")
+_ACRONYM_RE = re.compile(r"\b[A-Z][A-Z0-9]+\b")
+
+
+def normalize_query(text: str) -> str:
+    """Case- and whitespace-insensitive form used as the cache key."""
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
+
+
+def context_prefix(text: str) -> str:
+    """The "[context_type]" prefix knowledge_lookup adds, or "" for general queries."""
+    match = _CONTEXT_PREFIX_RE.match(text)
+    return match.group(1).strip().lower() if match else ""
+
+
+def key_terms(text: str) -> FrozenSet[str]:
+    """
+    The tokens a near-duplicate query must repeat exactly: numbers, IDs and
+    document codes ("0.35", "z3", "tpl/td/28") plus capitalized acronyms
+    such as compound names ("ETFE" vs "ECTFE"). Embeddings barely move when
+    only these change, but the answer does.
+    """
+    terms = {t for t in tokenize(text) if any(ch.isdigit() for ch in t) or "/" in t}
+    terms.update(acronym.lower() for acronym in _ACRONYM_RE.findall(text))
+    return frozenset(terms)
+
+
+class EmbeddingCache:
+    """
+    LRU + TTL cache for query embeddings.
+    Thread-safe: lookups happen on the event loop and in worker threads.
+    With a SQLite path, the newest max_entries rows are loaded when the cache
+    opens, so get() never touches the database; put() only updates memory and
+    a background writer thread persists new entries in batched commits.
+    """
+
+    _WRITE_BATCH = 256  # rows per commit in the writer thread
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl_seconds: Optional[float] = 24 * 3600,
+        path: Optional[Path] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()  # the connection is shared with the writer thread
+        self._pending: "queue.Queue[Tuple[Tuple[str, str], Tuple[float, List[float]]]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        if path:
+            self._open_db(Path(path))
+
+    # ------------------------------------------------------------
+    # PUBLIC API
+    # ------------------------------------------------------------
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        key = (model, normalize_query(text))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry[0], now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, text: str, model: str, embedding: List[float]):
+        key = (model, normalize_query(text))
+        entry = (time.time(), list(embedding))
+        with self._lock:
+            self._insert(key, entry)
+        if self._db is not None:
+            self._pending.put((key, entry))
+            self._start_writer()
+
+    def flush(self):
+        """Block until every queued entry has been written to SQLite."""
+        if self._writer is not None:
+            self._pending.join()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        self.flush()
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                with self._db_lock:
+                    self._db.execute("DELETE FROM embeddings")
+                    self._db.commit()
+
+    # ------------------------------------------------------------
+    # INTERNALS
+    # ------------------------------------------------------------
+
+    def _insert(self, key: Tuple[str, str], entry: Tuple[float, List[float]]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _is_fresh(self, created: float, now: float) -> bool:
+        return self.ttl_seconds is None or now - created < self.ttl_seconds
+
+    def _open_db(self, path: Path):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT, text TEXT, created REAL, vector BLOB, PRIMARY KEY (model, text))"
+            )
+            if self.ttl_seconds is not None:
+                self._db.execute("DELETE FROM embeddings WHERE created < ?", (time.time() - self.ttl_seconds,))
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT model, text, created, vector FROM embeddings ORDER BY created DESC LIMIT ?",
+                (self.max_entries,),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache disabled on-disk persistence ({path}): {e}")
+            self._db = None
+            return
+        # Oldest first, so the LRU order matches the order they were cached in
+        for model, text, created, vector in reversed(rows):
+            self._insert((model, text), (created, np.frombuffer(vector, dtype=np.float32).tolist()))
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="kb-embedding-cache-writer", daemon=True)
+                self._writer.start()
+                # The writer is a daemon thread; write what is still queued at interpreter exit
+                atexit.register(self.flush)
+
+    def _write_loop(self):
+        """Drain the queue: each wakeup writes everything pending (up to _WRITE_BATCH) in one commit."""
+        while True:
+            batch = [self._pending.get()]
+            while len(batch) < self._WRITE_BATCH:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._db_put_many(batch)
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+
+    def _db_put_many(self, batch: List[Tuple[Tuple[str, str], Tuple[float, List[float]]]]):
+        rows = [(*key, created, np.asarray(vector, dtype=np.float32).tobytes()) for key, (created, vector) in batch]
+        try:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text, created, vector) VALUES (?, ?, ?, ?)", rows
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+
+class SemanticResultCache:
+    """
+    Cache of full retrieval results matched by embedding similarity.
+
+    Entries are partitioned by (context prefix, retrieval params, key terms)
+    so a "[temperature]" lookup never answers a "[tooling]" one, and "DDR die
+    for 0.35 mm" never answers "0.40 mm" however close the embeddings are.
+    The whole cache is dropped when the index generation changes.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.95,
+        max_entries: int = 256,
+        ttl_seconds: Optional[float] = 3600,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        # (partition, normalized text) -> (created, unit vector, result)
+        self._entries: "OrderedDict[Tuple, Tuple[float, np.ndarray, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text: str, embedding: List[float], generation: int, **params) -> Optional[Any]:
+        vec = self._unit(embedding)
+        if vec is None:
+            return None
+        partition = self._partition(text, params)
+        now = time.time()
+        with self._lock:
+            self._check_generation(generation)
+            for key in [k for k, e in self._entries.items() if not self._is_fresh(e[0], now)]:
+                del self._entries[key]
+
+            keys = [k for k in self._entries if k[0] == partition]
+            if keys:
+                scores = np.stack([self._entries[k][1] for k in keys]) @ vec
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    return self._entries[keys[best]][2]
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, embedding: List[float], generation: int, result: Any, **params):
+        vec = self._unit(embedding)
+        if vec is None:
+            return
+        key = (self._partition(text, params), normalize_query(text))
+        with self._lock:
+            if self.generation is not None and generation < self.generation:
+                return  # finished on a snapshot that has since been reloaded
+            self._check_generation(generation)
+            self._entries[key] = (time.time(), vec, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, generation: Optional[int] = None):
+        with self._lock:
+            self._entries.clear()
+            self.generation = generation
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    @staticmethod
+    def _partition(text: str, params: Dict) -> Tuple:
+        return (context_prefix(text), tuple(sorted(params.items())), key_terms(text))
+
+    def _check_generation(self, generation: int):
+        if generation != self.generation:
+            self._entries.clear()
+            self.generation = generation
+
+    def _is_fresh(self, created: float, now: float) -> bool:
+        return self.ttl_seconds is None or now - created < self.ttl_seconds
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> Optional[np.ndarray]:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        # Zero vector means the embedding call failed; never cache on it
+        return vec / norm if norm > 0 else None
+
+
+class ContentEmbeddingCache:
+    """
+    SQLite-backed embeddings keyed by sha256(model, text).
+
+    The key covers the exact text (no normalization) and the model, so an
+    entry can never be stale and needs no TTL. Lookups and writes are
+    batched for ingestion.
+    """
+
+    _QUERY_CHUNK = 500  # keys per SELECT ... IN (...), under SQLite's variable limit
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._opened = False
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """Open (and create) the database on first use, not at construction; call under self._lock."""
+        if not self._opened:
+            self._opened = True
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+                self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Content embedding cache disabled ({self.path}): {e}")
+                self._db = None
+        return self._db
+
+    @staticmethod
+    def key(text: str, model: str) -> bytes:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, texts: List[str], model: str) -> List[Optional[List[float]]]:
+        """Cached embeddings in input order; None for misses."""
+        keys = [self.key(text, model) for text in texts]
+        found: Dict[bytes, List[float]] = {}
+        with self._lock:
+            db = self._connection()
+            if db is not None:
+                try:
+                    unique = list(dict.fromkeys(keys))
+                    for start in range(0, len(unique), self._QUERY_CHUNK):
+                        part = unique[start:start + self._QUERY_CHUNK]
+                        rows = db.execute(
+                            f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                        ).fetchall()
+                        for key, vector in rows:
+                            found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+                except sqlite3.Error as e:
+                    logger.warning(f"Content embedding cache read failed: {e}")
+        results = [found.get(key) for key in keys]
+        hits = sum(1 for emb in results if emb is not None)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, texts: List[str], model: str, embeddings: List[Optional[List[float]]]):
+        """Store embeddings; failed (None / zero) vectors are skipped."""
+        rows = [
+            (self.key(text, model), np.asarray(emb, dtype=np.float32).tobytes())
+            for text, emb in zip(texts, embeddings)
+            if emb is not None and any(emb)
+        ]
+        if not rows:
+            return
+        with self._lock:
+            db = self._connection()
+            if db is None:
+                return
+            try:
+                db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Content embedding cache write failed: {e}")
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        return self.get_many([text], model)[0]
+
+    def put(self, text: str, model: str, embedding: List[float]):
+        self.put_many([text], model, [embedding])
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        entries = 0
+        with self._lock:
+            if self.path.exists() and self._connection() is not None:
+                entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            if self.path.exists() and self._connection() is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
@@ -0,0 +1,178 @@
+"""
+KB Client
+=========
+What the agent's knowledge_lookup calls.
+
+With KB_SERVICE_URL set (http://host:port or unix:/path/to.sock) lookups
+go to the shared retrieval service (kb_service.py) and the worker loads no
+index of its own. If the service cannot be reached, times out or errors,
+the lookup runs on the in-process searcher instead (loaded on the first
+fallback) and the service is tried again after KB_SERVICE_RETRY_S seconds.
+A fallback only gets what is left of the lookup's deadline_ms.
+
+Without KB_SERVICE_URL every lookup is in-process, as before.
+
+tables() serves the fast-path table tools (kb_tables) in-process in both
+modes; with the service, the worker reads just tables.json of the current
+generation (a few KB) and re-checks the manifest every KB_RELOAD_INTERVAL
+seconds.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import fields
+from pathlib import Path
+from typing import Optional
+
+import aiohttp
+
+try:
+    from .kb_common import QueryResult
+    from .kb_index import IndexStore
+    from .kb_search import kb_searcher, load_kb_searcher
+    from .kb_tables import LookupTables
+except ImportError:
+    from kb_common import QueryResult
+    from kb_index import IndexStore
+    from kb_search import kb_searcher, load_kb_searcher
+    from kb_tables import LookupTables
+
+logger = logging.getLogger("kb-client")
+
+# Allowance on top of a lookup's deadline for the hop to the service
+SERVICE_GRACE_MS = 500
+
+
+class KnowledgeBaseClient:
+    """query() against the retrieval service, falling back to the in-process searcher."""
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        timeout_ms: Optional[float] = None,
+        retry_after: Optional[float] = None,
+        store_dir: str = "kb_store",
+    ):
+        self.url = url if url is not None else os.getenv("KB_SERVICE_URL", "")
+        self.timeout_ms = timeout_ms or float(os.getenv("KB_SERVICE_TIMEOUT_MS", "5000"))
+        self.retry_after = (
+            retry_after if retry_after is not None
+            else float(os.getenv("KB_SERVICE_RETRY_S", "30"))
+        )
+        self.remote = 0
+        self.fallbacks = 0
+        self._down_until = 0.0
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._base_url = ""
+        # Lookup tables read straight from the store when lookups go to the service
+        self._table_store = IndexStore(Path(__file__).parent / store_dir)
+        self._tables = LookupTables()
+        self._tables_generation = -1
+        self._tables_checked = 0.0
+        self.tables_refresh = float(os.getenv("KB_RELOAD_INTERVAL", "5"))
+
+    @property
+    def uses_service(self) -> bool:
+        return bool(self.url)
+
+    def prewarm(self):
+        """Load the in-process searcher, unless lookups go to the service (then only the lookup tables)."""
+        if not self.uses_service:
+            load_kb_searcher()
+        else:
+            self._refresh_tables()
+
+    async def tables(self) -> LookupTables:
+        """Lookup tables of the current index generation, for the fast-path tools."""
+        if not self.uses_service:
+            searcher = load_kb_searcher() if kb_searcher.loaded else await asyncio.to_thread(load_kb_searcher)
+            return searcher.tables
+        if time.monotonic() >= self._tables_checked + self.tables_refresh:
+            self._refresh_tables()
+        return self._tables
+
+    def _refresh_tables(self):
+        self._tables_checked = time.monotonic()
+        try:
+            if self._table_store.current_generation() == self._tables_generation:
+                return
+            generation, tables, documents = self._table_store.load_tables()
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not read lookup tables from {self._table_store.store_path}: {e}")
+            return
+        self._tables = LookupTables.from_stored(tables, documents)
+        self._tables_generation = generation
+
+    async def query(
+        self,
+        text: str,
+        top_k: int = 3,
+        include_images: bool = True,
+        deadline_ms: Optional[float] = None,
+    ) -> QueryResult:
+        started = time.monotonic()
+        if self.uses_service and time.monotonic() >= self._down_until:
+            try:
+                result = await self._remote_query(text, top_k, include_images, deadline_ms)
+                self.remote += 1
+                return result
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+                # Lookups already in flight fail together; report the outage once
+                if time.monotonic() >= self._down_until:
+                    logger.warning(
+                        f"KB service at {self.url} unavailable ({e!r}); "
+                        f"using the in-process searcher for {self.retry_after:.0f}s"
+                    )
+                self._down_until = time.monotonic() + self.retry_after
+
+        if self.uses_service:
+            self.fallbacks += 1
+        # A cold load must not block the event loop
+        searcher = load_kb_searcher() if kb_searcher.loaded else await asyncio.to_thread(load_kb_searcher)
+        if deadline_ms:
+            # The service attempt and a cold load count against the same deadline
+            deadline_ms -= (time.monotonic() - started) * 1000
+            if deadline_ms <= 0:
+                logger.warning(f"Deadline spent before the in-process fallback for '{text}'")
+                return QueryResult(text="", sources=[], partial=True)
+        return await searcher.query(text, top_k, include_images, deadline_ms)
+
+    async def _remote_query(
+        self, text: str, top_k: int, include_images: bool, deadline_ms: Optional[float]
+    ) -> QueryResult:
+        timeout_ms = deadline_ms + SERVICE_GRACE_MS if deadline_ms else self.timeout_ms
+        payload = {"text": text, "top_k": top_k, "include_images": include_images, "deadline_ms": deadline_ms}
+        async with self._get_session().post(
+            f"{self._base_url}/query",
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=timeout_ms / 1000),
+        ) as response:
+            response.raise_for_status()
+            data = await response.json()
+        return QueryResult(**{f.name: data[f.name] for f in fields(QueryResult)})
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # A session is bound to the event loop it was created on
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            if self.url.startswith("unix:"):
+                connector = aiohttp.UnixConnector(path=self.url[len("unix:"):])
+                self._base_url = "http://kb-service"
+            else:
+                connector = aiohttp.TCPConnector()
+                self._base_url = self.url.rstrip("/")
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# Singleton used by the agent
+kb_client = KnowledgeBaseClient()
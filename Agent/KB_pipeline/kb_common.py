@@ -1,16 +1,52 @@
+import asyncio
 import logging
 import json
 import numpy as np
 import openai
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional, Tuple, Any
-from rank_bm25 import BM25Okapi
+from typing import List, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple, Any
 from dotenv import load_dotenv
 
+try:
+    from .kb_batch import MicroBatcher
+    from .kb_cache import ContentEmbeddingCache, EmbeddingCache
+    from .kb_tokenize import count_tokens, count_word_tokens, split_words, tokenize, tokenize_many
+except ImportError:
+    from kb_batch import MicroBatcher
+    from kb_cache import ContentEmbeddingCache, EmbeddingCache
+    from kb_tokenize import count_tokens, count_word_tokens, split_words, tokenize, tokenize_many
+
 load_dotenv()
 
 logger = logging.getLogger("kb-common")
 
+EMBED_MODEL = "text-embedding-3-small"
+EMBED_DIM = 1536
+
+# ============================================================
+# SHARED OPENAI CLIENTS
+# ============================================================
+
+_openai_client: Optional[openai.OpenAI] = None
+_async_openai_client: Optional[openai.AsyncOpenAI] = None
+
+
+def get_openai_client() -> openai.OpenAI:
+    """Process-wide sync client (ingestion, CLI tools)."""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = openai.OpenAI()
+    return _openai_client
+
+
+def get_async_openai_client() -> openai.AsyncOpenAI:
+    """Process-wide async client (query path). Shares one connection pool."""
+    global _async_openai_client
+    if _async_openai_client is None:
+        _async_openai_client = openai.AsyncOpenAI()
+    return _async_openai_client
+
+
 # ============================================================
 # DATA CLASSES
 # ============================================================
@@ -76,17 +112,35 @@ class QueryResult:
     sources: List[str]
     images: List[str] = field(default_factory=list)
     confidence: float = 0.0
+    partial: bool = False  # True when a deadline cut retrieval short
 
 
 # ============================================================
 # CHUNKER
 # ============================================================
 
+class _Atom(NamedTuple):
+    """Smallest unit the chunker packs: one word, or one whole table / table piece."""
+    text: str
+    tokens: int
+    page: Optional[int]
+    is_block: bool
+
+
+_TABLE_OPEN, _TABLE_CLOSE = "[TABLE]", "[/TABLE]"
+
+
 class HierarchicalChunker:
     """
     Creates parent-child chunk hierarchy.
     - Parents: Large chunks (~2000 tokens) for context
     - Children: Small chunks (~256 tokens) for search
+    
+    Sizes are model tokens (kb_tokenize.count_tokens: tiktoken cl100k when
+    installed). Words are never split, [TABLE] blocks are kept whole when they
+    fit, and larger tables are split between rows with the header repeated,
+    so a row (e.g. one DDR Chart-3 line) is always in one chunk. Every parent
+    and child records the pages its own text came from.
     """
     
     def __init__(self, parent_size: int = 2000, child_size: int = 256, overlap: int = 50):
@@ -101,74 +155,424 @@ class HierarchicalChunker:
         filename: str
     ) -> List[DocumentChunk]:
         """Create hierarchical chunks from content elements."""
-        
-        # Combine text elements into full text
-        text_parts = []
-        current_pages = []
-        
-        for el in elements:
-            if el.element_type in ["text", "table", "formula"]:
-                text_parts.append(el.content)
-                if el.page:
-                    current_pages.append(el.page)
-        
-        full_text = "\n\n".join(text_parts)
-        
-        # Create parent chunks
-        parent_chunks = self._split_text(full_text, self.parent_size, self.overlap)
-        
-        chunks = []
-        for i, parent_text in enumerate(parent_chunks):
+        return list(self.iter_chunks(elements, doc_id, filename))
+    
+    def iter_chunks(
+        self,
+        elements: Iterable[ContentElement],
+        doc_id: str,
+        filename: str
+    ) -> Iterator[DocumentChunk]:
+        """
+        Streaming create_chunks: each parent (followed by its children) is
+        emitted as soon as the next atom would overflow it, so only about one
+        parent of text is buffered.
+        """
+        parents = self._pack(self._atoms(elements), self.parent_size, self.overlap)
+        for i, parent_atoms in enumerate(parents):
             parent_id = f"{doc_id}_p{i:03d}"
             
             # Create parent chunk
-            parent_chunk = DocumentChunk(
+            yield DocumentChunk(
                 chunk_id=parent_id,
                 doc_id=doc_id,
                 filename=filename,
-                text=parent_text,
+                text=self._join(parent_atoms),
                 is_parent=True,
-                page_numbers=list(set(current_pages)) if current_pages else []
+                page_numbers=self._pages(parent_atoms)
             )
-            chunks.append(parent_chunk)
             
             # Create child chunks (for search indexing)
-            child_texts = self._split_text(parent_text, self.child_size, self.overlap // 2)
-            for j, child_text in enumerate(child_texts):
-                child_chunk = DocumentChunk(
+            children = self._pack(iter(parent_atoms), self.child_size, self.overlap // 2)
+            for j, child_atoms in enumerate(children):
+                yield DocumentChunk(
                     chunk_id=f"{parent_id}_c{j:03d}",
                     doc_id=doc_id,
                     filename=filename,
-                    text=child_text,
+                    text=self._join(child_atoms),
                     is_parent=False,
-                    parent_id=parent_id
+                    parent_id=parent_id,
+                    page_numbers=self._pages(child_atoms)
                 )
-                chunks.append(child_chunk)
-        
-        return chunks
     
-    def _split_text(self, text: str, chunk_size: int, overlap: int) -> List[str]:
-        """Split text into chunks with overlap."""
-        if not text:
-            return []
-        
-        # Approximate tokens as words * 1.3
-        words = text.split()
-        target_words = int(chunk_size / 1.3)
-        overlap_words = int(overlap / 1.3)
-        
-        chunks = []
-        start = 0
-        
-        while start < len(words):
-            end = min(start + target_words, len(words))
-            chunk = ' '.join(words[start:end])
-            chunks.append(chunk)
-            start = end - overlap_words
-            if start >= len(words) - overlap_words:
+    def _atoms(self, elements: Iterable[ContentElement]) -> Iterator[_Atom]:
+        for el in elements:
+            if el.element_type not in ["text", "table", "formula"] or not el.content:
+                continue
+            content = el.content.strip()
+            if el.element_type == "table" and content.startswith(_TABLE_OPEN):
+                yield _Atom(content, count_tokens(content), el.page, True)
+                continue
+            words = split_words(content)
+            for word, tokens in zip(words, count_word_tokens(words)):
+                yield _Atom(word, tokens, el.page, False)
+    
+    def _pack(self, atoms: Iterator[_Atom], budget: int, overlap: int) -> Iterator[List[_Atom]]:
+        """
+        Greedy packing up to `budget` tokens. Consecutive chunks share up to
+        `overlap` tokens of trailing words (never a table).
+        """
+        current: List[_Atom] = []
+        tokens = 0
+        fresh = 0  # atoms added since the last emitted chunk
+        for atom in atoms:
+            pieces = self._split_table(atom, budget) if atom.is_block and atom.tokens > budget else [atom]
+            for piece in pieces:
+                if current and tokens + piece.tokens > budget:
+                    if fresh:
+                        yield current
+                    current = self._tail(current, overlap)
+                    tokens = sum(a.tokens for a in current)
+                    if tokens + piece.tokens > budget:
+                        current, tokens = [], 0
+                    fresh = 0
+                current.append(piece)
+                tokens += piece.tokens
+                fresh += 1
+        if fresh:
+            yield current
+    
+    @staticmethod
+    def _tail(atoms: List[_Atom], overlap: int) -> List[_Atom]:
+        """Trailing words worth at most `overlap` tokens."""
+        tail: List[_Atom] = []
+        tokens = 0
+        for atom in reversed(atoms):
+            if atom.is_block or tokens + atom.tokens > overlap:
                 break
+            tail.append(atom)
+            tokens += atom.tokens
+        tail.reverse()
+        return tail
+    
+    @staticmethod
+    def _split_table(atom: _Atom, budget: int) -> List[_Atom]:
+        """Split a [TABLE] block between rows; each piece repeats the header."""
+        lines = atom.text.split("\n")
+        if lines and lines[0] == _TABLE_OPEN:
+            lines = lines[1:]
+        if lines and lines[-1] == _TABLE_CLOSE:
+            lines = lines[:-1]
+        header_len = 2 if len(lines) > 1 and set(lines[1]) <= set("|-: ") else 1
+        header, rows = lines[:header_len], lines[header_len:]
+        if not rows:
+            return [atom]
         
-        return chunks
+        fixed = count_tokens("\n".join([_TABLE_OPEN, *header, _TABLE_CLOSE]))
+        pieces: List[_Atom] = []
+        current: List[str] = []
+        tokens = fixed
+        for row in rows:
+            row_tokens = count_tokens(row) + 1
+            if current and tokens + row_tokens > budget:
+                text = "\n".join([_TABLE_OPEN, *header, *current, _TABLE_CLOSE])
+                pieces.append(_Atom(text, tokens, atom.page, True))
+                current, tokens = [], fixed
+            current.append(row)
+            tokens += row_tokens
+        text = "\n".join([_TABLE_OPEN, *header, *current, _TABLE_CLOSE])
+        pieces.append(_Atom(text, tokens, atom.page, True))
+        return pieces
+    
+    @staticmethod
+    def _join(atoms: List[_Atom]) -> str:
+        """Words joined by spaces; tables on their own lines."""
+        parts: List[str] = []
+        prev_block = False
+        for atom in atoms:
+            if parts:
+                parts.append("\n" if atom.is_block or prev_block else " ")
+            parts.append(atom.text)
+            prev_block = atom.is_block
+        return "".join(parts)
+    
+    @staticmethod
+    def _pages(atoms: List[_Atom]) -> List[int]:
+        return sorted({a.page for a in atoms if a.page})
+
+
+# ============================================================
+# DENSE INDEX
+# ============================================================
+
+class DenseIndex:
+    """
+    Pre-normalized float32 embedding matrix with a parallel chunk-id array.
+    Built once at load time so a query is one matrix-vector product + top-k.
+    With an `ann` (kb_ann.IVFIndex) attached, queries only score the probed
+    lists. With `codes` (kb_quant int8 / binary) the first pass scans the codes
+    and only the top `rescore * top_k` rows are scored in float32.
+    Pass exact=True to force the full float scan.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        matrix: np.ndarray,
+        ann: Optional[Any] = None,
+        codes: Optional[Any] = None,
+        rescore: int = 10,
+    ):
+        self.ids = np.asarray(ids, dtype=object)
+        self.matrix = matrix
+        self.ann = ann
+        self.codes = codes
+        self.rescore = rescore
+
+    @classmethod
+    def from_embeddings(cls, embeddings: Dict[str, List[float]]) -> "DenseIndex":
+        """Build from a {chunk_id: embedding} mapping, skipping empty vectors."""
+        items = [(cid, emb) for cid, emb in embeddings.items() if emb is not None and len(emb)]
+        if not items:
+            return cls([], np.zeros((0, 0), dtype=np.float32))
+
+        ids = [cid for cid, _ in items]
+        matrix = np.asarray([emb for _, emb in items], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= norms + 1e-8
+        return cls(ids, matrix)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def apply_delta(self, remove_ids: Iterable[str], embeddings: Dict[str, List[float]]) -> "DenseIndex":
+        """
+        New index without `remove_ids` and with `embeddings` added (or replaced).
+        Kept rows are copied as-is; only the new vectors are normalized.
+        """
+        added = DenseIndex.from_embeddings(embeddings)
+        drop = set(remove_ids) | set(embeddings)
+        keep = np.fromiter((cid not in drop for cid in self.ids), dtype=bool, count=len(self.ids))
+        if not len(added):
+            return DenseIndex(self.ids[keep], np.ascontiguousarray(self.matrix[keep]))
+        if not keep.any():
+            return added
+        return DenseIndex(
+            np.concatenate([self.ids[keep], added.ids]),
+            np.concatenate([self.matrix[keep], added.matrix]),
+        )
+
+    def search(self, query_embedding: List[float], top_k: int = 10, exact: bool = False) -> List[Tuple[str, float]]:
+        """Cosine similarity top-k (approximate when an ANN index is attached)."""
+        if not len(self) or top_k <= 0:
+            return []
+
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        query_vec = query_vec / (np.linalg.norm(query_vec) + 1e-8)
+        if self.ann is not None and not exact:
+            rows, row_scores = self.ann.search(self.matrix, query_vec, top_k)
+            return [(self.ids[i], float(s)) for i, s in zip(rows, row_scores)]
+
+        if self.codes is not None and not exact:
+            # Approximate scan over the codes, then exact scores for the candidates
+            rows = np.sort(self._top(self.codes.scores(query_vec), top_k * self.rescore))
+            scores = self.matrix[rows] @ query_vec
+            top = self._top(scores, top_k)
+            return [(self.ids[rows[i]], float(scores[i])) for i in top]
+
+        scores = self.matrix @ query_vec
+        return [(self.ids[i], float(scores[i])) for i in self._top(scores, top_k)]
+
+    def search_many(
+        self, query_embeddings: List[List[float]], top_k: int = 10, exact: bool = False
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        search() for several queries at once. The float scan and the int8 first
+        pass read the matrix once for all of them (one matrix-matrix product
+        instead of a matrix-vector product per query); IVF and binary codes
+        score query by query.
+        """
+        if not len(self) or top_k <= 0 or not query_embeddings:
+            return [[] for _ in query_embeddings]
+        batched_codes = self.codes is None or hasattr(self.codes, "scores_many")
+        if len(query_embeddings) == 1 or (not exact and (self.ann is not None or not batched_codes)):
+            return [self.search(q, top_k, exact) for q in query_embeddings]
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True) + 1e-8
+        if self.codes is not None and not exact:
+            candidates = self.codes.scores_many(queries)
+            results = []
+            for query_vec, code_scores in zip(queries, candidates):
+                rows = np.sort(self._top(code_scores, top_k * self.rescore))
+                scores = self.matrix[rows] @ query_vec
+                results.append([(self.ids[rows[i]], float(scores[i])) for i in self._top(scores, top_k)])
+            return results
+
+        scores = queries @ self.matrix.T
+        return [[(self.ids[i], float(row[i])) for i in self._top(row, top_k)] for row in scores]
+
+    @staticmethod
+    def _top(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k highest scores, best first."""
+        k = min(k, len(scores))
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(-scores[top], kind="stable")]
+
+
+# ============================================================
+# SPARSE INDEX
+# ============================================================
+
+class SparseIndex:
+    """
+    BM25 (Okapi) over an inverted postings index in CSR layout.
+
+    Term t's postings are doc_ids[offsets[t]:offsets[t+1]] with matching
+    term frequencies in tfs. A query only touches documents that contain
+    one of its terms. Scores match rank_bm25.BM25Okapi, including its
+    epsilon floor for negative IDF.
+    """
+
+    def __init__(
+        self,
+        chunk_ids: List[str],
+        terms: List[str],
+        offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        tfs: np.ndarray,
+        idf: np.ndarray,
+        doc_len: np.ndarray,
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+    ):
+        self.chunk_ids = np.asarray(chunk_ids, dtype=object)
+        self.terms = list(terms)
+        self.vocab = {term: i for i, term in enumerate(self.terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.idf = idf
+        self.doc_len = doc_len
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.avgdl = float(doc_len.mean()) if len(doc_len) and doc_len.any() else 1.0
+        # Per-document BM25 length normalisation, precomputed once
+        self._norm = (k1 * (1 - b + b * doc_len / self.avgdl)).astype(np.float32)
+
+    @classmethod
+    def build(
+        cls,
+        chunk_ids: List[str],
+        corpus_tokens: List[List[str]],
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+    ) -> "SparseIndex":
+        """Build postings and statistics from a tokenized corpus."""
+        vocab: Dict[str, int] = {}
+        posting_terms, doc_ids, tfs, doc_len = cls._postings(corpus_tokens, vocab)
+        return cls._from_postings(chunk_ids, list(vocab.keys()), posting_terms, doc_ids, tfs, doc_len, k1, b, epsilon)
+
+    def apply_delta(
+        self,
+        remove_ids: Iterable[str],
+        chunk_ids: List[str],
+        corpus_tokens: List[List[str]],
+    ) -> "SparseIndex":
+        """
+        New index without `remove_ids` and with the given chunks added (or replaced).
+        Only the added chunks are tokenized; existing postings are filtered and
+        merged, and scores match a full build() over the resulting corpus.
+        """
+        drop = set(remove_ids) | set(chunk_ids)
+        keep_doc = np.fromiter((cid not in drop for cid in self.chunk_ids), dtype=bool, count=len(self.chunk_ids))
+        remap = np.cumsum(keep_doc) - 1
+        keep_posting = keep_doc[self.doc_ids]
+        n_kept = int(keep_doc.sum())
+
+        vocab = dict(self.vocab)
+        new_terms, new_docs, new_tfs, new_len = self._postings(corpus_tokens, vocab)
+        old_terms = np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(self.offsets))[keep_posting]
+        posting_terms = np.concatenate([old_terms, new_terms])
+        doc_ids = np.concatenate([remap[self.doc_ids[keep_posting]], new_docs + n_kept]).astype(np.int32)
+        tfs = np.concatenate([self.tfs[keep_posting], new_tfs]).astype(np.float32)
+
+        # Drop terms whose last document was removed (IDF averages over the vocabulary)
+        terms = list(vocab.keys())
+        used = np.bincount(posting_terms, minlength=len(terms)) > 0
+        if not used.all():
+            posting_terms = (np.cumsum(used) - 1)[posting_terms]
+            terms = [t for t, u in zip(terms, used) if u]
+
+        order = np.lexsort((doc_ids, posting_terms))
+        return self._from_postings(
+            list(self.chunk_ids[keep_doc]) + list(chunk_ids), terms,
+            posting_terms[order], doc_ids[order], tfs[order],
+            np.concatenate([np.asarray(self.doc_len)[keep_doc], new_len]).astype(np.float32),
+            self.k1, self.b, self.epsilon,
+        )
+
+    @staticmethod
+    def _postings(corpus_tokens: List[List[str]], vocab: Dict[str, int]) -> Tuple[np.ndarray, ...]:
+        """(term, doc, tf) postings sorted by term then doc, extending `vocab` in place."""
+        term_ids = [vocab.setdefault(token, len(vocab)) for tokens in corpus_tokens for token in tokens]
+        doc_len = np.fromiter((len(tokens) for tokens in corpus_tokens), dtype=np.float32, count=len(corpus_tokens))
+        n_docs = max(len(corpus_tokens), 1)
+
+        # One (term, doc) key per token occurrence; unique keys give sorted postings + tf
+        keys = np.asarray(term_ids, dtype=np.int64) * n_docs + np.repeat(
+            np.arange(len(corpus_tokens), dtype=np.int64), doc_len.astype(np.int64)
+        )
+        keys, tf_counts = np.unique(keys, return_counts=True)
+        return keys // n_docs, (keys % n_docs).astype(np.int32), tf_counts.astype(np.float32), doc_len
+
+    @classmethod
+    def _from_postings(
+        cls,
+        chunk_ids: List[str],
+        terms: List[str],
+        posting_terms: np.ndarray,
+        doc_ids: np.ndarray,
+        tfs: np.ndarray,
+        doc_len: np.ndarray,
+        k1: float,
+        b: float,
+        epsilon: float,
+    ) -> "SparseIndex":
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(posting_terms, minlength=len(terms)))
+
+        # Okapi IDF with rank_bm25's epsilon floor for very common terms
+        n_docs = len(chunk_ids)
+        df = np.diff(offsets).astype(np.float64)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5) if len(df) else df
+        if len(idf):
+            floor = epsilon * (idf.sum() / len(idf))
+            idf[idf < 0] = floor
+        return cls(chunk_ids, terms, offsets, doc_ids, tfs, idf.astype(np.float32), doc_len, k1, b, epsilon)
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def search(self, query_tokens: List[str], top_k: int = 10) -> List[Tuple[str, float]]:
+        """Score only documents sharing a term with the query; partial top-k selection."""
+        docs_parts, score_parts = [], []
+        for token in query_tokens:
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            docs_parts.append(docs)
+            score_parts.append(self.idf[term] * tf * (self.k1 + 1) / (tf + self._norm[docs]))
+
+        if not docs_parts or top_k <= 0:
+            return []
+
+        docs = np.concatenate(docs_parts)
+        contributions = np.concatenate(score_parts)
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions)
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.chunk_ids[candidates[i]], float(scores[i])) for i in top]
 
 
 # ============================================================
@@ -180,92 +584,199 @@ class HybridSearchEngine:
     Hybrid search with dense (OpenAI) + sparse (BM25) + RRF fusion.
     """
     
-    def __init__(self):
-        self.openai_client = openai.OpenAI()
-        self.bm25_index = None
-        self.corpus_tokens = []
-        self.chunk_lookup = {}
+    def __init__(
+        self,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        content_cache: Optional[ContentEmbeddingCache] = None,
+    ):
+        # embedding_cache: query LRU; content_cache: persistent chunk embeddings (ingestion)
+        self.embedding_cache = embedding_cache
+        self.content_cache = content_cache
+        self.sparse_index: Optional[SparseIndex] = None
+        self.dense_index = DenseIndex([], np.zeros((0, 0), dtype=np.float32))
+        # Coalesce concurrent query-embedding misses into one request and concurrent
+        # dense lookups into one matrix product (retrieval service)
+        self.query_batcher: Optional[MicroBatcher] = None
+        self.dense_batcher: Optional[MicroBatcher] = None
+    
+    def enable_query_batching(self, window_ms: float = 3.0, max_batch: int = 64):
+        """Send query embeddings of lookups arriving within window_ms as one request."""
+        self.query_batcher = MicroBatcher(self._aembed_request, window_ms=window_ms, max_batch=max_batch)
+    
+    def enable_dense_batching(self, window_ms: float = 2.0, max_batch: int = 64):
+        """Score dense lookups arriving within window_ms together (see asearch_dense)."""
+        self.dense_batcher = MicroBatcher(self._search_dense_batch, window_ms=window_ms, max_batch=max_batch)
+    
+    async def close_batching(self):
+        """Stop both batchers (their batches in flight are cancelled); lookups go unbatched after."""
+        for batcher in (self.query_batcher, self.dense_batcher):
+            if batcher is not None:
+                await batcher.close()
+        self.query_batcher = self.dense_batcher = None
+    
+    @property
+    def openai_client(self) -> openai.OpenAI:
+        return get_openai_client()
+    
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        return get_async_openai_client()
+    
+    def _cached(self, text: str) -> Optional[List[float]]:
+        cached = self.embedding_cache.get(text, EMBED_MODEL) if self.embedding_cache else None
+        if cached is None and self.content_cache:
+            cached = self.content_cache.get(text, EMBED_MODEL)
+        return cached
+    
+    def _remember(self, text: str, embedding: List[float]):
+        # Never cache the zero vector returned on failure
+        if not any(embedding):
+            return
+        if self.embedding_cache:
+            self.embedding_cache.put(text, EMBED_MODEL, embedding)
+        if self.content_cache:
+            self.content_cache.put(text, EMBED_MODEL, embedding)
     
     def embed_text(self, text: str) -> List[float]:
         """Generate OpenAI embedding for text."""
+        cached = self._cached(text)
+        if cached is not None:
+            return cached
         try:
             response = self.openai_client.embeddings.create(
-                model="text-embedding-3-small",
+                model=EMBED_MODEL,
                 input=text[:8000]  # Truncate to max length
             )
-            return response.data[0].embedding
+            embedding = response.data[0].embedding
+            self._remember(text, embedding)
+            return embedding
         except Exception as e:
             logger.error(f"Embedding failed: {e}")
-            return [0.0] * 1536
+            return [0.0] * EMBED_DIM
     
-    def embed_batch(self, texts: List[str]) -> List[List[float]]:
-        """Batch embed multiple texts."""
-        embeddings = []
-        batch_size = 20
-        
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            try:
-                response = self.openai_client.embeddings.create(
-                    model="text-embedding-3-small",
-                    input=[t[:8000] for t in batch]
-                )
-                embeddings.extend([d.embedding for d in response.data])
-            except Exception as e:
-                logger.error(f"Batch embedding failed: {e}")
-                embeddings.extend([[0.0] * 1536] * len(batch))
+    async def _aembed_request(self, texts: List[str]) -> List[List[float]]:
+        """One embeddings call for the query path; zero vectors on failure."""
+        unique = list(dict.fromkeys(texts))
+        try:
+            response = await self.async_client.embeddings.create(
+                model=EMBED_MODEL,
+                input=[t[:8000] for t in unique]
+            )
+            by_text = {t: d.embedding for t, d in zip(unique, response.data)}
+        except Exception as e:
+            logger.error(f"Embedding failed: {e}")
+            by_text = {t: [0.0] * EMBED_DIM for t in unique}
+        return [by_text[t] for t in texts]
+    
+    def cached_embedding(self, text: str) -> Optional[List[float]]:
+        """The query embedding if a cache already holds it, without any request."""
+        return self._cached(text)
+    
+    async def aembed_text(self, text: str) -> List[float]:
+        """Async embed_text for the query path; never blocks the event loop."""
+        cached = self._cached(text)
+        if cached is not None:
+            return cached
+        return await self.aembed_uncached(text)
+    
+    async def aembed_uncached(self, text: str) -> List[float]:
+        """aembed_text after a cache miss: always requests (or joins a batch)."""
+        if self.query_batcher is not None:
+            embedding = await self.query_batcher.submit(text)
+        else:
+            embedding = (await self._aembed_request([text]))[0]
+        self._remember(text, embedding)
+        return embedding
+    
+    def embed_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Batch embed multiple texts (ingestion). Packed by tokens, rate-limited and
+        retried by kb_embed.EmbeddingPool; texts that still fail come back as None.
+        Texts already in content_cache make no request.
+        """
+        try:
+            from .kb_embed import embed_sync
+        except ImportError:
+            from kb_embed import embed_sync
+        return embed_sync(texts, cache=self.content_cache)
+    
+    async def aembed_batch(self, texts: List[str], batch_size: int = 20) -> List[List[float]]:
+        """Async embed_batch; cache misses are requested in concurrent batches."""
+        embeddings: List[Optional[List[float]]] = [self._cached(t) for t in texts]
+        missing = [i for i, emb in enumerate(embeddings) if emb is None]
         
+        if self.query_batcher is not None:
+            # Joins the variations of other concurrent lookups in one request
+            fetched = await asyncio.gather(*(self.query_batcher.submit(texts[j]) for j in missing))
+        else:
+            batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+            results = await asyncio.gather(*(self._aembed_request([texts[j] for j in b]) for b in batches))
+            fetched = [emb for batch_embeddings in results for emb in batch_embeddings]
+        for j, emb in zip(missing, fetched):
+            embeddings[j] = emb
+            self._remember(texts[j], emb)
         return embeddings
     
     def build_bm25_index(self, chunks: List[DocumentChunk]):
         """Build BM25 sparse index."""
-        self.corpus_tokens = []
-        self.chunk_lookup = {}
-        
-        for chunk in chunks:
-            tokens = chunk.text.lower().split()
-            self.corpus_tokens.append(tokens)
-            self.chunk_lookup[len(self.corpus_tokens) - 1] = chunk.chunk_id
-        
-        if self.corpus_tokens:
-            self.bm25_index = BM25Okapi(self.corpus_tokens)
+        corpus_tokens = tokenize_many(chunk.text for chunk in chunks)
+        self.sparse_index = SparseIndex.build([chunk.chunk_id for chunk in chunks], corpus_tokens)
+    
+    def build_dense_index(self, embeddings: Dict[str, List[float]]):
+        """Build the persistent dense matrix used by search_dense."""
+        self.dense_index = DenseIndex.from_embeddings(embeddings)
     
     def search_dense(
         self, 
         query_embedding: List[float], 
-        all_embeddings: Dict[str, List[float]], 
-        top_k: int = 10
+        top_k: int = 10,
+        index: Optional[DenseIndex] = None
     ) -> List[Tuple[str, float]]:
-        """Dense cosine similarity search."""
-        query_vec = np.array(query_embedding)
-        scores = []
-        
-        for chunk_id, embedding in all_embeddings.items():
-            emb_vec = np.array(embedding)
-            # Cosine similarity
-            similarity = np.dot(query_vec, emb_vec) / (
-                np.linalg.norm(query_vec) * np.linalg.norm(emb_vec) + 1e-8
-            )
-            scores.append((chunk_id, float(similarity)))
-        
-        scores.sort(key=lambda x: x[1], reverse=True)
-        return scores[:top_k]
+        """Dense cosine similarity search (defaults to the chunk index)."""
+        index = index if index is not None else self.dense_index
+        return index.search(query_embedding, top_k)
+    
+    async def asearch_dense(
+        self,
+        query_embedding: List[float],
+        top_k: int = 10,
+        index: Optional[DenseIndex] = None
+    ) -> List[Tuple[str, float]]:
+        """search_dense off the event loop; batched with concurrent lookups when enabled."""
+        index = index if index is not None else self.dense_index
+        if self.dense_batcher is None:
+            return await asyncio.to_thread(index.search, query_embedding, top_k)
+        return await self.dense_batcher.submit((index, query_embedding, top_k))
+    
+    async def _search_dense_batch(
+        self, requests: List[Tuple[DenseIndex, List[float], int]]
+    ) -> List[List[Tuple[str, float]]]:
+        """One search_many per index (chunks / images / snapshot) in the batch, in a worker thread."""
+        def _run() -> List[List[Tuple[str, float]]]:
+            groups: Dict[int, List[int]] = {}
+            for i, (index, _, _) in enumerate(requests):
+                groups.setdefault(id(index), []).append(i)
+            results: List[List[Tuple[str, float]]] = [[] for _ in requests]
+            for members in groups.values():
+                index = requests[members[0]][0]
+                top_k = max(requests[i][2] for i in members)
+                hits = index.search_many([requests[i][1] for i in members], top_k)
+                for i, found in zip(members, hits):
+                    results[i] = found[:requests[i][2]]
+            return results
+        return await asyncio.to_thread(_run)
     
-    def search_sparse(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
-        """BM25 sparse keyword search."""
-        if not self.bm25_index:
+    def search_sparse(
+        self,
+        query: str,
+        top_k: int = 10,
+        index: Optional[SparseIndex] = None
+    ) -> List[Tuple[str, float]]:
+        """BM25 sparse keyword search (defaults to the engine's index)."""
+        index = index if index is not None else self.sparse_index
+        if not index:
             return []
-        
-        query_tokens = query.lower().split()
-        scores = self.bm25_index.get_scores(query_tokens)
-        
-        results = []
-        for idx, score in enumerate(scores):
-            if idx in self.chunk_lookup:
-                results.append((self.chunk_lookup[idx], float(score)))
-        
-        results.sort(key=lambda x: x[1], reverse=True)
-        return results[:top_k]
+        return index.search(tokenize(query), top_k)
     
     def rrf_fusion(
         self, 
@@ -0,0 +1,238 @@
+"""
+KB Embedding Scheduler
+======================
+Batched, rate-limited, retrying embedding requests for ingestion.
+
+Query-time embedding stays in HybridSearchEngine (one short request under a
+deadline). Ingestion sends thousands of chunks, so EmbeddingPool:
+
+- packs texts into requests up to the provider's per-request input and token
+  limits, sized so all `max_concurrency` workers have a batch
+- keeps at most `max_concurrency` requests in flight under a requests/min and
+  tokens/min budget (KB_EMBED_RPM / KB_EMBED_TPM)
+- retries transient failures (rate limits, timeouts, 5xx) with exponential
+  backoff and jitter; a batch the API rejects is bisected so one bad input
+  does not fail its neighbours
+- returns None for texts that still failed, never a zero vector, so callers
+  can record them for re-embedding
+- with a ContentEmbeddingCache, only texts not embedded before (same model,
+  same exact text) are sent at all
+"""
+
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from typing import List, Optional, Tuple
+
+import openai
+
+try:
+    from .kb_cache import ContentEmbeddingCache
+    from .kb_common import EMBED_MODEL, get_async_openai_client
+    from .kb_tokenize import count_tokens, truncate_tokens
+except ImportError:
+    from kb_cache import ContentEmbeddingCache
+    from kb_common import EMBED_MODEL, get_async_openai_client
+    from kb_tokenize import count_tokens, truncate_tokens
+
+logger = logging.getLogger("kb-embed")
+
+# OpenAI embeddings limits
+MAX_INPUT_TOKENS = 8191
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 300_000
+MIN_BATCH_TOKENS = 8192
+
+# Errors retrying cannot fix (the request itself is wrong)
+_PERMANENT_ERRORS = (
+    openai.BadRequestError,
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+    openai.NotFoundError,
+)
+
+
+class RateLimiter:
+    """Token buckets for requests/min and tokens/min (None = unlimited)."""
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._requests = requests_per_minute or 0.0
+        self._tokens = tokens_per_minute or 0.0
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, tokens: int):
+        if self.rpm is None and self.tpm is None:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                elapsed, self._updated = now - self._updated, now
+                if self.rpm:
+                    self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+                if self.tpm:
+                    # A batch larger than the whole minute budget waits for a full bucket
+                    self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+                    tokens = min(tokens, self.tpm)
+
+                wait = 0.0
+                if self.rpm and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+                if self.tpm and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+                if wait <= 0:
+                    if self.rpm:
+                        self._requests -= 1
+                    if self.tpm:
+                        self._tokens -= tokens
+                    return
+                await asyncio.sleep(wait)
+
+
+class EmbeddingPool:
+    """Token-packed, concurrency- and rate-limited async embedding with retry."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+        max_batch_inputs: int = MAX_BATCH_INPUTS,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        client: Optional[openai.AsyncOpenAI] = None,
+        cache: Optional[ContentEmbeddingCache] = None,
+    ):
+        # Pass a dedicated client when running under a short-lived event loop (asyncio.run)
+        self.client = client
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_inputs = max_batch_inputs
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limiter = RateLimiter(
+            requests_per_minute if requests_per_minute is not None else _env_float("KB_EMBED_RPM"),
+            tokens_per_minute if tokens_per_minute is not None else _env_float("KB_EMBED_TPM"),
+        )
+        self.requests = 0
+        self.retries = 0
+        self.failed = 0
+        self.tokens = 0
+        self.cached = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests, "retries": self.retries, "failed": self.failed,
+            "tokens": self.tokens, "cached": self.cached,
+        }
+
+    async def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embeddings in input order; None where a text could not be embedded."""
+        if not texts:
+            return []
+        if self.cache is not None:
+            results = self.cache.get_many(texts, EMBED_MODEL)
+        else:
+            results = [None] * len(texts)
+        missing = [i for i, emb in enumerate(results) if emb is None]
+        self.cached += len(texts) - len(missing)
+
+        # Repeated texts (boilerplate, captions) are requested once
+        first: dict = {}
+        items = []
+        for i in missing:
+            text = texts[i]
+            if text in first:
+                continue
+            first[text] = i
+            text = truncate_tokens(text, MAX_INPUT_TOKENS) if count_tokens(text) > MAX_INPUT_TOKENS else text
+            items.append((i, text or " ", count_tokens(text or " ")))
+
+        batches = self._pack(items) if items else []
+        for batch_results in await asyncio.gather(*(self._embed_batch(b) for b in batches)):
+            for i, emb in batch_results:
+                results[i] = emb
+        for i in missing:
+            results[i] = results[first[texts[i]]]
+        if self.cache is not None and missing:
+            self.cache.put_many([texts[i] for i in missing], EMBED_MODEL, [results[i] for i in missing])
+        return results
+
+    def _pack(self, items: List[Tuple[int, str, int]]) -> List[List[Tuple[int, str, int]]]:
+        """Greedy in-order packing; the target keeps every worker busy on small jobs."""
+        total = sum(n for _, _, n in items)
+        target = min(self.max_batch_tokens, max(MIN_BATCH_TOKENS, math.ceil(total / self.max_concurrency)))
+        batches, current, current_tokens = [], [], 0
+        for item in items:
+            if current and (current_tokens + item[2] > target or len(current) >= self.max_batch_inputs):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(item)
+            current_tokens += item[2]
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _embed_batch(self, batch: List[Tuple[int, str, int]]) -> List[Tuple[int, Optional[List[float]]]]:
+        tokens = sum(n for _, _, n in batch)
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.semaphore:
+                    await self.rate_limiter.acquire(tokens)
+                    self.requests += 1
+                    response = await (self.client or get_async_openai_client()).embeddings.create(
+                        model=EMBED_MODEL,
+                        input=[text for _, text, _ in batch]
+                    )
+                self.tokens += tokens
+                return [(i, d.embedding) for (i, _, _), d in zip(batch, response.data)]
+            except _PERMANENT_ERRORS as e:
+                if isinstance(e, openai.BadRequestError) and len(batch) > 1:
+                    # Isolate the offending input(s)
+                    mid = len(batch) // 2
+                    halves = await asyncio.gather(self._embed_batch(batch[:mid]), self._embed_batch(batch[mid:]))
+                    return halves[0] + halves[1]
+                logger.error(f"Embedding rejected: {e}")
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Batch embedding failed after {attempt + 1} attempts: {e}")
+                    break
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * (0.5 + random.random())
+                self.retries += 1
+                logger.warning(f"Batch embedding failed ({e}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        self.failed += len(batch)
+        return [(i, None) for i, _, _ in batch]
+
+
+def embed_sync(texts: List[str], **pool_kwargs) -> List[Optional[List[float]]]:
+    """Blocking EmbeddingPool.embed for sync callers (not from inside an event loop)."""
+    async def _run():
+        async with openai.AsyncOpenAI() as client:
+            return await EmbeddingPool(client=client, **pool_kwargs).embed(texts)
+    return asyncio.run(_run())
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
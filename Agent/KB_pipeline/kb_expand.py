@@ -0,0 +1,168 @@
+"""
+KB Query Expansion
+==================
+Pluggable query-expansion strategies for KnowledgeBaseSearcher.
+
+- "llm":   gpt-4o-mini rewrites the query into 3 keyword variations (default)
+- "local": synonym / abbreviation table built from the KB at ingest time
+           ("Z3" <-> "zone 3", "DDR" <-> "draw down ratio", ...). No network.
+- "off":   no expansion, search the query as-is
+"""
+
+import logging
+import re
+from typing import Dict, Iterable, List
+
+try:
+    from .kb_common import get_async_openai_client
+    from .kb_tokenize import tokenize
+except ImportError:
+    from kb_common import get_async_openai_client
+    from kb_tokenize import tokenize
+
+logger = logging.getLogger("kb-expand")
+
+EXPANSION_MODES = ("llm", "local", "off")
+
+# Extrusion-line abbreviations; only those that occur in the KB are kept
+SEED_ABBREVIATIONS = {
+    "ddr": "draw down ratio",
+    "dbr": "draw balance ratio",
+    "etfe": "ethylene tetrafluoroethylene",
+    "pfa": "perfluoroalkoxy",
+    "fep": "fluorinated ethylene propylene",
+    "ptfe": "polytetrafluoroethylene",
+    "pvc": "polyvinyl chloride",
+    "od": "outer diameter",
+    "id": "inner diameter",
+    "npc": "nickel plated copper",
+    "mfs": "melt flow speed",
+    "rpm": "revolutions per minute",
+    "qc": "quality control",
+    "ppe": "personal protective equipment",
+    "wi": "work instruction",
+    "td": "technical data",
+}
+
+# "Draw Down Ratio (DDR)" and "DDR (Draw Down Ratio)"
+_LONG_THEN_ABBR_RE = re.compile(r"\b((?:[A-Za-z][a-z]+[\s-]+){1,5}[A-Za-z][a-z]+)\s*\(([A-Z][A-Z0-9]{1,7})\)")
+_ABBR_THEN_LONG_RE = re.compile(r"\b([A-Z][A-Z0-9]{1,7})\s*\(((?:[A-Za-z][a-z]+[\s-]+){1,5}[A-Za-z][a-z]+)\)")
+# "Z3", "Z-3", "zone 3", "zone3"
+_ZONE_RE = re.compile(r"\b(?:z|zone)\s*-?\s*(\d{1,2})\b", re.IGNORECASE)
+
+
+def _initials(phrase: str) -> str:
+    return "".join(w[0] for w in re.split(r"[\s-]+", phrase.lower()) if w)
+
+
+def build_synonyms(texts: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Build a bidirectional synonym table from KB text (run at ingest time).
+    Keys and values are lower-case phrases.
+    """
+    pairs = set()
+    vocabulary = set()
+
+    for text in texts:
+        vocabulary.update(tokenize(text))
+
+        for long_form, abbr in _LONG_THEN_ABBR_RE.findall(text):
+            long_form = " ".join(long_form.split()[-len(abbr):])
+            if _initials(long_form) == abbr.lower():
+                pairs.add((abbr.lower(), long_form.lower()))
+        for abbr, long_form in _ABBR_THEN_LONG_RE.findall(text):
+            if _initials(long_form) == abbr.lower():
+                pairs.add((abbr.lower(), " ".join(long_form.lower().split())))
+
+        for zone in _ZONE_RE.findall(text):
+            pairs.add((f"z{int(zone)}", f"zone {int(zone)}"))
+
+    for abbr, long_form in SEED_ABBREVIATIONS.items():
+        if abbr in vocabulary:
+            pairs.add((abbr, long_form))
+
+    synonyms: Dict[str, List[str]] = {}
+    for short, long_form in sorted(pairs):
+        synonyms.setdefault(short, []).append(long_form)
+        synonyms.setdefault(long_form, []).append(short)
+    return synonyms
+
+
+class QueryExpander:
+    """Strategy interface: return extra query variations (never the query itself)."""
+    mode = "off"
+
+    async def expand(self, query: str) -> List[str]:
+        return []
+
+
+class LLMQueryExpander(QueryExpander):
+    """Keyword variations from gpt-4o-mini (one chat call per lookup)."""
+    mode = "llm"
+
+    async def expand(self, query: str) -> List[str]:
+        try:
+            response = await get_async_openai_client().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "You are a query expansion assistant. Generate 3 short, keyword-focused variations of the user's query to help find relevant information in a document database. Return only the 3 variations separated by newlines."},
+                    {"role": "user", "content": query}
+                ],
+                max_tokens=60,
+                temperature=0.5,
+            )
+            variations = response.choices[0].message.content.strip().split('\n')
+            return [v.strip() for v in variations if v.strip()]
+        except Exception as e:
+            logger.warning(f"Query expansion failed: {e}")
+            return []
+
+
+class LocalQueryExpander(QueryExpander):
+    """Rewrites abbreviations <-> long forms using the ingest-time synonym table."""
+    mode = "local"
+
+    def __init__(self, synonyms: Dict[str, List[str]], max_variations: int = 3):
+        self.synonyms = synonyms
+        self.max_variations = max_variations
+        # Longest phrases first so "zone 3" wins over "zone"
+        phrases = sorted(synonyms, key=len, reverse=True)
+        self._pattern = re.compile(
+            r"\b(" + "|".join(re.escape(p) for p in phrases) + r")\b", re.IGNORECASE
+        ) if phrases else None
+
+    async def expand(self, query: str) -> List[str]:
+        if not self._pattern:
+            return []
+        # Canonical zone form ("Zone-3", "zone3" -> "z3") so the table lookup matches
+        normalized = _ZONE_RE.sub(lambda m: f"z{int(m.group(1))}", query)
+        matches = list(self._pattern.finditer(normalized))
+
+        candidates = [normalized]
+        for choice in range(self.max_variations):
+            out, last = [], 0
+            for m in matches:
+                options = self.synonyms.get(m.group(0).lower(), [])
+                if choice < len(options):
+                    out.append(normalized[last:m.start()] + options[choice])
+                    last = m.end()
+            if not out:
+                break
+            candidates.append("".join(out) + normalized[last:])
+
+        variations = []
+        for candidate in candidates:
+            if candidate.lower() != query.lower() and candidate not in variations:
+                variations.append(candidate)
+        return variations[:self.max_variations]
+
+
+def make_expander(mode: str, synonyms: Dict[str, List[str]]) -> QueryExpander:
+    """Build the expander for one of EXPANSION_MODES."""
+    if mode == "llm":
+        return LLMQueryExpander()
+    if mode == "local":
+        return LocalQueryExpander(synonyms)
+    if mode == "off":
+        return QueryExpander()
+    raise ValueError(f"Unknown query expansion mode '{mode}', expected one of {EXPANSION_MODES}")
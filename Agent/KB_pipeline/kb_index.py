@@ -0,0 +1,546 @@
+"""
+KB Index Store
+==============
+Versioned on-disk layout for the knowledge base index.
+
+    kb_store/
+      index/
+        manifest.json            # format version, generation, counts
+        parents-000005.bin       # append-only parent texts, shared by generations
+        gen-000007/
+          chunk_embeddings.npy   # float32 (N, D), L2-normalized
+          chunk_ids.json         # row -> chunk_id
+          image_embeddings.npy
+          image_ids.json
+          chunks.json            # columnar chunk metadata table (parent texts live in the blob)
+          parent_ids.json, parent_spans.npy, parents.json  # parent id -> (offset, length) in the blob
+          documents.json
+          images.json            # image metadata (no embeddings)
+          sparse_*.npy           # BM25 postings (CSR), IDF and doc lengths
+          sparse.json            # BM25 vocabulary, parameters, tokenizer version, row -> chunk_id
+          synonyms.json          # local query-expansion table
+          tables.json            # doc_id -> lookup tables extracted at ingest (DDR chart, temperature sheets)
+          files.json             # source path -> content hash + doc_id (incremental ingest)
+          pending.json           # chunk / image ids whose embedding failed, retried next ingest
+          ann_*.npy, ann.json    # optional IVF centroids + list offsets (large KBs only)
+          chunk_int8*.npy        # int8 codes + per-dim scale (first-pass scan)
+          chunk_binary.npy       # packed sign bits (first-pass scan)
+
+Each save writes a fresh generation directory and then atomically swaps
+manifest.json, so readers never see a half-written index. A legacy
+index.json (format 1) is still imported when no manifest exists.
+
+With an IVF index the chunk matrix and chunk_ids are written in inverted-list
+order, so each list is a contiguous slice of the matrix.
+
+Searchers open the .npy arrays (embeddings and BM25 postings) read-only
+with mmap, so every agent job process on a host shares the same physical
+pages via the page cache.
+"""
+
+import json
+import logging
+import os
+import shutil
+import numpy as np
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from pathlib import Path
+from typing import Any, List, Dict, Optional, Tuple
+
+try:
+    from .kb_ann import IVFIndex
+    from .kb_common import DenseIndex, DocumentChunk, SparseIndex
+    from .kb_parents import PARENT_CACHE_SIZE, ParentStore
+    from .kb_quant import BinaryCodes, Int8Codes, encode_all
+    from .kb_tokenize import TOKENIZER_VERSION
+except ImportError:
+    from kb_ann import IVFIndex
+    from kb_common import DenseIndex, DocumentChunk, SparseIndex
+    from kb_parents import PARENT_CACHE_SIZE, ParentStore
+    from kb_quant import BinaryCodes, Int8Codes, encode_all
+    from kb_tokenize import TOKENIZER_VERSION
+
+logger = logging.getLogger("kb-index")
+
+FORMAT_VERSION = 4
+KEEP_GENERATIONS = 2
+
+# Chunk table columns (embeddings live in the matrix, not the table)
+CHUNK_COLUMNS = [f.name for f in fields(DocumentChunk) if f.name != "embedding"]
+
+
+@dataclass
+class StoredIndex:
+    """In-memory view of one index generation."""
+    documents: Dict[str, Dict] = field(default_factory=dict)
+    chunks: Dict[str, Dict] = field(default_factory=dict)
+    images: Dict[str, Dict] = field(default_factory=dict)
+    chunk_ids: List[str] = field(default_factory=list)
+    chunk_matrix: np.ndarray = field(default_factory=lambda: np.zeros((0, 0), dtype=np.float32))
+    image_ids: List[str] = field(default_factory=list)
+    image_matrix: np.ndarray = field(default_factory=lambda: np.zeros((0, 0), dtype=np.float32))
+    sparse: Optional[SparseIndex] = None
+    ann: Optional[IVFIndex] = None
+    codes: Dict[str, Any] = field(default_factory=dict)  # "int8" / "binary" quantized chunk matrix
+    synonyms: Dict[str, List[str]] = field(default_factory=dict)
+    tables: Dict[str, Dict] = field(default_factory=dict)  # doc_id -> kb_tables.extract_tables() output
+    files: Dict[str, Dict] = field(default_factory=dict)
+    pending: Dict[str, List[str]] = field(default_factory=lambda: {"chunks": [], "images": []})
+    parents: Optional[ParentStore] = None  # parent texts (format 4+); chunks[...]["text"] is "" for stored parents
+    generation: int = 0
+    format_version: int = FORMAT_VERSION
+
+    @classmethod
+    def from_index_dict(
+        cls,
+        index: Dict,
+        sparse: Optional[SparseIndex] = None,
+        synonyms: Optional[Dict[str, List[str]]] = None,
+        generation: int = 0,
+        dense: Optional[DenseIndex] = None,
+        parents: Optional[ParentStore] = None,
+    ) -> "StoredIndex":
+        """
+        Convert the legacy dict layout (embeddings as lists) to matrices.
+        Pass `dense` to use an already-built chunk matrix instead of index["embeddings"],
+        and `parents` (the loaded generation's store) so unchanged parents keep their spans.
+        """
+        chunk_dense = dense if dense is not None else DenseIndex.from_embeddings(index.get("embeddings", {}))
+        image_dense = DenseIndex.from_embeddings({
+            img_id: img.get("embedding") for img_id, img in index.get("images", {}).items()
+        })
+        return cls(
+            documents=index.get("documents", {}),
+            chunks={
+                cid: {k: v for k, v in c.items() if k != "embedding"}
+                for cid, c in index.get("chunks", {}).items()
+            },
+            images={
+                img_id: {k: v for k, v in img.items() if k != "embedding"}
+                for img_id, img in index.get("images", {}).items()
+            },
+            chunk_ids=list(chunk_dense.ids),
+            chunk_matrix=chunk_dense.matrix,
+            image_ids=list(image_dense.ids),
+            image_matrix=image_dense.matrix,
+            sparse=sparse,
+            synonyms=synonyms or {},
+            tables=index.get("tables", {}),
+            files=index.get("files", {}),
+            pending=index.get("pending", {"chunks": [], "images": []}),
+            parents=parents,
+            generation=generation,
+        )
+
+    def chunk_text(self, chunk_id: str) -> str:
+        """Chunk text, reading parents from the parent store."""
+        chunk = self.chunks.get(chunk_id, {})
+        if chunk.get("is_parent") and not chunk.get("text") and self.parents is not None:
+            return self.parents.get(chunk_id) or ""
+        return chunk.get("text", "")
+
+    def build_ann(self, nlist: Optional[int] = None):
+        """Train an IVF index and reorder the chunk rows into inverted-list order."""
+        ann, order = IVFIndex.train(self.chunk_matrix, nlist)
+        self.chunk_ids = [self.chunk_ids[i] for i in order]
+        self.chunk_matrix = np.ascontiguousarray(self.chunk_matrix[order])
+        self.ann = ann
+
+    def to_index_dict(self) -> Dict:
+        """Expand back to the mutable dict layout used during ingestion."""
+        images = {img_id: dict(img, embedding=[]) for img_id, img in self.images.items()}
+        for img_id, row in zip(self.image_ids, self.image_matrix):
+            images[img_id]["embedding"] = row
+        return {
+            "documents": self.documents,
+            "chunks": self.chunks,
+            "images": images,
+            "embeddings": dict(zip(self.chunk_ids, self.chunk_matrix)),
+            "tables": self.tables,
+            "files": self.files,
+            "pending": self.pending,
+        }
+
+
+class IndexStore:
+    """Reads and writes StoredIndex generations under kb_store/index."""
+
+    def __init__(self, store_path: Path, parent_cache_size: int = PARENT_CACHE_SIZE):
+        self.store_path = Path(store_path)
+        self.parent_cache_size = parent_cache_size
+        self.index_dir = self.store_path / "index"
+        self.manifest_path = self.index_dir / "manifest.json"
+        self.legacy_path = self.store_path / "index.json"
+
+    def read_manifest(self) -> Optional[Dict]:
+        if not self.manifest_path.exists():
+            return None
+        with open(self.manifest_path, 'r') as f:
+            return json.load(f)
+
+    def current_generation(self) -> int:
+        manifest = self.read_manifest()
+        return manifest["generation"] if manifest else 0
+
+    def exists(self) -> bool:
+        return self.manifest_path.exists() or self.legacy_path.exists()
+
+    # ------------------------------------------------------------
+    # LOAD
+    # ------------------------------------------------------------
+
+    def load(self, mmap: bool = False) -> Optional[StoredIndex]:
+        """
+        Load the current generation, falling back to legacy index.json.
+        With mmap=True the embedding matrices are read-only memory maps.
+        """
+        manifest = self.read_manifest()
+        if manifest:
+            if manifest.get("format_version", 0) > FORMAT_VERSION:
+                raise ValueError(f"Index format {manifest['format_version']} is newer than supported {FORMAT_VERSION}")
+            return self._load_generation(manifest, mmap)
+
+        if self.legacy_path.exists():
+            logger.info(f"Importing legacy index from {self.legacy_path}")
+            with open(self.legacy_path, 'r') as f:
+                return StoredIndex.from_index_dict(json.load(f))
+
+        return None
+
+    def _load_generation(self, manifest: Dict, mmap: bool) -> StoredIndex:
+        gen_dir = self.index_dir / manifest["path"]
+        mmap_mode = "r" if mmap else None
+
+        columns, rows = self._read_table(gen_dir / "chunks.json")
+        id_col = columns.index("chunk_id")
+        chunks = {row[id_col]: dict(zip(columns, row)) for row in rows}
+
+        # Format 2 stores kept BM25 as bm25.json; those (and sparse indexes from an
+        # older tokenizer) are rebuilt by the caller
+        sparse = None
+        if (gen_dir / "sparse.json").exists():
+            sparse = self._load_sparse(gen_dir, mmap_mode)
+
+        chunk_ids = self._read_json(gen_dir / "chunk_ids.json")
+        chunk_matrix = np.load(gen_dir / "chunk_embeddings.npy", mmap_mode=mmap_mode)
+        codes = self._load_codes(gen_dir, mmap_mode, chunk_matrix.shape)
+        ann = None
+        if (gen_dir / "ann.json").exists():
+            ann = self._load_ann(gen_dir, mmap_mode, len(chunk_ids))
+
+        synonyms = {}
+        if (gen_dir / "synonyms.json").exists():
+            synonyms = self._read_json(gen_dir / "synonyms.json")
+        tables = {}
+        if (gen_dir / "tables.json").exists():
+            tables = self._read_json(gen_dir / "tables.json")
+        files = {}
+        if (gen_dir / "files.json").exists():
+            files = self._read_json(gen_dir / "files.json")
+        pending = {"chunks": [], "images": []}
+        if (gen_dir / "pending.json").exists():
+            pending = self._read_json(gen_dir / "pending.json")
+        parents = None
+        if (gen_dir / "parents.json").exists():
+            parents = self._load_parents(gen_dir)
+
+        return StoredIndex(
+            documents=self._read_json(gen_dir / "documents.json"),
+            chunks=chunks,
+            images=self._read_json(gen_dir / "images.json"),
+            chunk_ids=chunk_ids,
+            chunk_matrix=chunk_matrix,
+            image_ids=self._read_json(gen_dir / "image_ids.json"),
+            image_matrix=np.load(gen_dir / "image_embeddings.npy", mmap_mode=mmap_mode),
+            sparse=sparse,
+            ann=ann,
+            codes=codes,
+            synonyms=synonyms,
+            tables=tables,
+            files=files,
+            pending=pending,
+            parents=parents,
+            generation=manifest["generation"],
+            format_version=manifest["format_version"],
+        )
+
+    def load_tables(self) -> Tuple[int, Dict[str, Dict], Dict[str, Dict]]:
+        """
+        Generation, lookup tables and documents of the current generation,
+        without loading the rest of the index (a few KB).
+        """
+        manifest = self.read_manifest()
+        if not manifest:
+            return 0, {}, {}
+        gen_dir = self.index_dir / manifest["path"]
+        tables = self._read_json(gen_dir / "tables.json") if (gen_dir / "tables.json").exists() else {}
+        return manifest["generation"], tables, self._read_json(gen_dir / "documents.json")
+
+    def _load_sparse(self, gen_dir: Path, mmap_mode: Optional[str]) -> Optional[SparseIndex]:
+        meta = self._read_json(gen_dir / "sparse.json")
+        arrays = {
+            name: np.load(gen_dir / f"sparse_{name}.npy", mmap_mode=mmap_mode)
+            for name in ("offsets", "doc_ids", "tfs", "idf", "doc_len")
+        }
+        if meta.get("tokenizer") != TOKENIZER_VERSION:
+            logger.info("Sparse index was built with another tokenizer version; rebuilding")
+            return None
+        return SparseIndex(meta["chunk_ids"], meta["terms"], k1=meta["k1"], b=meta["b"],
+                           epsilon=meta["epsilon"], **arrays)
+
+    def _load_ann(self, gen_dir: Path, mmap_mode: Optional[str], n_rows: int) -> Optional[IVFIndex]:
+        meta = self._read_json(gen_dir / "ann.json")
+        offsets = np.load(gen_dir / "ann_offsets.npy")
+        if meta.get("type") != "ivf" or int(offsets[-1]) != n_rows:
+            logger.warning("Ignoring ANN index that does not match the chunk matrix; using exact search")
+            return None
+        centroids = np.load(gen_dir / "ann_centroids.npy", mmap_mode=mmap_mode)
+        return IVFIndex(centroids, offsets, nprobe=meta.get("nprobe"))
+
+    def _load_parents(self, gen_dir: Path) -> ParentStore:
+        meta = self._read_json(gen_dir / "parents.json")
+        return ParentStore(
+            self.index_dir / meta["blob"],
+            self._read_json(gen_dir / "parent_ids.json"),
+            np.load(gen_dir / "parent_spans.npy"),
+            cache_size=self.parent_cache_size,
+        )
+
+    def _load_codes(self, gen_dir: Path, mmap_mode: Optional[str], shape) -> Dict[str, Any]:
+        codes: Dict[str, Any] = {}
+        if (gen_dir / "chunk_int8.npy").exists():
+            codes["int8"] = Int8Codes(np.load(gen_dir / "chunk_int8.npy", mmap_mode=mmap_mode),
+                                      np.load(gen_dir / "chunk_int8_scale.npy"))
+        if (gen_dir / "chunk_binary.npy").exists():
+            codes["binary"] = BinaryCodes(np.load(gen_dir / "chunk_binary.npy", mmap_mode=mmap_mode), shape[1])
+        return codes
+
+    @staticmethod
+    def _read_table(path: Path):
+        """
+        Columns and rows of a table written by save(), decoded one row at a
+        time. A single json.load of chunks.json holds the GIL for the whole
+        parse, which would stall queries while a searcher hot-reloads.
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        decoder = json.JSONDecoder()
+        try:
+            columns, _ = decoder.raw_decode(text, text.index('"columns":') + len('"columns":'))
+            pos = text.index('"rows":[') + len('"rows":[')
+            rows = []
+            while text[pos] != "]":
+                row, pos = decoder.raw_decode(text, pos)
+                rows.append(row)
+                if text[pos] == ",":
+                    pos += 1
+            return columns, rows
+        except (ValueError, IndexError):
+            # Not in save()'s compact layout (e.g. edited by hand)
+            table = json.loads(text)
+            return table["columns"], table["rows"]
+
+    @staticmethod
+    def _read_json(path: Path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    # ------------------------------------------------------------
+    # SAVE
+    # ------------------------------------------------------------
+
+    def save(self, stored: StoredIndex) -> int:
+        """Write a new generation and atomically publish it. Returns its number."""
+        generation = self.current_generation() + 1
+        gen_name = f"gen-{generation:06d}"
+        gen_dir = self.index_dir / gen_name
+        if gen_dir.exists():
+            shutil.rmtree(gen_dir)
+        gen_dir.mkdir(parents=True)
+
+        np.save(gen_dir / "chunk_embeddings.npy", np.ascontiguousarray(stored.chunk_matrix, dtype=np.float32))
+        # Codes follow the final row order (after any ANN reordering)
+        stored.codes = encode_all(np.asarray(stored.chunk_matrix, dtype=np.float32))
+        if "int8" in stored.codes:
+            np.save(gen_dir / "chunk_int8.npy", stored.codes["int8"].codes)
+            np.save(gen_dir / "chunk_int8_scale.npy", stored.codes["int8"].scale)
+            np.save(gen_dir / "chunk_binary.npy", stored.codes["binary"].bits)
+        np.save(gen_dir / "image_embeddings.npy", np.ascontiguousarray(stored.image_matrix, dtype=np.float32))
+        self._write_json(gen_dir / "chunk_ids.json", list(stored.chunk_ids))
+        self._write_json(gen_dir / "image_ids.json", list(stored.image_ids))
+        stored.parents = self._save_parents(gen_dir, stored, generation)
+        text_col = CHUNK_COLUMNS.index("text")
+        rows = []
+        for c in stored.chunks.values():
+            row = [c.get(col) for col in CHUNK_COLUMNS]
+            if c.get("is_parent"):
+                row[text_col] = ""
+            rows.append(row)
+        self._write_json(gen_dir / "chunks.json", {"columns": CHUNK_COLUMNS, "rows": rows})
+        self._write_json(gen_dir / "documents.json", stored.documents)
+        self._write_json(gen_dir / "images.json", stored.images)
+        if stored.sparse is not None:
+            self._save_sparse(gen_dir, stored.sparse)
+        if stored.ann is not None:
+            np.save(gen_dir / "ann_centroids.npy", np.ascontiguousarray(stored.ann.centroids, dtype=np.float32))
+            np.save(gen_dir / "ann_offsets.npy", np.ascontiguousarray(stored.ann.offsets, dtype=np.int64))
+            self._write_json(gen_dir / "ann.json", {
+                "type": "ivf", "nlist": stored.ann.nlist, "nprobe": stored.ann.nprobe,
+            })
+        self._write_json(gen_dir / "synonyms.json", stored.synonyms)
+        self._write_json(gen_dir / "tables.json", stored.tables)
+        self._write_json(gen_dir / "files.json", stored.files)
+        self._write_json(gen_dir / "pending.json", stored.pending)
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "generation": generation,
+            "path": gen_name,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "dim": int(stored.chunk_matrix.shape[1]) if stored.chunk_matrix.ndim == 2 else 0,
+            "counts": {
+                "documents": len(stored.documents),
+                "chunks": len(stored.chunks),
+                "embeddings": len(stored.chunk_ids),
+                "images": len(stored.images),
+            },
+            "dense_search": "ivf" if stored.ann is not None else "exact",
+        }
+        tmp_path = self.manifest_path.with_suffix(".json.tmp")
+        self._write_json(tmp_path, manifest)
+        os.replace(tmp_path, self.manifest_path)
+
+        stored.generation = generation
+        self._prune(generation)
+        logger.info(f"Saved index generation {generation} ({len(stored.chunk_ids)} embeddings)")
+        return generation
+
+    def _save_parents(self, gen_dir: Path, stored: StoredIndex, generation: int) -> ParentStore:
+        """
+        Append new parent texts to the blob and record every parent's span.
+        Unchanged parents keep their span; the blob is rewritten with only
+        live parents once less than half of it is live.
+        """
+        prev = stored.parents
+        parent_ids = [cid for cid, c in stored.chunks.items() if c.get("is_parent")]
+        reuse = False
+        if prev is not None and prev.blob_path.exists():
+            kept = sum(prev.span(cid)[1] for cid in parent_ids
+                       if cid in prev and not stored.chunks[cid].get("text"))
+            reuse = kept * 2 >= prev.blob_path.stat().st_size
+        blob_path = prev.blob_path if reuse else self.index_dir / f"parents-{generation:06d}.bin"
+
+        spans = np.zeros((len(parent_ids), 2), dtype=np.int64)
+        with open(blob_path, "ab") as f:
+            offset = f.tell()
+            for row, cid in enumerate(parent_ids):
+                text = stored.chunks[cid].get("text")
+                if text:
+                    data = text.encode("utf-8")
+                elif prev is not None and cid in prev:
+                    if reuse:
+                        spans[row] = prev.span(cid)
+                        continue
+                    data = prev.read_bytes(cid) or b""
+                else:
+                    # Format 3 stores kept parents as kb_store/parents/<id>.txt
+                    legacy = self.store_path / "parents" / f"{cid}.txt"
+                    data = legacy.read_bytes() if legacy.exists() else b""
+                f.write(data)
+                spans[row] = (offset, len(data))
+                offset += len(data)
+
+        np.save(gen_dir / "parent_spans.npy", spans)
+        self._write_json(gen_dir / "parent_ids.json", parent_ids)
+        self._write_json(gen_dir / "parents.json", {"blob": blob_path.name, "bytes": offset})
+        return ParentStore(blob_path, parent_ids, spans, cache_size=self.parent_cache_size)
+
+    def _save_sparse(self, gen_dir: Path, sparse: SparseIndex):
+        for name in ("offsets", "doc_ids", "tfs", "idf", "doc_len"):
+            np.save(gen_dir / f"sparse_{name}.npy", np.ascontiguousarray(getattr(sparse, name)))
+        self._write_json(gen_dir / "sparse.json", {
+            "k1": sparse.k1, "b": sparse.b, "epsilon": sparse.epsilon,
+            "tokenizer": TOKENIZER_VERSION,
+            "terms": sparse.terms, "chunk_ids": list(sparse.chunk_ids),
+        })
+
+    def _prune(self, current: int):
+        """
+        Remove generation directories older than KEEP_GENERATIONS, parent
+        blobs no generation references and the format-3 parents directory.
+        Processes still mapping a removed generation keep their pages.
+        """
+        for path in self.index_dir.glob("gen-*"):
+            try:
+                gen = int(path.name.split("-", 1)[1])
+            except ValueError:
+                continue
+            if gen <= current - KEEP_GENERATIONS:
+                shutil.rmtree(path, ignore_errors=True)
+
+        # Parent blobs no remaining generation points at
+        live_blobs = set()
+        for meta_path in self.index_dir.glob("gen-*/parents.json"):
+            try:
+                live_blobs.add(self._read_json(meta_path)["blob"])
+            except (OSError, ValueError, KeyError):
+                continue
+        for blob in self.index_dir.glob("parents-*.bin"):
+            if blob.name not in live_blobs:
+                blob.unlink(missing_ok=True)
+
+        # Format 3 kept parents as kb_store/parents/<id>.txt; the generation just
+        # published carries them in the blob, so the legacy files are dead weight
+        legacy_parents = self.store_path / "parents"
+        if legacy_parents.is_dir():
+            shutil.rmtree(legacy_parents, ignore_errors=True)
+            logger.info(f"Removed legacy parent files in {legacy_parents}")
+
+    @staticmethod
+    def _write_json(path: Path, data):
+        with open(path, 'w') as f:
+            json.dump(data, f, separators=(",", ":"))
+
+
+# ============================================================
+# MEMORY MEASUREMENT
+# ============================================================
+
+def process_memory(mapped_under: Optional[Path] = None) -> Dict[str, int]:
+    """
+    Per-process memory in KiB from /proc/self/smaps (Linux only).
+    Totals cover the whole process; the "mapped_*" keys only count
+    mappings whose file path lies under `mapped_under`.
+    """
+    report = {"rss": 0, "pss": 0, "shared": 0, "private": 0,
+              "mapped_rss": 0, "mapped_pss": 0, "mapped_shared": 0}
+    try:
+        with open("/proc/self/smaps", 'r') as f:
+            lines = f.readlines()
+    except OSError:
+        return {}
+
+    prefix = str(Path(mapped_under).resolve()) if mapped_under else None
+    in_mapping = False
+    for line in lines:
+        parts = line.split()
+        if not parts[0].endswith(":"):
+            # Mapping header: "addr perms offset dev inode [path]"
+            path = parts[5] if len(parts) > 5 else ""
+            in_mapping = bool(prefix) and path.startswith(prefix)
+            continue
+
+        key, value = parts[0][:-1], int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+        if key == "Rss":
+            report["rss"] += value
+            if in_mapping: report["mapped_rss"] += value
+        elif key == "Pss":
+            report["pss"] += value
+            if in_mapping: report["mapped_pss"] += value
+        elif key in ("Shared_Clean", "Shared_Dirty"):
+            report["shared"] += value
+            if in_mapping: report["mapped_shared"] += value
+        elif key in ("Private_Clean", "Private_Dirty"):
+            report["private"] += value
+    return report
@@ -0,0 +1,117 @@
+"""
+KB Parent Store
+===============
+Parent chunk texts for context building.
+
+Parents live in one append-only blob (kb_store/index/parents-*.bin) instead
+of one .txt file each. Every index generation records (offset, length) spans
+into the blob; ingestion appends new parents and reuses the spans of
+unchanged ones, so older generations stay readable while they are still
+mapped. The blob is rewritten with only live parents once more than half
+of it is dead.
+
+The searcher memory-maps the blob, so a parent fetch is a dict lookup and
+a slice of the page cache; decoded texts of hot parents are kept in an LRU.
+"""
+
+import logging
+import mmap
+import threading
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("kb-parents")
+
+PARENT_CACHE_SIZE = 512
+
+
+class ParentStore:
+    """Read-only view of one generation's parents: id -> span of the mmapped blob."""
+
+    def __init__(self, blob_path: Path, ids: List[str], spans: np.ndarray, cache_size: int = PARENT_CACHE_SIZE):
+        self.blob_path = Path(blob_path)
+        self.ids = list(ids)
+        self.spans = spans
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._rows: Dict[str, int] = {pid: i for i, pid in enumerate(self.ids)}
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._buffer: Optional[mmap.mmap] = None
+        if self.blob_path.exists() and self.blob_path.stat().st_size:
+            with open(self.blob_path, "rb") as f:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, parent_id: str) -> bool:
+        return parent_id in self._rows
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def live_bytes(self) -> int:
+        return int(self.spans[:, 1].sum()) if len(self.spans) else 0
+
+    def span(self, parent_id: str) -> Optional[Tuple[int, int]]:
+        row = self._rows.get(parent_id)
+        if row is None:
+            return None
+        offset, length = self.spans[row]
+        return int(offset), int(length)
+
+    def read_bytes(self, parent_id: str) -> Optional[bytes]:
+        span = self.span(parent_id)
+        if span is None or self._buffer is None:
+            return None
+        offset, length = span
+        return self._buffer[offset:offset + length]
+
+    def get(self, parent_id: str) -> Optional[str]:
+        """Parent text, or None if this generation has no such parent."""
+        with self._lock:
+            text = self._cache.get(parent_id)
+            if text is not None:
+                self._cache.move_to_end(parent_id)
+                self.hits += 1
+                return text
+        data = self.read_bytes(parent_id)
+        if data is None:
+            return None
+        text = data.decode("utf-8")
+        with self._lock:
+            self.misses += 1
+            self._cache[parent_id] = text
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return text
+
+    def adopt_cache(self, previous: "ParentStore"):
+        """Carry over decoded texts whose bytes are unchanged (same blob, same span) after a reload."""
+        if previous.blob_path != self.blob_path:
+            return
+        with previous._lock:
+            cached = list(previous._cache.items())
+        with self._lock:
+            for parent_id, text in cached:
+                if parent_id not in self._cache and self.span(parent_id) == previous.span(parent_id):
+                    self._cache[parent_id] = text
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "parents": len(self.ids),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.close()
+            self._buffer = None
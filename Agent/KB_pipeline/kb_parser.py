@@ -6,19 +6,41 @@ Handles document loading, parsing (unstructured, pymupdf), chunking, and indexin
 Not used at pure runtime/search.
 """
 
+import asyncio
 import logging
-import json
+import os
+import time
 import base64
 import hashlib
 import openai
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Iterator, Optional, Set, Tuple
 
 # Import common components
 try:
-    from .kb_common import ContentElement, DocumentChunk, DocumentMeta, HierarchicalChunker, HybridSearchEngine
+    from .kb_common import ContentElement, DenseIndex, DocumentChunk, DocumentMeta, HierarchicalChunker, HybridSearchEngine, get_openai_client
+    from .kb_tokenize import tokenize_many
+    from .kb_index import IndexStore, StoredIndex
+    from .kb_expand import build_synonyms
+    from .kb_ann import ANN_MIN_CHUNKS, ANN_MODES, should_build as should_build_ann
+    from .kb_embed import EmbeddingPool
+    from .kb_cache import ContentEmbeddingCache
+    from .kb_parents import ParentStore
+    from .kb_tables import TABLES_VERSION, extract_tables
 except ImportError:
-    from kb_common import ContentElement, DocumentChunk, DocumentMeta, HierarchicalChunker, HybridSearchEngine
+    from kb_common import ContentElement, DenseIndex, DocumentChunk, DocumentMeta, HierarchicalChunker, HybridSearchEngine, get_openai_client
+    from kb_tokenize import tokenize_many
+    from kb_index import IndexStore, StoredIndex
+    from kb_expand import build_synonyms
+    from kb_ann import ANN_MIN_CHUNKS, ANN_MODES, should_build as should_build_ann
+    from kb_embed import EmbeddingPool
+    from kb_cache import ContentEmbeddingCache
+    from kb_parents import ParentStore
+    from kb_tables import TABLES_VERSION, extract_tables
 
 logger = logging.getLogger("kb-parser")
 
@@ -28,8 +50,10 @@ class ContentDetector:
     Detects and classifies content inside documents.
     """
     
-    def __init__(self, use_vision_for_charts: bool = True):
+    def __init__(self, use_vision_for_charts: bool = True, page_window: Optional[int] = None):
         self.use_vision_for_charts = use_vision_for_charts
+        # PDF pages partitioned per pass (bounds parser memory on long manuals; 0 = whole file)
+        self.page_window = page_window if page_window is not None else int(os.getenv("KB_PARSE_PAGE_WINDOW", "10"))
         self._check_dependencies()
     
     def _check_dependencies(self):
@@ -43,13 +67,71 @@ class ContentDetector:
     
     def detect_content(self, file_path: Path) -> Tuple[List[ContentElement], Dict]:
         """Parse document and detect content."""
+        summary = self._new_summary()
+        return list(self.iter_content(file_path, summary)), summary
+    
+    def iter_content(self, file_path: Path, summary: Dict) -> Iterator[ContentElement]:
+        """
+        Stream content elements; `summary` is filled in as they are produced.
+        PDFs are partitioned `page_window` pages at a time, so only one window
+        of layout elements / image payloads is alive at once.
+        """
         if not self.unstructured_available:
-            return self._fallback_parse(file_path)
+            yield from self._fallback_iter(file_path, summary)
+            return
+        
+        produced = False
+        state = {"last_caption": None}
+        for part_path, page_offset in self._page_windows(file_path):
+            elements = self._partition(part_path)
+            for element in elements:
+                el = self._convert(element, page_offset, summary, state)
+                if el is not None:
+                    produced = True
+                    yield el
+            del elements
+        
+        if not produced:
+            yield from self._fallback_iter(file_path, summary)
+    
+    @staticmethod
+    def _new_summary() -> Dict:
+        return {
+            "has_text": False, "has_tables": False, 
+            "has_images": False, "has_charts": False, 
+            "has_formulas": False, "page_count": 0, "element_counts": {}
+        }
+    
+    def _page_windows(self, file_path: Path) -> Iterator[Tuple[Path, int]]:
+        """(path, page offset) per window: page ranges of a large PDF, else the file itself."""
+        if file_path.suffix.lower() != ".pdf" or not self.page_window:
+            yield file_path, 0
+            return
+        try:
+            import fitz
+            doc = fitz.open(str(file_path))
+        except Exception:
+            yield file_path, 0
+            return
         
+        with doc, tempfile.TemporaryDirectory(prefix="kb_pages_") as tmp:
+            if len(doc) <= self.page_window:
+                yield file_path, 0
+                return
+            for start in range(0, len(doc), self.page_window):
+                part = fitz.open()
+                part.insert_pdf(doc, from_page=start, to_page=min(len(doc), start + self.page_window) - 1)
+                part_path = Path(tmp) / f"pages_{start:05d}.pdf"
+                part.save(str(part_path))
+                part.close()
+                yield part_path, start
+                part_path.unlink(missing_ok=True)
+    
+    def _partition(self, file_path: Path) -> list:
         from unstructured.partition.auto import partition
         
         try:
-            elements = partition(
+            return partition(
                 filename=str(file_path),
                 strategy="hi_res",
                 extract_images_in_pdf=True,
@@ -58,79 +140,71 @@ class ContentDetector:
         except Exception as e:
             logger.warning(f"Hi-res parsing failed, trying fast mode: {e}")
             try:
-                elements = partition(filename=str(file_path), strategy="fast")
+                return partition(filename=str(file_path), strategy="fast")
             except Exception as e2:
                 logger.warning(f"Fast parsing also failed: {e2}")
-                elements = []
-        
-        if not elements:
-            return self._fallback_parse(file_path)
+                return []
+    
+    def _convert(self, element, page_offset: int, summary: Dict, state: Dict) -> Optional[ContentElement]:
+        """One unstructured element -> ContentElement (None for captions / skipped types)."""
+        el_type = type(element).__name__
+        page_num = getattr(element.metadata, 'page_number', None)
+        if page_num:
+            page_num += page_offset
         
-        content_elements = []
-        summary = {
-            "has_text": False, "has_tables": False, 
-            "has_images": False, "has_charts": False, 
-            "has_formulas": False, "page_count": 0, "element_counts": {}
-        }
+        if page_num and page_num > summary["page_count"]:
+            summary["page_count"] = page_num
         
-        last_caption = None
+        summary["element_counts"][el_type] = summary["element_counts"].get(el_type, 0) + 1
         
-        for element in elements:
-            el_type = type(element).__name__
-            page_num = getattr(element.metadata, 'page_number', None)
+        if el_type in ["NarrativeText", "Text", "Title", "ListItem"]:
+            summary["has_text"] = True
+            return ContentElement(element_type="text", content=element.text, page=page_num)
             
-            if page_num and page_num > summary["page_count"]:
-                summary["page_count"] = page_num
+        elif el_type == "FigureCaption":
+            state["last_caption"] = element.text
             
-            summary["element_counts"][el_type] = summary["element_counts"].get(el_type, 0) + 1
+        elif el_type == "Table":
+            table_html = getattr(element.metadata, 'text_as_html', None)
+            summary["has_tables"] = True
+            return ContentElement(
+                element_type="table",
+                content=self._table_to_markdown(element.text, table_html),
+                page=page_num, metadata={"html": table_html}
+            )
+            
+        elif el_type == "Image":
+            img_b64 = getattr(element.metadata, 'image_base64', None)
+            is_chart = False
+            caption = state["last_caption"] or ""
+            
+            if caption and any(w in caption.lower() for w in ["chart", "graph", "figure", "plot"]):
+                is_chart = True
+            elif img_b64 and self.use_vision_for_charts:
+                is_chart = self._classify_image(img_b64)
             
-            if el_type in ["NarrativeText", "Text", "Title", "ListItem"]:
-                content_elements.append(ContentElement(
-                    element_type="text", content=element.text, page=page_num
-                ))
-                summary["has_text"] = True
-                
-            elif el_type == "FigureCaption":
-                last_caption = element.text
-                
-            elif el_type == "Table":
-                table_html = getattr(element.metadata, 'text_as_html', None)
-                content_elements.append(ContentElement(
-                    element_type="table",
-                    content=self._table_to_markdown(element.text, table_html),
-                    page=page_num, metadata={"html": table_html}
-                ))
-                summary["has_tables"] = True
-                
-            elif el_type == "Image":
-                img_b64 = getattr(element.metadata, 'image_base64', None)
-                is_chart = False
-                caption = last_caption or ""
-                
-                if caption and any(w in caption.lower() for w in ["chart", "graph", "figure", "plot"]):
-                    is_chart = True
-                elif img_b64 and self.use_vision_for_charts:
-                    is_chart = self._classify_image(img_b64)
-                
-                content_elements.append(ContentElement(
-                    element_type="chart" if is_chart else "image",
-                    content=caption, page=page_num,
-                    base64_data=img_b64, metadata={"is_chart": is_chart}
-                ))
-                summary["has_images"] = True
-                if is_chart: summary["has_charts"] = True
-                last_caption = None
-                
-            elif el_type == "Formula":
-                content_elements.append(ContentElement(
-                    element_type="formula", content=element.text, page=page_num
-                ))
-                summary["has_formulas"] = True
-        
-        return content_elements, summary
+            summary["has_images"] = True
+            if is_chart: summary["has_charts"] = True
+            state["last_caption"] = None
+            return ContentElement(
+                element_type="chart" if is_chart else "image",
+                content=caption, page=page_num,
+                base64_data=img_b64, metadata={"is_chart": is_chart}
+            )
+            
+        elif el_type == "Formula":
+            summary["has_formulas"] = True
+            return ContentElement(element_type="formula", content=element.text, page=page_num)
+        
+        return None
 
     def _table_to_markdown(self, text: str, html: Optional[str]) -> str:
-        """Convert table to markdown."""
+        """Convert table to markdown (one line per row, so the chunker never splits a row)."""
+        rows = _html_table_rows(html) if html else []
+        if rows:
+            md_lines = ["| " + " | ".join(cells) + " |" for cells in rows]
+            md_lines.insert(1, "|" + "|".join(["---"] * len(rows[0])) + "|")
+            return f"[TABLE]\n{chr(10).join(md_lines)}\n[/TABLE]"
         if not text: return ""
         lines = text.strip().split('\n')
         if len(lines) < 2: return f"[TABLE]\n{text}\n[/TABLE]"
@@ -142,8 +216,7 @@ class ContentDetector:
     def _classify_image(self, img_b64: str) -> bool:
         """Use Vision AI to classify image."""
         try:
-            client = openai.OpenAI()
-            response = client.chat.completions.create(
+            response = get_openai_client().chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[{
                     "role": "user",
@@ -158,45 +231,134 @@ class ContentDetector:
         except:
             return False
 
-    def _fallback_parse(self, file_path: Path) -> Tuple[List[ContentElement], Dict]:
-        """Simple fallback parser."""
+    def _fallback_iter(self, file_path: Path, summary: Dict) -> Iterator[ContentElement]:
+        """Simple fallback parser (PyMuPDF page by page for PDFs, else plain text)."""
         ext = file_path.suffix.lower()
-        elements = []
-        summary = {"has_text": False, "has_tables": False, "has_images": False, "has_charts": False, "page_count": 0, "element_counts": {}}
         
         # Implement minimal fallback for PDF/PyMuPDF usage if Unstructured fails
         if ext == '.pdf':
             try:
                 import fitz
                 doc = fitz.open(str(file_path))
-                summary["page_count"] = len(doc)
-                for i, page in enumerate(doc):
-                    text = page.get_text()
-                    if text.strip():
-                        elements.append(ContentElement("text", text, page=i+1))
-                        summary["has_text"] = True
-                    # Basic image extraction
-                    for img in page.get_images():
-                        try:
-                            xref = img[0]
-                            base = doc.extract_image(xref)
-                            b64 = base64.b64encode(base["image"]).decode('utf-8')
-                            elements.append(ContentElement("image", "Extracted Image", page=i+1, base64_data=b64))
+            except Exception:
+                doc = None
+            if doc is not None:
+                with doc:
+                    summary["page_count"] = len(doc)
+                    for i, page in enumerate(doc):
+                        text = page.get_text()
+                        if text.strip():
+                            summary["has_text"] = True
+                            yield ContentElement("text", text, page=i+1)
+                        # Basic image extraction
+                        for img in page.get_images():
+                            try:
+                                xref = img[0]
+                                base = doc.extract_image(xref)
+                                b64 = base64.b64encode(base["image"]).decode('utf-8')
+                            except Exception:
+                                continue
                             summary["has_images"] = True
-                        except: pass
-                doc.close()
-                return elements, summary
-            except: pass
+                            yield ContentElement("image", "Extracted Image", page=i+1, base64_data=b64)
+                return
         
         # Fallback text
         try:
             with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
                 content = f.read()
-            if content.strip():
-                elements.append(ContentElement("text", content))
-                summary["has_text"] = True
-        except: pass
-        return elements, summary
+        except OSError:
+            return
+        if content.strip():
+            summary["has_text"] = True
+            yield ContentElement("text", content)
+
+
+class _TableRowParser(HTMLParser):
+    """Collects cell text per <tr> from unstructured's text_as_html."""
+
+    def __init__(self):
+        super().__init__()
+        self.rows: List[List[str]] = []
+        self._cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self.rows.append([])
+        elif tag in ("td", "th"):
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._cell is not None:
+            if not self.rows:
+                self.rows.append([])
+            self.rows[-1].append(" ".join("".join(self._cell).split()).replace("|", "/"))
+            self._cell = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def _html_table_rows(html: str) -> List[List[str]]:
+    parser = _TableRowParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        return []
+    return [row for row in parser.rows if any(row)]
+
+
+@dataclass
+class ParsedDocument:
+    """Output of the parse + chunk stage; image payloads are already on disk."""
+    chunks: List[DocumentChunk]
+    images: List[Dict]
+    summary: Dict
+    element_count: int
+    tables: Dict = field(default_factory=dict)  # kb_tables lookup tables found in the file
+
+
+def parse_document(
+    detector: ContentDetector,
+    chunker: HierarchicalChunker,
+    file_path: Path,
+    doc_id: str,
+    images_path: Path,
+) -> ParsedDocument:
+    """
+    Streaming parse -> classify -> chunk. Elements flow one at a time from the
+    detector into the chunker; images are written to images_path as they
+    arrive and their base64 payload dropped, so a document is never held as
+    one element list or one joined string.
+    """
+    summary = detector._new_summary()
+    images: List[Dict] = []
+    count = 0
+    
+    def elements() -> Iterator[ContentElement]:
+        nonlocal count
+        for i, el in enumerate(detector.iter_content(file_path, summary)):
+            count = i + 1
+            if el.element_type in ["image", "chart"] and el.base64_data:
+                img_id = f"{doc_id}_img_{i:04d}"  # Stable across runs (doc_id is content-addressed)
+                local_path = images_path / f"{img_id}.png"
+                try:
+                    local_path.write_bytes(base64.b64decode(el.base64_data))
+                    images.append({
+                        "image_id": img_id, "doc_id": doc_id,
+                        "filename": file_path.name, "caption": el.content,
+                        "local_path": str(local_path),
+                        "is_chart": el.metadata.get("is_chart", False)
+                    })
+                except Exception as e:
+                    logger.warning(f"Failed to save image: {e}")
+                el.base64_data = None
+            yield el
+    
+    chunks = list(chunker.iter_chunks(elements(), doc_id, file_path.name))
+    return ParsedDocument(chunks=chunks, images=images, summary=summary, element_count=count,
+                          tables=extract_tables(file_path))
 
 
 class KnowledgeBaseParser:
@@ -204,109 +366,393 @@ class KnowledgeBaseParser:
     Manages Ingestion and Indexing (Heavy).
     """
     
-    def __init__(self, data_dir: str = "kb_data", store_dir: str = "kb_store"):
+    def __init__(
+        self,
+        data_dir: str = "kb_data",
+        store_dir: str = "kb_store",
+        ann: Optional[str] = None,
+        ann_min_chunks: Optional[int] = None,
+        embed_concurrency: Optional[int] = None,
+        embed_cache_path: Optional[str] = None,
+    ):
         self.base_path = Path(__file__).parent
         self.data_path = self.base_path / data_dir
         self.store_path = self.base_path / store_dir
         self.parents_path = self.store_path / "parents"
         self.images_path = self.store_path / "images"
         
-        for path in [self.data_path, self.store_path, self.parents_path, self.images_path]:
+        for path in [self.data_path, self.store_path, self.images_path]:
             path.mkdir(parents=True, exist_ok=True)
         
+        # Content-addressed embedding cache: unchanged chunk text is never re-embedded
+        # (relative to store_dir; "off" disables)
+        embed_cache_path = embed_cache_path or os.getenv("KB_EMBED_CACHE_PATH", "embedding_cache.sqlite")
+        self.embed_cache = (
+            ContentEmbeddingCache(self.store_path / embed_cache_path) if embed_cache_path != "off" else None
+        )
+        
         self.detector = ContentDetector()
         self.chunker = HierarchicalChunker()
-        self.search_engine = HybridSearchEngine()
+        self.search_engine = HybridSearchEngine(content_cache=self.embed_cache)
+        self.store = IndexStore(self.store_path)
         
-        self.index = {"documents": {}, "chunks": {}, "images": {}, "embeddings": {}}
+        # Embedding requests in flight during pipelined ingest (ingest.py --workers N)
+        self.embed_concurrency = embed_concurrency or int(os.getenv("KB_EMBED_CONCURRENCY", "4"))
+        
+        # ANN for the chunk matrix: "auto" builds IVF above ann_min_chunks, "ivf" always, "off" never
+        self.ann_mode = ann or os.getenv("KB_ANN", "auto")
+        if self.ann_mode not in ANN_MODES:
+            # Checked here, not at save time, so a typo never costs a full parse + embed
+            raise ValueError(f"Unknown ANN mode '{self.ann_mode}', expected one of {ANN_MODES}")
+        self.ann_min_chunks = (
+            ann_min_chunks if ann_min_chunks is not None
+            else int(os.getenv("KB_ANN_MIN_CHUNKS", str(ANN_MIN_CHUNKS)))
+        )
+        
+        # index["embeddings"] holds only vectors added since load; the rest live in
+        # search_engine.dense_index and are carried over by apply_delta on save
+        self.index = {"documents": {}, "chunks": {}, "images": {}, "embeddings": {}, "files": {},
+                      "tables": {}, "pending": {"chunks": [], "images": []}}
+        self._removed_chunk_ids: Set[str] = set()
+        self._added_chunk_ids: List[str] = []
+        self._parents: Optional[ParentStore] = None
+        self.last_run: Dict[str, int] = {}
         self._load_index()
     
     def _load_index(self):
-        path = self.store_path / "index.json"
-        if path.exists():
-            try:
-                with open(path, 'r') as f: self.index = json.load(f)
-                chunks = [DocumentChunk(**c) for c in self.index.get("chunks", {}).values()]
-                self.search_engine.build_bm25_index(chunks)
-            except Exception as e: logger.error(f"Load failed: {e}")
+        try:
+            stored = self.store.load()
+            if stored:
+                self.index = stored.to_index_dict()
+                self.index["embeddings"] = {}
+                self._parents = stored.parents
+                self.search_engine.dense_index = DenseIndex(stored.chunk_ids, stored.chunk_matrix)
+                if stored.sparse:
+                    self.search_engine.sparse_index = stored.sparse
+                else:
+                    self.search_engine.build_bm25_index(self._all_chunks())
+        except Exception as e: logger.error(f"Load failed: {e}")
             
     def _save_index(self):
-        with open(self.store_path / "index.json", 'w') as f:
-            json.dump(self.index, f, indent=2)
+        # Delta updates: drop removed chunks, append the ones ingested since load
+        engine = self.search_engine
+        engine.dense_index = engine.dense_index.apply_delta(self._removed_chunk_ids, self.index["embeddings"])
+        added = [cid for cid in self._added_chunk_ids if cid in self.index["chunks"]]
+        if engine.sparse_index is None:
+            engine.build_bm25_index(self._all_chunks())
+        else:
+            engine.sparse_index = engine.sparse_index.apply_delta(
+                self._removed_chunk_ids, added,
+                tokenize_many(self.index["chunks"][cid]["text"] for cid in added),
+            )
+        self.index["embeddings"] = {}
+        self._removed_chunk_ids, self._added_chunk_ids = set(), []
+        
+        # Local query-expansion vocabulary is rebuilt from the chunk texts on every save
+        synonyms = build_synonyms(self._chunk_text(cid, c) for cid, c in self.index["chunks"].items())
+        stored = StoredIndex.from_index_dict(
+            self.index, sparse=engine.sparse_index, synonyms=synonyms, dense=engine.dense_index,
+            parents=self._parents,
+        )
+        if should_build_ann(self.ann_mode, len(stored.chunk_ids), self.ann_min_chunks):
+            stored.build_ann()
+        self.store.save(stored)
+        
+        # New parent texts are in the blob now; drop them from memory
+        self._parents = stored.parents
+        for c in self.index["chunks"].values():
+            if c.get("is_parent"):
+                c["text"] = ""
+    
+    def _chunk_text(self, chunk_id: str, chunk: Dict) -> str:
+        """Chunk text; stored parents are read from the parent blob."""
+        if chunk.get("is_parent") and not chunk.get("text") and self._parents is not None:
+            data = self._parents.read_bytes(chunk_id)
+            return data.decode("utf-8") if data is not None else ""
+        return chunk.get("text", "")
+    
+    def _all_chunks(self) -> List[DocumentChunk]:
+        return [DocumentChunk(**dict(c, text=self._chunk_text(cid, c))) for cid, c in self.index["chunks"].items()]
+
+    @staticmethod
+    def _hash_file(file_path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
 
-    def _generate_doc_id(self, file_path: Path) -> str:
-        content = f"{file_path.name}_{file_path.stat().st_mtime}"
-        return hashlib.md5(content.encode()).hexdigest()[:12]
+    def _generate_doc_id(self, file_path: Path, content_hash: Optional[str] = None) -> str:
+        """Content-addressed: touching a file keeps its id, editing it changes it."""
+        return (content_hash or self._hash_file(file_path))[:16]
+    
+    def _remove_document(self, doc_id: str, keep_images: bool = False):
+        """Drop a document's chunks, embeddings, parent files and images."""
+        doc = self.index["documents"].pop(doc_id, None)
+        chunk_ids = set(doc.get("chunk_ids", [])) if doc else set()
+        chunk_ids.update(cid for cid, c in self.index["chunks"].items() if c.get("doc_id") == doc_id)
+        for cid in chunk_ids:
+            chunk = self.index["chunks"].pop(cid, None)
+            self.index["embeddings"].pop(cid, None)
+            if chunk and chunk.get("is_parent"):
+                # Format 3 stores only; blob spans are simply not carried into the next generation
+                (self.parents_path / f"{cid}.txt").unlink(missing_ok=True)
+        self._removed_chunk_ids.update(chunk_ids)
+        self.index.setdefault("tables", {}).pop(doc_id, None)
+        pending = self.index.setdefault("pending", {"chunks": [], "images": []})
+        pending["chunks"] = [cid for cid in pending["chunks"] if cid not in chunk_ids]
+        pending["images"] = [i for i in pending["images"] if not i.startswith(f"{doc_id}_img_")]
         
-    def ingest_all(self, force: bool = False) -> int:
-        processed = 0
-        for file_path in self.data_path.rglob("*"):
-            if file_path.is_file() and not file_path.name.startswith('.'):
-                try:
-                    self.ingest_document(file_path, force)
-                    processed += 1
-                except Exception as e: logger.error(f"Failed {file_path.name}: {e}")
+        for img_id in [i for i, img in self.index["images"].items() if img.get("doc_id") == doc_id]:
+            img = self.index["images"].pop(img_id)
+            if img.get("local_path") and not keep_images:
+                Path(img["local_path"]).unlink(missing_ok=True)
+        logger.info(f"Removed document {doc_id} ({len(chunk_ids)} chunks)")
+        
+    def ingest_all(self, force: bool = False, workers: int = 1) -> int:
+        """
+        Incremental ingest: files are matched by content hash, so only new or
+        edited files are parsed and embedded, and documents whose file changed
+        or disappeared are removed. An unchanged KB costs one hash per file.
+        With workers > 1, parsing runs in a process pool and overlaps with
+        embedding (see _ingest_pipelined).
+        """
+        started = time.perf_counter()
+        files = self.index.setdefault("files", {})
+        documents = self.index["documents"]
+        tables = self.index.setdefault("tables", {})
+        current: Dict[str, Dict] = {}
+        to_ingest: List[Tuple[Path, str]] = []
+        untabled: Dict[str, Path] = {}
+        queued: Set[str] = set()
+        
+        for file_path in sorted(self.data_path.rglob("*")):
+            if not file_path.is_file() or file_path.name.startswith('.'):
+                continue
+            rel = file_path.relative_to(self.data_path).as_posix()
+            try:
+                content_hash = self._hash_file(file_path)
+            except OSError as e:
+                logger.error(f"Failed {file_path.name}: {e}")
+                continue
+            doc_id = self._generate_doc_id(file_path, content_hash)
+            current[rel] = {"sha256": content_hash, "doc_id": doc_id}
+            # Identical content under several paths is ingested once
+            if (force or doc_id not in documents) and doc_id not in queued:
+                to_ingest.append((file_path, doc_id))
+                queued.add(doc_id)
+            elif doc_id in documents and tables.get(doc_id, {}).get("version") != TABLES_VERSION:
+                # Ingested before lookup tables existed, or with an older extractor:
+                # extract them without re-embedding
+                untabled[doc_id] = file_path
+        
+        # Stale: documents no current file points at (edited, deleted, or legacy mtime ids)
+        live_ids = {entry["doc_id"] for entry in current.values()}
+        stale = [doc_id for doc_id in documents if doc_id not in live_ids]
+        pending = self.index.setdefault("pending", {"chunks": [], "images": []})
+        for doc_id, file_path in untabled.items():
+            tables[doc_id] = extract_tables(file_path)
+        if (not stale and not to_ingest and not untabled and current == files
+                and not pending["chunks"] and not pending["images"]):
+            self.last_run = {"ingested": 0, "removed": 0, "unchanged": len(current), "chunks": 0,
+                             "seconds": time.perf_counter() - started}
+            logger.info(f"No changes in {len(current)} files; index left as-is")
+            return 0
+        
+        for doc_id in stale:
+            self._remove_document(doc_id)
+        
+        failed, embed_stats = asyncio.run(self._ingest_pipelined(to_ingest, force, workers))
         
-        chunks = [DocumentChunk(**c) for c in self.index.get("chunks", {}).values()]
-        self.search_engine.build_bm25_index(chunks)
+        # Failed files stay out of the manifest so the next run retries them
+        self.index["files"] = {rel: entry for rel, entry in current.items() if entry["doc_id"] not in failed}
+        processed = len(to_ingest) - len(failed)
+        chunks_added = len(self._added_chunk_ids)
         self._save_index()
+        self.last_run = {
+            "ingested": processed, "removed": len(stale), "unchanged": len(current) - len(to_ingest),
+            "chunks": chunks_added, "seconds": time.perf_counter() - started,
+            "embedding_requests": embed_stats["requests"],
+            "cached_embeddings": embed_stats["cached"],
+            "pending_embeddings": len(pending["chunks"]) + len(pending["images"]),
+        }
         return processed
 
-    def ingest_document(self, file_path: Path, force: bool = False):
-        doc_id = self._generate_doc_id(file_path)
-        if not force and doc_id in self.index.get("documents", {}):
+    def ingest_document(self, file_path: Path, force: bool = False, doc_id: Optional[str] = None):
+        doc_id = doc_id or self._generate_doc_id(file_path)
+        if doc_id in self.index.get("documents", {}) and not force:
             return
             
         logger.info(f"Ingesting: {file_path.name}")
-        elements, summary = self.detector.detect_content(file_path)
-        chunks = self.chunker.create_chunks(elements, doc_id, file_path.name)
-        
-        # Embed children
-        child_chunks = [c for c in chunks if not c.is_parent]
-        if child_chunks:
-            embeddings = self.search_engine.embed_batch([c.text for c in child_chunks])
-            for c, emb in zip(child_chunks, embeddings):
+        parsed = parse_document(self.detector, self.chunker, file_path, doc_id, self.images_path)
+        texts = self._embedding_texts(parsed)
+        embeddings = self.search_engine.embed_batch(texts) if texts else []
+        self._write_document(file_path, doc_id, parsed, embeddings)
+
+    async def _ingest_pipelined(
+        self, jobs: List[Tuple[Path, str]], force: bool, workers: int
+    ) -> Tuple[Set[str], Dict[str, int]]:
+        """
+        parse + chunk (process pool, or a thread for workers=1) -> embed (EmbeddingPool)
+        -> single writer. At most 2 * workers parsed documents wait for embedding,
+        which bounds memory. Returns the doc_ids that failed and embedding stats.
+        """
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(2 * workers)
+        written: asyncio.Queue = asyncio.Queue()
+        failed: Set[str] = set()
+        executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        
+        async def parse(file_path: Path, doc_id: str) -> ParsedDocument:
+            if executor is None:
+                return await loop.run_in_executor(
+                    None, parse_document, self.detector, self.chunker, file_path, doc_id, self.images_path
+                )
+            return await loop.run_in_executor(
+                executor, _parse_in_worker, self.detector, self.chunker, str(file_path), doc_id, str(self.images_path)
+            )
+        
+        async def process(file_path: Path, doc_id: str):
+            async with in_flight:
+                try:
+                    logger.info(f"Ingesting: {file_path.name}")
+                    parsed = await parse(file_path, doc_id)
+                    texts = self._embedding_texts(parsed)
+                    embeddings = await pool.embed(texts) if texts else []
+                    await written.put((file_path, doc_id, parsed, embeddings))
+                except Exception as e:
+                    logger.error(f"Failed {file_path.name}: {e}")
+                    failed.add(doc_id)
+                    self._discard_images(doc_id)
+        
+        async def writer():
+            # The only place that mutates self.index
+            while True:
+                item = await written.get()
+                if item is None:
+                    return
+                file_path, doc_id = item[0], item[1]
+                try:
+                    self._write_document(*item)
+                except Exception as e:
+                    logger.error(f"Failed {file_path.name}: {e}")
+                    failed.add(doc_id)
+        
+        # Dedicated client: this event loop only lives for one ingest_all()
+        async with openai.AsyncOpenAI() as client:
+            pool = EmbeddingPool(max_concurrency=self.embed_concurrency, client=client, cache=self.embed_cache)
+            try:
+                await self._embed_pending(pool)
+                writer_task = asyncio.create_task(writer())
+                await asyncio.gather(*(process(path, doc_id) for path, doc_id in jobs))
+                await written.put(None)
+                await writer_task
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+        logger.info(f"Ingest embeddings: {pool.stats()}")
+        return failed, pool.stats()
+
+    def _discard_images(self, doc_id: str):
+        """Delete image files a failed parse wrote, unless an indexed version owns them."""
+        if doc_id in self.index["documents"]:
+            return
+        for path in self.images_path.glob(f"{doc_id}_img_*.png"):
+            path.unlink(missing_ok=True)
+
+    async def _embed_pending(self, pool: EmbeddingPool):
+        """Retry chunks / image captions whose embedding failed on an earlier run."""
+        pending = self.index["pending"]
+        chunk_ids = [cid for cid in pending["chunks"] if cid in self.index["chunks"]]
+        image_ids = [img_id for img_id in pending["images"] if img_id in self.index["images"]]
+        if not chunk_ids and not image_ids:
+            pending["chunks"], pending["images"] = [], []
+            return
+        
+        logger.info(f"Re-embedding {len(chunk_ids)} chunks and {len(image_ids)} captions from earlier failures")
+        texts = [self.index["chunks"][cid]["text"] for cid in chunk_ids]
+        texts += [self.index["images"][img_id]["caption"] for img_id in image_ids]
+        embeddings = await pool.embed(texts)
+        
+        pending["chunks"], pending["images"] = [], []
+        for cid, emb in zip(chunk_ids, embeddings[:len(chunk_ids)]):
+            if emb is None:
+                pending["chunks"].append(cid)
+            else:
+                self.index["embeddings"][cid] = emb
+        for img_id, emb in zip(image_ids, embeddings[len(chunk_ids):]):
+            if emb is None:
+                pending["images"].append(img_id)
+            else:
+                self.index["images"][img_id]["embedding"] = emb
+
+    @staticmethod
+    def _embedding_texts(parsed: ParsedDocument) -> List[str]:
+        """Child chunk texts, then image captions, in the order _write_document consumes them."""
+        texts = [c.text for c in parsed.chunks if not c.is_parent]
+        texts += [img["caption"] for img in parsed.images if img["caption"]]
+        return texts
+
+    def _write_document(
+        self,
+        file_path: Path,
+        doc_id: str,
+        parsed: ParsedDocument,
+        embeddings: List[Optional[List[float]]],
+    ):
+        """
+        Store one parsed + embedded document in the index (image files were
+        written by parse_document; parent texts reach the blob on save).
+        Texts whose embedding failed (None) are recorded in index["pending"]
+        and retried on the next ingest instead of being stored as zero vectors.
+        """
+        if doc_id in self.index["documents"]:
+            # Forced re-ingest: same content-addressed ids, so keep the freshly written images
+            self._remove_document(doc_id, keep_images=True)
+        
+        embeddings = iter(embeddings)
+        pending = self.index.setdefault("pending", {"chunks": [], "images": []})
+        chunks = parsed.chunks
+        
+        # Child embeddings
+        for c in chunks:
+            if not c.is_parent:
+                emb = next(embeddings)
+                if emb is None:
+                    pending["chunks"].append(c.chunk_id)
+                    continue
                 c.embedding = emb
                 self.index["embeddings"][c.chunk_id] = emb
         
-        # Store chunks
+        # Store chunks (parent texts go to the parent blob on save)
         for c in chunks:
-            self.index["chunks"][c.chunk_id] = c.__dict__
-            if c.is_parent:
-                (self.parents_path / f"{c.chunk_id}.txt").write_text(c.text, encoding='utf-8')
+            self.index["chunks"][c.chunk_id] = {k: v for k, v in c.__dict__.items() if k != "embedding"}
+            self._added_chunk_ids.append(c.chunk_id)
         
         # Store Doc Meta
+        summary = parsed.summary
         doc_meta = DocumentMeta(
-            doc_id=doc_id, filename=file_path.name, summary=f"Parsed {len(elements)} elements",
+            doc_id=doc_id, filename=file_path.name, summary=f"Parsed {parsed.element_count} elements",
             has_text=summary["has_text"], has_images=summary["has_images"],
             chunk_ids=[c.chunk_id for c in chunks]
         )
         self.index["documents"][doc_id] = doc_meta.__dict__
+        self.index.setdefault("tables", {})[doc_id] = parsed.tables
         
-        # Save images
-        for el in elements:
-            if (el.element_type in ["image", "chart"]) and el.base64_data:
-                img_id = f"{doc_id}_img_{hash(el.content or 'img')}"  # Simple hash
-                # Decode and save to file
-                try:
-                    img_bytes = base64.b64decode(el.base64_data)
-                    local_path = self.images_path / f"{img_id}.png"
-                    with open(local_path, "wb") as f:
-                        f.write(img_bytes)
-                    
-                    # Embed caption if exists
-                    emb = []
-                    if el.content:
-                        emb = self.search_engine.embed_text(el.content)
-
-                    self.index["images"][img_id] = {
-                        "image_id": img_id, "doc_id": doc_id,
-                        "filename": file_path.name, "caption": el.content,
-                        "embedding": emb, "local_path": str(local_path),
-                        "is_chart": el.metadata.get("is_chart", False)
-                    }
-                except Exception as e:
-                    logger.warning(f"Failed to save image: {e}")
+        # Image records; caption embeddings were computed with the chunks
+        for img in parsed.images:
+            emb = next(embeddings) if img["caption"] else []
+            if emb is None:
+                pending["images"].append(img["image_id"])
+                emb = []
+            self.index["images"][img["image_id"]] = {**img, "embedding": emb}
+
+
+def _parse_in_worker(
+    detector: ContentDetector, chunker: HierarchicalChunker, file_path: str, doc_id: str, images_path: str
+) -> ParsedDocument:
+    """Process-pool entry point (only chunk text and image records cross the process boundary)."""
+    return parse_document(detector, chunker, Path(file_path), doc_id, Path(images_path))
 
 # Instantiate singleton
 kb_parser = KnowledgeBaseParser()
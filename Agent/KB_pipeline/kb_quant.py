@@ -0,0 +1,105 @@
+"""
+KB Quantization
+===============
+Compact codes for the first-pass dense scan.
+
+- "int8":   per-dimension symmetric scalar quantization, 1 byte/dim (4x smaller)
+- "binary": sign bits packed 8 per byte, scored by Hamming distance (32x smaller)
+
+DenseIndex scans the codes, keeps a candidate set several times top_k, and
+re-scores only those rows against the float32 matrix. The matrix stays
+mmapped, so just the candidate rows are paged in.
+"""
+
+import numpy as np
+from typing import Dict
+
+QUANTIZATION_MODES = ("none", "int8", "binary")
+
+# Rows per scan block; small enough that the int8 -> float32 buffer stays in cache
+_BLOCK_ROWS = 2048
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:  # numpy < 2.0
+    _POPCOUNT_LUT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(bits: np.ndarray) -> np.ndarray:
+        return _POPCOUNT_LUT[bits]
+
+
+class Int8Codes:
+    """int8 codes with a per-dimension scale: x ~= codes * scale."""
+    mode = "int8"
+
+    def __init__(self, codes: np.ndarray, scale: np.ndarray):
+        self.codes = codes
+        self.scale = scale
+
+    @classmethod
+    def encode(cls, matrix: np.ndarray) -> "Int8Codes":
+        scale = (np.abs(matrix).max(axis=0) / 127.0).astype(np.float32) if len(matrix) else np.ones(matrix.shape[1], dtype=np.float32)
+        scale[scale == 0] = 1.0
+        codes = np.clip(np.rint(matrix / scale), -127, 127).astype(np.int8)
+        return cls(codes, scale)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scale.nbytes
+
+    def scores(self, query_vec: np.ndarray) -> np.ndarray:
+        """Approximate dot products with a normalized query."""
+        scaled = (query_vec * self.scale).astype(np.float32)
+        out = np.empty(len(self.codes), dtype=np.float32)
+        buffer = np.empty((min(_BLOCK_ROWS, len(self.codes)), self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.codes), _BLOCK_ROWS):
+            block = self.codes[start:start + _BLOCK_ROWS]
+            rows = buffer[:len(block)]
+            np.copyto(rows, block, casting="unsafe")
+            np.matmul(rows, scaled, out=out[start:start + len(block)])
+        return out
+
+    def scores_many(self, query_matrix: np.ndarray) -> np.ndarray:
+        """scores() for (q, D) normalized queries -> (q, N); each block is converted once for all of them."""
+        scaled = (query_matrix * self.scale).astype(np.float32)
+        out = np.empty((len(query_matrix), len(self.codes)), dtype=np.float32)
+        buffer = np.empty((min(_BLOCK_ROWS, len(self.codes)), self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.codes), _BLOCK_ROWS):
+            block = self.codes[start:start + _BLOCK_ROWS]
+            rows = buffer[:len(block)]
+            np.copyto(rows, block, casting="unsafe")
+            out[:, start:start + len(block)] = scaled @ rows.T
+        return out
+
+
+class BinaryCodes:
+    """Sign bits, 8 dims per byte. Score = dims - 2 * Hamming distance."""
+    mode = "binary"
+
+    def __init__(self, bits: np.ndarray, dim: int):
+        self.bits = bits
+        self.dim = dim
+
+    @classmethod
+    def encode(cls, matrix: np.ndarray) -> "BinaryCodes":
+        return cls(np.packbits(matrix > 0, axis=1), matrix.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def scores(self, query_vec: np.ndarray) -> np.ndarray:
+        query_bits = np.packbits(query_vec > 0)
+        out = np.empty(len(self.bits), dtype=np.float32)
+        for start in range(0, len(self.bits), _BLOCK_ROWS):
+            block = self.bits[start:start + _BLOCK_ROWS]
+            hamming = _popcount(block ^ query_bits).sum(axis=1, dtype=np.int32)
+            out[start:start + len(block)] = self.dim - 2 * hamming
+        return out
+
+
+def encode_all(matrix: np.ndarray) -> Dict[str, object]:
+    """Both code sets for a pre-normalized matrix (written with every store generation)."""
+    if matrix.ndim != 2 or not matrix.shape[1]:
+        return {}
+    return {"int8": Int8Codes.encode(matrix), "binary": BinaryCodes.encode(matrix)}
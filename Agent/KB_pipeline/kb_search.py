@@ -5,20 +5,94 @@ Lightweight Knowledge Base Searcher.
 Does NOT include parsing dependencies (unstructured, pymupdf).
 """
 
+import asyncio
+import gc
 import logging
-import json
-import openai
+import os
+import threading
+import time
+import numpy as np
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional, Tuple
 
 # Import common components
 try:
-    from .kb_common import HybridSearchEngine, DocumentChunk, QueryResult
+    from .kb_common import HybridSearchEngine, DenseIndex, QueryResult, SparseIndex
+    from .kb_index import IndexStore, process_memory
+    from .kb_cache import EmbeddingCache, SemanticResultCache
+    from .kb_expand import make_expander
+    from .kb_quant import QUANTIZATION_MODES
+    from .kb_parents import PARENT_CACHE_SIZE, ParentStore
+    from .kb_tokenize import tokenize_many
+    from .kb_tables import LookupTables
 except ImportError:
-    from kb_common import HybridSearchEngine, DocumentChunk, QueryResult
+    from kb_common import HybridSearchEngine, DenseIndex, QueryResult, SparseIndex
+    from kb_index import IndexStore, process_memory
+    from kb_cache import EmbeddingCache, SemanticResultCache
+    from kb_expand import make_expander
+    from kb_quant import QUANTIZATION_MODES
+    from kb_parents import PARENT_CACHE_SIZE, ParentStore
+    from kb_tokenize import tokenize_many
+    from kb_tables import LookupTables
 
 logger = logging.getLogger("kb-searcher")
 
+
+@dataclass
+class IndexSnapshot:
+    """
+    Everything a query reads from one index generation.
+
+    Snapshots are never mutated: a reload builds a new one and swaps the
+    searcher's reference, and a query keeps the snapshot it started with.
+    """
+    generation: int = 0
+    index: Dict[str, Dict] = field(default_factory=lambda: {"documents": {}, "chunks": {}, "images": {}})
+    synonyms: Dict[str, List[str]] = field(default_factory=dict)
+    expander: Any = None
+    parents: Optional[ParentStore] = None
+    sparse_index: Optional[SparseIndex] = None
+    dense_index: DenseIndex = field(default_factory=lambda: DenseIndex.from_embeddings({}))
+    image_index: DenseIndex = field(default_factory=lambda: DenseIndex.from_embeddings({}))
+    tables: LookupTables = field(default_factory=LookupTables)
+
+
+# Nesting state for _collector_paused; searchers on several threads can reload at once
+_gc_pause_lock = threading.Lock()
+_gc_pauses = 0
+_gc_was_enabled = False
+
+
+@contextmanager
+def _collector_paused():
+    """
+    Build a snapshot without cyclic-GC passes.
+
+    A snapshot is a few hundred thousand long-lived, acyclic objects. Left to
+    the collector, allocating them triggers full collections that hold the
+    GIL for tens of ms, a stall for lookups running alongside a reload.
+
+    gc.disable() is process-wide: while any reload is building, no thread
+    (including the agent's event loop) runs cyclic collection. Pauses nest
+    across threads; the collector is re-enabled when the last one ends, and
+    only if it was enabled when the first one began.
+    """
+    global _gc_pauses, _gc_was_enabled
+    with _gc_pause_lock:
+        if _gc_pauses == 0:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pauses += 1
+    try:
+        yield
+    finally:
+        with _gc_pause_lock:
+            _gc_pauses -= 1
+            if _gc_pauses == 0 and _gc_was_enabled:
+                gc.enable()
+
 class KnowledgeBaseSearcher:
     """
     Manages Knowledge Base Retrieval (Search Only).
@@ -28,6 +102,21 @@ class KnowledgeBaseSearcher:
         self,
         data_dir: str = "kb_data",
         store_dir: str = "kb_store",
+        query_cache_size: int = 2048,
+        query_cache_ttl: Optional[float] = 24 * 3600,
+        query_cache_path: Optional[str] = None,
+        result_cache_threshold: Optional[float] = None,
+        result_cache_size: int = 256,
+        result_cache_ttl: Optional[float] = 3600,
+        expansion: Optional[str] = None,
+        speculative_expansion: Optional[bool] = None,
+        expansion_timeout_ms: Optional[float] = None,
+        ann: Optional[str] = None,
+        ann_nprobe: Optional[int] = None,
+        quantization: Optional[str] = None,
+        quantization_rescore: Optional[int] = None,
+        parent_cache_size: Optional[int] = None,
+        reload_interval: Optional[float] = None,
     ):
         self.base_path = Path(__file__).parent
         self.data_path = self.base_path / data_dir
@@ -35,117 +124,325 @@ class KnowledgeBaseSearcher:
         self.parents_path = self.store_path / "parents"
         self.images_path = self.store_path / "images"
         
+        # Query embedding cache (optionally persisted so warm restarts keep it)
+        query_cache_path = query_cache_path or os.getenv("KB_QUERY_CACHE_PATH")
+        self.embedding_cache = EmbeddingCache(
+            max_entries=query_cache_size,
+            ttl_seconds=query_cache_ttl,
+            path=self.store_path / query_cache_path if query_cache_path else None,
+        )
+        
+        # Semantic result cache (cosine threshold on the query embedding, per index generation)
+        self.result_cache = SemanticResultCache(
+            threshold=(
+                result_cache_threshold if result_cache_threshold is not None
+                else float(os.getenv("KB_RESULT_CACHE_THRESHOLD", "0.95"))
+            ),
+            max_entries=result_cache_size,
+            ttl_seconds=result_cache_ttl,
+        )
+        
+        # Query expansion: "llm" | "local" | "off"; speculative runs LLM expansion
+        # alongside the unexpanded search and only uses it if it returns in time
+        self.expansion_mode = expansion or os.getenv("KB_QUERY_EXPANSION", "llm")
+        self.speculative_expansion = (
+            speculative_expansion if speculative_expansion is not None
+            else os.getenv("KB_SPECULATIVE_EXPANSION", "").lower() in ("1", "true", "yes")
+        )
+        self.expansion_timeout_ms = (
+            expansion_timeout_ms if expansion_timeout_ms is not None
+            else float(os.getenv("KB_EXPANSION_TIMEOUT_MS", "350"))
+        )
+        
+        # ANN: use the store's IVF index when present unless "off"; nprobe trades recall for latency
+        self.ann_mode = ann or os.getenv("KB_ANN", "auto")
+        self.ann_nprobe = ann_nprobe or int(os.getenv("KB_ANN_NPROBE", "0")) or None
+        
+        # Quantized first-pass scan ("int8" 4x / "binary" 32x smaller), float32 rescoring
+        # of quantization_rescore * top_k candidates. Used for the full scan, not with IVF.
+        self.quantization = quantization or os.getenv("KB_DENSE_QUANTIZATION", "none")
+        if self.quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown dense quantization '{self.quantization}', expected one of {QUANTIZATION_MODES}")
+        self.quantization_rescore = quantization_rescore or int(os.getenv("KB_QUANT_RESCORE", "10"))
+        
         # Initialize Engine
-        self.search_engine = HybridSearchEngine()
-        
-        # Index data
-        self.index = {
-            "documents": {},
-            "chunks": {},
-            "images": {},
-            "embeddings": {},
-        }
+        self.search_engine = HybridSearchEngine(embedding_cache=self.embedding_cache)
+        # Parent texts: mmapped blob + LRU of decoded hot parents
+        self.parent_cache_size = parent_cache_size or int(os.getenv("KB_PARENT_CACHE_SIZE", str(PARENT_CACHE_SIZE)))
+        self.store = IndexStore(self.store_path, parent_cache_size=self.parent_cache_size)
+        
+        # Index data (embeddings live in the dense matrices, not here)
+        self.snapshot = IndexSnapshot(expander=make_expander(self.expansion_mode, {}))
+        self._reload_lock = threading.Lock()
         
         # Load existing index
         self._load_index()
+        
+        # Hot reload: poll the manifest generation and swap in new snapshots (0 = off)
+        self.reload_interval = (
+            reload_interval if reload_interval is not None
+            else float(os.getenv("KB_RELOAD_INTERVAL", "5"))
+        )
+        self.reloads = 0
+        self.last_reload_ms = 0.0
+        self._stop_watching = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        if self.reload_interval > 0:
+            self._watcher = threading.Thread(target=self._watch, name="kb-index-watcher", daemon=True)
+            self._watcher.start()
+    
+    # Read-only views of the current snapshot
+    @property
+    def index(self) -> Dict[str, Dict]:
+        return self.snapshot.index
+    
+    @property
+    def generation(self) -> int:
+        return self.snapshot.generation
+    
+    @property
+    def parents(self) -> Optional[ParentStore]:
+        return self.snapshot.parents
+    
+    @property
+    def synonyms(self) -> Dict[str, List[str]]:
+        return self.snapshot.synonyms
+    
+    @property
+    def expander(self):
+        return self.snapshot.expander
+    
+    @property
+    def image_index(self) -> DenseIndex:
+        return self.snapshot.image_index
+    
+    @property
+    def tables(self) -> LookupTables:
+        return self.snapshot.tables
     
     def _load_index(self):
         """Load index from disk."""
-        index_path = self.store_path / "index.json"
-        if index_path.exists():
+        with self._reload_lock, _collector_paused():
+            snapshot = self._load_snapshot()
+        if snapshot is not None:
+            self._swap(snapshot)
+    
+    def _load_snapshot(self) -> Optional[IndexSnapshot]:
+        """Build the search structures for the store's current generation (None if unavailable)."""
+        try:
+            # mmap: job processes on one host share the embedding pages
+            stored = self.store.load(mmap=True)
+        except Exception as e:
+            logger.error(f"Failed to load index: {e}")
+            return None
+        
+        if stored is None:
+            logger.warning(f"Index not found in {self.store_path}")
+            return None
+        
+        # BM25: use the persisted (mmapped) postings, rebuild only for older stores
+        sparse = stored.sparse
+        if not sparse:
+            sparse = SparseIndex.build(
+                list(stored.chunks),
+                tokenize_many(stored.chunk_text(cid) for cid in stored.chunks),
+            )
+        
+        # Dense matrices are stored pre-normalized; wrap the maps without copying
+        ann = stored.ann if self.ann_mode != "off" else None
+        if ann is not None and self.ann_nprobe:
+            ann.nprobe = min(self.ann_nprobe, ann.nlist)
+        codes = stored.codes.get(self.quantization)
+        if self.quantization != "none" and codes is None:
+            logger.warning(f"Store has no {self.quantization} codes (re-run ingest); using float32 scan")
+        
+        return IndexSnapshot(
+            generation=stored.generation,
+            index={
+                "documents": stored.documents,
+                "chunks": stored.chunks,
+                "images": stored.images,
+            },
+            synonyms=stored.synonyms,
+            expander=make_expander(self.expansion_mode, stored.synonyms),
+            parents=stored.parents,
+            sparse_index=sparse,
+            dense_index=DenseIndex(
+                stored.chunk_ids, stored.chunk_matrix, ann=ann,
+                codes=codes, rescore=self.quantization_rescore,
+            ),
+            image_index=DenseIndex(stored.image_ids, stored.image_matrix),
+            tables=LookupTables.from_stored(stored.tables, stored.documents),
+        )
+    
+    def _swap(self, snapshot: IndexSnapshot):
+        """Make `snapshot` current; queries already running keep the old one."""
+        previous = self.snapshot
+        if previous.parents is not None and snapshot.parents is not None:
+            snapshot.parents.adopt_cache(previous.parents)
+        self.snapshot = snapshot
+        self.search_engine.sparse_index = snapshot.sparse_index
+        self.search_engine.dense_index = snapshot.dense_index
+        self.result_cache.invalidate(snapshot.generation)
+        logger.info(f"Loaded index generation {snapshot.generation} with {len(snapshot.index['documents'])} documents")
+    
+    def reload(self) -> bool:
+        """
+        Swap in the store's current generation if it is newer than the one
+        being served. Returns True if a new snapshot was swapped in.
+        """
+        with self._reload_lock:
+            try:
+                generation = self.store.current_generation()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read index manifest: {e}")
+                return False
+            if generation <= self.snapshot.generation:
+                return False
+            start = time.perf_counter()
+            with _collector_paused():
+                snapshot = self._load_snapshot()
+            if snapshot is None:
+                return False
+            self._warm(snapshot)
+            self._swap(snapshot)
+            self.reloads += 1
+            self.last_reload_ms = (time.perf_counter() - start) * 1000
+            logger.info(f"Hot-reloaded index generation {generation} in {self.last_reload_ms:.0f} ms")
+            return True
+    
+    @staticmethod
+    def _warm(snapshot: IndexSnapshot):
+        """Fault in the new maps off the query path so the first query after the swap is not slower."""
+        dense = snapshot.dense_index
+        if len(dense) and dense.matrix.ndim == 2:
+            dense.search(np.ones(dense.matrix.shape[1], dtype=np.float32), 1)
+        if snapshot.sparse_index:
+            snapshot.sparse_index.search(["warm"], 1)
+    
+    def _watch(self):
+        while not self._stop_watching.wait(self.reload_interval):
             try:
-                with open(index_path, 'r') as f:
-                    self.index = json.load(f)
-                logger.info(f"Loaded index with {len(self.index.get('documents', []))} documents")
-                
-                # Rebuild BM25 index
-                chunks = [DocumentChunk(**c) for c in self.index.get("chunks", {}).values()]
-                self.search_engine.build_bm25_index(chunks)
-                
+                self.reload()
             except Exception as e:
-                logger.error(f"Failed to load index: {e}")
-        else:
-            logger.warning(f"Index not found at {index_path}")
+                logger.error(f"Index reload failed: {e}")
+    
+    def close(self):
+        """Stop the reload watcher."""
+        self._stop_watching.set()
     
+    def memory_stats(self) -> Dict[str, int]:
+        """Process RSS / shared pages (KiB), plus the share backed by the index maps."""
+        return process_memory(self.store.index_dir)
+
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Hit/miss counters for the query-path caches."""
+        stats = {
+            "embeddings": self.embedding_cache.stats(),
+            "results": self.result_cache.stats(),
+        }
+        if self.parents is not None:
+            stats["parents"] = self.parents.stats()
+        return stats
+
     def get_stats(self) -> Dict:
         """Get knowledge base statistics."""
+        snapshot = self.snapshot
         return {
-            "documents": len(self.index.get("documents", {})),
-            "chunks": len(self.index.get("chunks", {})),
-            "images": len(self.index.get("images", {})),
+            "generation": snapshot.generation,
+            "documents": len(snapshot.index.get("documents", {})),
+            "chunks": len(snapshot.index.get("chunks", {})),
+            "images": len(snapshot.index.get("images", {})),
+            "dense_search": "ivf" if snapshot.dense_index.ann is not None else "exact",
+            "quantization": snapshot.dense_index.codes.mode if snapshot.dense_index.codes is not None else "none",
+            "lookup_tables": snapshot.tables.stats(),
+            "reloads": self.reloads,
         }
 
-    async def _expand_query(self, query: str) -> List[str]:
+    async def _expand_query(self, query: str, snapshot: Optional[IndexSnapshot] = None) -> List[str]:
         """Generate variations of the query to improve search recall."""
-        try:
-            client = openai.OpenAI()
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a query expansion assistant. Generate 3 short, keyword-focused variations of the user's query to help find relevant information in a document database. Return only the 3 variations separated by newlines."},
-                    {"role": "user", "content": query}
-                ],
-                max_tokens=60,
-                temperature=0.5,
-            )
-            variations = response.choices[0].message.content.strip().split('\n')
-            return [v.strip() for v in variations if v.strip()]
-        except Exception as e:
-            logger.warning(f"Query expansion failed: {e}")
-            return []
+        return await (snapshot or self.snapshot).expander.expand(query)
 
-    async def query(self, text: str, top_k: int = 3, include_images: bool = True) -> QueryResult:
+    async def query(
+        self,
+        text: str,
+        top_k: int = 3,
+        include_images: bool = True,
+        deadline_ms: Optional[float] = None,
+    ) -> QueryResult:
         """Alias for retrieve()."""
-        return await self.retrieve(text, top_k, include_images)
+        return await self.retrieve(text, top_k, include_images, deadline_ms)
 
-    async def retrieve(self, text: str, top_k: int = 3, include_images: bool = True) -> QueryResult:
-        """
-        Retrieves relevant context (chunks + images) using Hybrid Search.
-        """
-        # 1. Expand Query
-        variations = await self._expand_query(text)
-        search_queries = [text] + variations
-        logger.info(f"Expanded query '{text}' to: {variations}")
-        
-        all_fused = []
-        
-        # 2. Hybrid Search...
-        for q in search_queries:
-            q_embedding = self.search_engine.embed_text(q)
-            dense_results = self.search_engine.search_dense(q_embedding, self.index.get("embeddings", {}), top_k * 2)
-            sparse_results = self.search_engine.search_sparse(q, top_k * 2)
-            fused = self.search_engine.rrf_fusion(dense_results, sparse_results)[:top_k]
-            all_fused.extend(fused)
-        
-        # Deduplicate
-        chunk_scores = {}
-        for chunk_id, score in all_fused:
-            chunk_scores[chunk_id] = max(chunk_scores.get(chunk_id, 0), score)
-        
-        final_results = sorted(chunk_scores.items(), key=lambda x: x[1], reverse=True)[:top_k+2]
-            
-        if not final_results:
-            return QueryResult(
-                text="No relevant information found in the knowledge base.",
-                sources=[]
-            )
-        
-        # 3. Build Context
+    def _hybrid_search(
+        self, query: str, query_embedding: List[float], top_k: int, snapshot: Optional[IndexSnapshot] = None
+    ) -> List[Tuple[str, float]]:
+        """Dense + sparse + RRF for one query variation (CPU-bound, runs in a worker thread)."""
+        snapshot = snapshot or self.snapshot
+        dense_results = self.search_engine.search_dense(query_embedding, top_k * 2, snapshot.dense_index)
+        sparse_results = self.search_engine.search_sparse(query, top_k * 2, snapshot.sparse_index)
+        return self.search_engine.rrf_fusion(dense_results, sparse_results)[:top_k]
+
+    def _sparse_search(
+        self, query: str, top_k: int, snapshot: Optional[IndexSnapshot] = None
+    ) -> List[Tuple[str, float]]:
+        """Sparse-only fallback when the query embedding missed the deadline."""
+        snapshot = snapshot or self.snapshot
+        sparse_results = self.search_engine.search_sparse(query, top_k * 2, snapshot.sparse_index)
+        return self.search_engine.rrf_fusion([], sparse_results)[:top_k]
+
+    async def _ahybrid_search(
+        self, query: str, query_embedding: List[float], top_k: int, snapshot: Optional[IndexSnapshot] = None
+    ) -> List[Tuple[str, float]]:
+        """_hybrid_search off the event loop; with dense batching the dense pass joins concurrent lookups."""
+        snapshot = snapshot or self.snapshot
+        if self.search_engine.dense_batcher is None:
+            return await asyncio.to_thread(self._hybrid_search, query, query_embedding, top_k, snapshot)
+        dense_results, sparse_results = await asyncio.gather(
+            self.search_engine.asearch_dense(query_embedding, top_k * 2, snapshot.dense_index),
+            asyncio.to_thread(self.search_engine.search_sparse, query, top_k * 2, snapshot.sparse_index),
+        )
+        return self.search_engine.rrf_fusion(dense_results, sparse_results)[:top_k]
+
+    async def _search_variations(
+        self, variations: List[str], top_k: int, snapshot: Optional[IndexSnapshot] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """One batched embeddings call for all variations, then concurrent scoring."""
+        embeddings = await self.search_engine.aembed_batch(variations)
+        return await asyncio.gather(*(
+            self._ahybrid_search(q, q_embedding, top_k, snapshot)
+            for q, q_embedding in zip(variations, embeddings)
+        ))
+
+    @staticmethod
+    async def _wait(task: asyncio.Future, timeout: Optional[float]) -> bool:
+        """Wait up to `timeout` seconds (None = forever); cancel and return False on expiry."""
+        done, _ = await asyncio.wait({task}, timeout=None if timeout is None else max(timeout, 0))
+        if not done:
+            task.cancel()
+        return bool(done)
+
+    def _build_context(
+        self, final_results: List[Tuple[str, float]], snapshot: Optional[IndexSnapshot] = None
+    ) -> Tuple[List[str], List[str]]:
+        """Fetch parent texts and format context blocks (file I/O only for format 3 stores)."""
+        snapshot = snapshot or self.snapshot
+        index, parents = snapshot.index, snapshot.parents
         context_parts = []
         sources = set()
         
         for chunk_id, score in final_results:
-            chunk_data = self.index["chunks"].get(chunk_id, {})
+            chunk_data = index["chunks"].get(chunk_id, {})
             parent_id = chunk_data.get("parent_id") or chunk_id
-            parent_file = self.parents_path / f"{parent_id}.txt"
-            
-            if parent_file.exists():
-                parent_text = parent_file.read_text(encoding='utf-8')
-            else:
-                parent_text = chunk_data.get("text", "")
+            parent_text = parents.get(parent_id) if parents is not None else None
+            if parent_text is None:
+                parent_file = self.parents_path / f"{parent_id}.txt"
+                if parent_file.exists():
+                    parent_text = parent_file.read_text(encoding='utf-8')
+                else:
+                    parent_text = chunk_data.get("text", "")
             
             doc_id = chunk_data.get("doc_id")
-            doc_meta = self.index.get("documents", {}).get(doc_id, {})
+            doc_meta = index.get("documents", {}).get(doc_id, {})
             summary = doc_meta.get("summary", "")
             filename = doc_meta.get("filename", "Unknown")
             page_nums = chunk_data.get("page_numbers", [])
@@ -164,29 +461,175 @@ class KnowledgeBaseSearcher:
             else:
                 sources.add(filename)
         
-        # 4. Get Images
-        image_paths = []
-        if include_images:
-            q_emb = self.search_engine.embed_text(text)
-            image_results = self.search_engine.search_dense(
-                q_emb,
-                {img["image_id"]: img["embedding"] for img in self.index.get("images", {}).values() if img.get("embedding")},
-                top_k=2
+        return context_parts, list(sources)
+
+    async def retrieve(
+        self,
+        text: str,
+        top_k: int = 3,
+        include_images: bool = True,
+        deadline_ms: Optional[float] = None,
+    ) -> QueryResult:
+        """
+        Retrieves relevant context (chunks + images) using Hybrid Search.
+        Network calls are awaited on the shared async client and CPU/disk work
+        runs in worker threads, so the agent's event loop is never blocked.
+        
+        With deadline_ms, whatever has been scored when the deadline hits is
+        fused and returned with partial=True instead of waiting for slow
+        embedding / expansion calls.
+        
+        The whole lookup reads one IndexSnapshot, so a hot reload that lands
+        mid-query cannot mix chunk ids from two generations.
+        """
+        snapshot = self.snapshot
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + deadline_ms / 1000 if deadline_ms else None
+        
+        def remaining() -> Optional[float]:
+            return None if deadline is None else deadline - loop.time()
+        
+        partial = False
+        
+        # 1. Embed the query. A repeated query's embedding is already cached, so the
+        # result cache is checked before any request is sent; otherwise expansion
+        # runs alongside the embeddings call and is cancelled on a cache hit.
+        expansion = None
+        text_embedding = self.search_engine.cached_embedding(text)
+        if text_embedding is None:
+            expansion = asyncio.create_task(self._expand_query(text, snapshot))
+            expansion_started = loop.time()
+            embedding_task = asyncio.create_task(self.search_engine.aembed_uncached(text))
+            text_embedding = embedding_task.result() if await self._wait(embedding_task, remaining()) else None
+        
+        # Semantic result cache: a near-identical earlier lookup answers immediately
+        cache_params = {"top_k": top_k, "include_images": include_images}
+        if text_embedding is not None:
+            cached = self.result_cache.get(text, text_embedding, snapshot.generation, **cache_params)
+            if cached is not None:
+                if expansion is not None:
+                    expansion.cancel()
+                logger.info(f"Result cache hit for '{text}'")
+                return cached
+        
+        if expansion is None:
+            expansion = asyncio.create_task(self._expand_query(text, snapshot))
+            expansion_started = loop.time()
+        
+        # The unexpanded search starts right away; variations join it when ready
+        if text_embedding is not None:
+            base_search = self._ahybrid_search(text, text_embedding, top_k, snapshot)
+        else:
+            logger.warning(f"Query embedding missed the {deadline_ms:.0f} ms deadline; using keyword search only")
+            base_search = asyncio.to_thread(self._sparse_search, text, top_k, snapshot)
+            partial = True
+        base_search = asyncio.ensure_future(base_search)
+        
+        expansion_timeout = remaining()
+        if self.speculative_expansion:
+            budget = self.expansion_timeout_ms / 1000 - (loop.time() - expansion_started)
+            expansion_timeout = budget if expansion_timeout is None else min(budget, expansion_timeout)
+        if await self._wait(expansion, expansion_timeout):
+            variations = expansion.result()
+        else:
+            variations = []
+            if deadline is not None and loop.time() >= deadline:
+                partial = True
+            logger.info("Query expansion missed its budget; using unexpanded search")
+        logger.info(f"Expanded query '{text}' to: {variations}")
+        
+        # 2. Hybrid Search: one batched embeddings call, then score all variations concurrently
+        fused_lists = [await base_search]
+        if variations:
+            variation_search = asyncio.ensure_future(self._search_variations(variations, top_k, snapshot))
+            if await self._wait(variation_search, remaining()):
+                fused_lists.extend(variation_search.result())
+            else:
+                partial = True
+                logger.warning(f"Deadline of {deadline_ms:.0f} ms hit; returning partial results for '{text}'")
+        all_fused = [hit for fused in fused_lists for hit in fused]
+        
+        # Deduplicate
+        chunk_scores = {}
+        for chunk_id, score in all_fused:
+            chunk_scores[chunk_id] = max(chunk_scores.get(chunk_id, 0), score)
+        
+        final_results = sorted(chunk_scores.items(), key=lambda x: x[1], reverse=True)[:top_k+2]
+            
+        if not final_results:
+            return QueryResult(
+                text="No relevant information found in the knowledge base.",
+                sources=[],
+                partial=partial,
             )
+        
+        # 3. Build Context (4. Get Images runs alongside, reusing the original query embedding)
+        async def _search_images() -> List[str]:
+            if not include_images or text_embedding is None:
+                return []
+            image_results = await self.search_engine.asearch_dense(text_embedding, 2, snapshot.image_index)
+            image_paths = []
             for img_id, _ in image_results:
-                img_data = self.index.get("images", {}).get(img_id, {})
+                img_data = snapshot.index.get("images", {}).get(img_id, {})
                 if img_data.get("local_path"):
                     image_paths.append(img_data["local_path"])
+            return image_paths
+        
+        images_task = asyncio.ensure_future(_search_images())
+        if snapshot.parents is not None:
+            # Parent fetches are LRU hits or slices of the mmapped blob: no thread hop
+            context_parts, sources = self._build_context(final_results, snapshot)
+        else:
+            context_parts, sources = await asyncio.to_thread(self._build_context, final_results, snapshot)
+        image_paths = await images_task
         
         # Return RAW CONTEXT
         final_context_text = "\n\n---\n\n".join(context_parts)
         
-        return QueryResult(
+        result = QueryResult(
             text=final_context_text,
-            sources=list(sources),
+            sources=sources,
             images=image_paths,
-            confidence=all_fused[0][1] if all_fused else 0.0
+            confidence=all_fused[0][1] if all_fused else 0.0,
+            partial=partial,
         )
+        if not partial and text_embedding is not None:
+            self.result_cache.put(text, text_embedding, snapshot.generation, result, **cache_params)
+        return result
+
+_searcher: Optional[KnowledgeBaseSearcher] = None
+_searcher_lock = threading.Lock()
+
+
+def load_kb_searcher(**kwargs) -> KnowledgeBaseSearcher:
+    """
+    Build the process-wide searcher (index maps, BM25, caches) once.
+
+    The agent calls this from its prewarm hook so the load happens while the
+    job process is idle, not on the first lookup of a call. Later calls, and
+    the `kb_searcher` proxy, return the same instance; kwargs only apply to
+    the first call.
+    """
+    global _searcher
+    with _searcher_lock:
+        if _searcher is None:
+            start = time.perf_counter()
+            _searcher = KnowledgeBaseSearcher(**kwargs)
+            logger.info(f"KB searcher ready in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return _searcher
+
+
+class _LazySearcher:
+    """Stands in for the singleton and loads it on first use (CLI, scripts, tests)."""
+
+    def __getattr__(self, name):
+        return getattr(load_kb_searcher(), name)
+
+    @property
+    def loaded(self) -> bool:
+        return _searcher is not None
+
 
-# Instantiate singleton
-kb_searcher = KnowledgeBaseSearcher()
+# Singleton: importing this module no longer loads the index
+kb_searcher = _LazySearcher()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+KB Retrieval Service
+====================
+Serves KnowledgeBaseSearcher over local HTTP so one warm index per host
+answers the lookups of every agent worker (see kb_client.py).
+
+Usage:
+    python kb_service.py                          # http://127.0.0.1:8765
+    python kb_service.py --port 9000
+    python kb_service.py --socket /tmp/kb.sock    # Unix socket
+    KB_SERVICE_URL=unix:/tmp/kb.sock python agent.py start
+
+Endpoints:
+    POST /query    {"text", "top_k", "include_images", "deadline_ms"} -> QueryResult
+    GET  /health   {"status", "generation", "documents"}
+    GET  /stats    get_stats() + cache_stats() + batching counters
+
+All lookups share one event loop. Lookups arriving within KB_SERVICE_BATCH_MS
+of each other share one embeddings request, and their dense scoring runs as
+one matrix-matrix product.
+The searcher hot-reloads new index generations as usual.
+"""
+
+import argparse
+import logging
+import os
+from dataclasses import asdict
+
+from aiohttp import web
+
+try:
+    from .kb_search import KnowledgeBaseSearcher, load_kb_searcher
+except ImportError:
+    from kb_search import KnowledgeBaseSearcher, load_kb_searcher
+
+logger = logging.getLogger("kb-service")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+def create_app(searcher: KnowledgeBaseSearcher) -> web.Application:
+    """aiohttp application serving `searcher`."""
+
+    async def query(request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except ValueError:
+            return web.json_response({"error": "request body must be JSON"}, status=400)
+        text = body.get("text") if isinstance(body, dict) else None
+        if not isinstance(text, str) or not text.strip():
+            return web.json_response({"error": "'text' is required"}, status=400)
+        try:
+            top_k = int(body.get("top_k", 3))
+            deadline_ms = body.get("deadline_ms")
+            deadline_ms = float(deadline_ms) if deadline_ms is not None else None
+        except (TypeError, ValueError):
+            return web.json_response({"error": "'top_k' and 'deadline_ms' must be numbers"}, status=400)
+
+        result = await searcher.query(
+            text,
+            top_k=top_k,
+            include_images=bool(body.get("include_images", True)),
+            deadline_ms=deadline_ms,
+        )
+        return web.json_response(asdict(result))
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "generation": searcher.generation,
+            "documents": len(searcher.index["documents"]),
+        })
+
+    async def stats(request: web.Request) -> web.Response:
+        engine = searcher.search_engine
+        return web.json_response({
+            "index": searcher.get_stats(),
+            "caches": searcher.cache_stats(),
+            "embedding_batches": engine.query_batcher.stats() if engine.query_batcher is not None else {},
+            "dense_batches": engine.dense_batcher.stats() if engine.dense_batcher is not None else {},
+        })
+
+    async def close_batching(app: web.Application):
+        await searcher.search_engine.close_batching()
+
+    app = web.Application()
+    app.router.add_post("/query", query)
+    app.router.add_get("/health", health)
+    app.router.add_get("/stats", stats)
+    app.on_cleanup.append(close_batching)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared KB retrieval service")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", type=str, default="", help="Listen on a Unix socket instead of TCP")
+    parser.add_argument(
+        "--batch-window-ms",
+        type=float,
+        default=float(os.getenv("KB_SERVICE_BATCH_MS", "3")),
+        help="Coalesce query embeddings and dense scoring arriving within this window (0 = no batching)"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    searcher = load_kb_searcher()
+    if args.batch_window_ms > 0:
+        searcher.search_engine.enable_query_batching(window_ms=args.batch_window_ms)
+        searcher.search_engine.enable_dense_batching(window_ms=args.batch_window_ms)
+
+    app = create_app(searcher)
+    if args.socket:
+        web.run_app(app, path=args.socket)
+    else:
+        web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
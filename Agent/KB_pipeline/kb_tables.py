@@ -0,0 +1,446 @@
+"""
+KB Lookup Tables
+================
+Typed copies of the reference tables operators ask about most, so exact
+lookups skip embedding, expansion and retrieval entirely.
+
+    DDR chart (DDR Chart-3.xlsx)    wire size range -> die ID, nozzle OD / ID, per insulation thickness
+    Temperature sheets (TPL/TD/28)  compound (+ machine) -> zone, die and water settings
+
+extract_tables() runs in the ingest parse stage and returns plain dicts,
+which are stored per document in the index generation (tables.json) and
+hot-reload with it. LookupTables indexes them for the agent's fast-path
+tools: a bisect over sorted range starts for wire sizes and dict keys for
+compound and machine. Every row carries its document reference
+(chart / section, issue, date, page) for citations.
+
+Tables are found by their structure, not by file name: a sheet with a
+"Wire size" header row, or a docx whose compound tables ("For ETFE
+Compound ...") follow a TECHNICAL DATA header naming the machine.
+"""
+
+import logging
+import re
+from bisect import bisect_left
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("kb-tables")
+
+# Bump when extraction output changes; ingest re-extracts tables stored with another version
+TABLES_VERSION = 2
+
+_RANGE = re.compile(r"^\s*(\d*\.?\d+)\s*(?:-|–|to)\s*(\d*\.?\d+)\s*$")
+_NUMBER = re.compile(r"\d*\.?\d+")
+_TITLE = re.compile(r"^\s*For\s+(.+?)\s*(?:\b(?:Compound|Material)\b(.*?))?\s*(?:\bTemp\b|$)", re.IGNORECASE)
+_ALIAS = re.compile(r"\(([A-Za-z]+)\)")
+_TOLERANCE = re.compile(r"Tol(?:erance)?\s*:?\s*((?:\+/-|±)\s*\d+)", re.IGNORECASE)
+_MACHINE_ID = re.compile(r"TPL/M/\d+", re.IGNORECASE)
+_HEADER_FIELD = re.compile(r"^\s*(Section No|Issue/Rev\. No|Date|Page No)\.?\s*:\s*(.*?)\s*$", re.IGNORECASE)
+
+# Chart-3 column headers -> DDRRow fields
+_DDR_COLUMNS = {
+    "wire size": "wire_size",
+    "die id": "die_id",
+    "nozzle od": "nozzle_od",
+    "nozzle id": "nozzle_id",
+    "thickness": "thickness",
+}
+
+
+def _key(text: str) -> str:
+    """Lookup key: upper case, letters and digits only ("XL-ZH" -> "XLZH", "TPL/M/60" -> "TPLM60")."""
+    return re.sub(r"[^A-Z0-9]", "", text.upper())
+
+
+def _clean(text: Any) -> str:
+    if text is None:
+        return ""
+    if isinstance(text, float):
+        return f"{text:g}"
+    text = " ".join(str(text).split())
+    # "----" marks "not applicable" in the sheets
+    return "" if re.fullmatch(r"-+", text) else text
+
+
+def parse_size(text: str) -> Optional[float]:
+    """First number in an operator's wire size ("0.35mm" -> 0.35); a range gives its midpoint."""
+    match = _RANGE.match(text.replace("mm", "")) if text else None
+    if match:
+        return (float(match.group(1)) + float(match.group(2))) / 2
+    number = _NUMBER.search(text or "")
+    return float(number.group()) if number else None
+
+
+def _parse_range(text: str) -> Optional[Tuple[float, float]]:
+    match = _RANGE.match(text)
+    if not match:
+        number = _NUMBER.fullmatch(text.strip())
+        return (float(text), float(text)) if number else None
+    low_text, high_text = match.groups()
+    low, high = float(low_text), float(high_text)
+    # Chart-3 writes 0.35-0.4 as "0.35-4": a whole-number bound above a sub-mm start
+    # lost its "0." - but only if restoring it still gives a range ("0.5-2" is 0.5 to 2)
+    if "." not in high_text and low < 1 < high and float(f"0.{high_text}") >= low:
+        high = float(f"0.{high_text}")
+    if low > high:
+        logger.warning(f"Ignoring inverted wire size range '{text}'")
+        return None
+    return low, high
+
+
+# ============================================================
+# TYPED ROWS
+# ============================================================
+
+@dataclass
+class DDRRow:
+    """One Chart-3 row: tooling for a wire size range at one insulation thickness."""
+    wire_size: str
+    wire_min: float
+    wire_max: float
+    die_id: str
+    nozzle_od: str
+    nozzle_id: str
+    thickness: str
+    title: str = ""
+    chart: str = ""
+    issue_rev: str = ""
+    date: str = ""
+    filename: str = ""
+
+    @property
+    def wire_range(self) -> str:
+        """The parsed size range for display, e.g. "0.35-0.4"; wire_size keeps the cell as written."""
+        if self.wire_min == self.wire_max:
+            return f"{self.wire_min:g}"
+        return f"{self.wire_min:g}-{self.wire_max:g}"
+
+    @property
+    def citation(self) -> str:
+        parts = [p for p in (self.chart, self.issue_rev and f"Issue/Rev {self.issue_rev}",
+                             self.date and f"Dt {self.date}") if p]
+        return f"{', '.join(parts)} ({self.filename})" if self.filename else ", ".join(parts)
+
+
+@dataclass
+class TemperatureProfile:
+    """One TPL/TD/28 table: settings for one or more compounds on one machine."""
+    title: str
+    compounds: List[str]
+    machine: str
+    machine_ids: List[str]
+    tolerance: str
+    settings: List[List[str]]  # [label, value] in sheet order (Z1..Z4 / Ex1..Ex4, ..., Die, Water, ...)
+    variant: str = ""
+    section: str = ""
+    issue_rev: str = ""
+    date: str = ""
+    page: str = ""
+    filename: str = ""
+
+    def value(self, *labels: str) -> str:
+        """Value of the first setting whose label starts with one of `labels` (case-insensitive)."""
+        for label, value in self.settings:
+            if any(label.lower().startswith(l.lower()) for l in labels):
+                return value
+        return ""
+
+    @property
+    def zones(self) -> List[str]:
+        """The four barrel zones (Z1-Z4 or Ex1-Ex4)."""
+        return [value for _, value in self.settings[:4]]
+
+    @property
+    def die(self) -> str:
+        for label, value in self.settings:
+            if label.lower().startswith("die") or label == "D":
+                return value
+        return ""
+
+    @property
+    def water(self) -> str:
+        return self.value("Water")
+
+    @property
+    def citation(self) -> str:
+        parts = [p for p in (self.section, self.issue_rev and f"Issue/Rev {self.issue_rev}",
+                             self.page and f"page {self.page}") if p]
+        return f"{', '.join(parts)} ({self.filename})" if self.filename else ", ".join(parts)
+
+
+# ============================================================
+# EXTRACTION (ingest)
+# ============================================================
+
+def extract_tables(file_path: Path) -> Dict[str, Any]:
+    """Lookup tables found in one source file (only "version" if none). Never raises."""
+    ext = file_path.suffix.lower()
+    tables: Dict[str, Any] = {"version": TABLES_VERSION}
+    try:
+        if ext == ".xlsx":
+            rows = extract_ddr_chart(file_path)
+            if rows:
+                tables["ddr"] = [asdict(r) for r in rows]
+        elif ext == ".docx":
+            profiles = extract_temperature_profiles(file_path)
+            if profiles:
+                tables["temperature"] = [asdict(p) for p in profiles]
+    except Exception as e:
+        logger.warning(f"Table extraction failed for {file_path.name}: {e}")
+    return tables
+
+
+def extract_ddr_chart(file_path: Path) -> List[DDRRow]:
+    """
+    Chart-3 rows from every sheet with a "Wire size" header row. The chart
+    repeats its columns side by side, one group per insulation thickness;
+    each group becomes its own rows.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    rows: List[DDRRow] = []
+    try:
+        for sheet in workbook.worksheets:
+            rows.extend(_ddr_sheet_rows([list(r) for r in sheet.iter_rows(values_only=True)]))
+    finally:
+        workbook.close()
+    return rows
+
+
+def _ddr_sheet_rows(cells: List[List[Any]]) -> List[DDRRow]:
+    header_row = next(
+        (i for i, row in enumerate(cells) if row and _clean(row[0]).lower() == "wire size"), None
+    )
+    if header_row is None:
+        return []
+    header = [_clean(c).lower() for c in cells[header_row]]
+    starts = [i for i, name in enumerate(header) if name == "wire size"]
+    groups = [
+        {_DDR_COLUMNS[header[col]]: col for col in range(start, end) if header[col] in _DDR_COLUMNS}
+        for start, end in zip(starts, starts[1:] + [len(header)])
+    ]
+
+    # Title, chart number, issue and date sit above the header
+    meta = {"title": "", "chart": "", "issue_rev": "", "date": ""}
+    for row in cells[:header_row]:
+        for cell in row:
+            text = _clean(cell)
+            if not text:
+                continue
+            if re.match(r"chart-?\s*\d+$", text, re.IGNORECASE):
+                meta["chart"] = text
+            elif text.lower().startswith("issue/rev"):
+                meta["issue_rev"] = text.split(":", 1)[-1].strip()
+            elif text.lower().startswith("dt"):
+                meta["date"] = text.split(":", 1)[-1].strip()
+            elif not meta["title"]:
+                meta["title"] = text
+
+    rows = []
+    for row in cells[header_row + 1:]:
+        for columns in groups:
+            if "wire_size" not in columns:
+                continue
+            values = {name: _clean(row[col]) if col < len(row) else "" for name, col in columns.items()}
+            bounds = _parse_range(values["wire_size"]) if values["wire_size"] else None
+            if bounds is None:
+                continue
+            rows.append(DDRRow(
+                wire_size=values["wire_size"], wire_min=bounds[0], wire_max=bounds[1],
+                die_id=values.get("die_id", ""), nozzle_od=values.get("nozzle_od", ""),
+                nozzle_id=values.get("nozzle_id", ""), thickness=values.get("thickness", ""),
+                **meta,
+            ))
+    return rows
+
+
+def extract_temperature_profiles(file_path: Path) -> List[TemperatureProfile]:
+    """
+    TPL/TD/28 compound tables: a title row ("For ETFE (Tefzol) & FEP Compound
+    ... Tolerance +/- 20 deg C"), a label row and a value row. The machine
+    and section header comes from the preceding TECHNICAL DATA table.
+    """
+    import docx
+
+    document = docx.Document(str(file_path))
+    profiles: List[TemperatureProfile] = []
+    header: Dict[str, Any] = {}
+    for table in document.tables:
+        rows = [_row_texts(row) for row in table.rows]
+        if not rows or not rows[0]:
+            continue
+        first = rows[0][0]
+        if first.upper().startswith("TECHNICAL DATA"):
+            header = _parse_machine_header(rows)
+            continue
+        if len(rows) >= 3 and header and _TITLE.match(first):
+            profile = _parse_profile(first, rows[1], rows[2], header)
+            if profile is not None:
+                profiles.append(profile)
+    return profiles
+
+
+def _row_texts(row) -> List[str]:
+    """Cell texts of a docx row; a horizontally merged cell is listed once, not once per grid column."""
+    texts, previous = [], None
+    for cell in row.cells:
+        if cell._tc is not previous:
+            texts.append(cell.text)
+        previous = cell._tc
+    return texts
+
+
+def _parse_machine_header(rows: List[List[str]]) -> Dict[str, Any]:
+    header: Dict[str, Any] = {"machine": "", "machine_ids": []}
+    for row in rows:
+        for text in row:
+            if "maintained on" in text:
+                machine = text.split("maintained on", 1)[1]
+                header["machine_ids"] = [m.upper() for m in _MACHINE_ID.findall(machine)]
+                header["machine"] = _clean(re.sub(r"\(.*?\)|\bor\b", " ", machine))
+            for line in text.splitlines():
+                match = _HEADER_FIELD.match(line)
+                if match:
+                    name = match.group(1).lower()
+                    field_name = ("section" if name.startswith("section") else
+                                  "issue_rev" if name.startswith("issue") else
+                                  "date" if name.startswith("date") else "page")
+                    header[field_name] = match.group(2)
+    return header
+
+
+def _parse_profile(
+    title: str, labels: List[str], values: List[str], header: Dict[str, Any]
+) -> Optional[TemperatureProfile]:
+    title = _clean(title)
+    match = _TITLE.match(title)
+    names = re.sub(r"\(.*?\)", " ", match.group(1))
+    compounds = [_clean(n) for n in names.split("&") if _clean(n)]
+    if not compounds:
+        return None
+    tolerance = _TOLERANCE.search(title)
+    settings = [[_clean(l), _clean(v)] for l, v in zip(labels, values) if _clean(l)]
+    return TemperatureProfile(
+        title=title,
+        compounds=compounds,
+        machine=header.get("machine", ""),
+        machine_ids=header.get("machine_ids", []),
+        tolerance=f"{' '.join(tolerance.group(1).split())} deg C" if tolerance else "",
+        settings=settings,
+        variant=_clean(match.group(2) or ""),
+        section=header.get("section", ""),
+        issue_rev=header.get("issue_rev", ""),
+        date=header.get("date", ""),
+        page=header.get("page", ""),
+    )
+
+
+# ============================================================
+# LOOKUP (query time)
+# ============================================================
+
+class LookupTables:
+    """
+    Indexed lookup tables of one index generation.
+
+    DDR rows are grouped by thickness and sorted by range start, so a wire
+    size is a bisect; temperature profiles are keyed by compound name and
+    alias ("ETFE", "TEFZOL", "XLZH").
+    """
+
+    def __init__(self, ddr: Optional[List[DDRRow]] = None, temperature: Optional[List[TemperatureProfile]] = None):
+        self.ddr_rows = ddr or []
+        self.profiles = temperature or []
+        # thickness -> (sorted range starts, rows, largest range end)
+        self._ddr: Dict[str, Tuple[List[float], List[DDRRow], float]] = {}
+        by_thickness: Dict[str, List[DDRRow]] = {}
+        for row in sorted(self.ddr_rows, key=lambda r: (r.wire_min, r.wire_max)):
+            by_thickness.setdefault(row.thickness, []).append(row)
+        for thickness, rows in by_thickness.items():
+            self._ddr[thickness] = ([r.wire_min for r in rows], rows, max(r.wire_max for r in rows))
+        self._thickness_mm = {t: parse_size(t) or 0.0 for t in self._ddr}
+        self._compounds: Dict[str, List[TemperatureProfile]] = {}
+        for profile in self.profiles:
+            keys = {_key(c) for c in profile.compounds} | {_key(a) for a in _ALIAS.findall(profile.title)}
+            for key in keys:
+                self._compounds.setdefault(key, []).append(profile)
+
+    @classmethod
+    def from_stored(cls, tables: Dict[str, Dict], documents: Dict[str, Dict]) -> "LookupTables":
+        """Build from tables.json (doc_id -> extracted tables); documents supply the cited file names."""
+        ddr, temperature = [], []
+        for doc_id, doc_tables in tables.items():
+            filename = documents.get(doc_id, {}).get("filename", "")
+            for row in doc_tables.get("ddr", []):
+                ddr.append(DDRRow(**dict(row, filename=filename)))
+            for profile in doc_tables.get("temperature", []):
+                temperature.append(TemperatureProfile(**dict(profile, filename=filename)))
+        return cls(ddr, temperature)
+
+    def __len__(self) -> int:
+        return len(self.ddr_rows) + len(self.profiles)
+
+    @property
+    def thicknesses(self) -> List[str]:
+        return list(self._ddr)
+
+    @property
+    def compounds(self) -> List[str]:
+        return sorted({c for p in self.profiles for c in p.compounds})
+
+    def ddr(self, wire_size: float, thickness: Optional[float] = None) -> List[DDRRow]:
+        """
+        The Chart-3 row for `wire_size` (mm) in each thickness group, or only
+        the group nearest `thickness`. A size on a shared bound ("0.3-0.35" /
+        "0.35-0.4") takes the lower row; one in a gap between ranges takes
+        the nearer range; one outside the chart matches nothing.
+        """
+        groups = list(self._ddr.items())
+        if thickness is not None and groups:
+            groups = [min(groups, key=lambda g: abs(self._thickness_mm[g[0]] - thickness))]
+        matches = []
+        for _, (starts, rows, end) in groups:
+            if wire_size < starts[0] or wire_size > end:
+                continue
+            i = max(bisect_left(starts, wire_size) - 1, 0)
+            candidates = rows[i:i + 2]
+            matches.append(min(candidates, key=lambda r: (
+                0 if r.wire_min <= wire_size <= r.wire_max else 1,
+                min(abs(wire_size - r.wire_min), abs(wire_size - r.wire_max)),
+            )))
+        return matches
+
+    def temperatures(self, compound: str, machine: str = "") -> List[TemperatureProfile]:
+        """Profiles for `compound` (name or alias), optionally only on `machine` (id like "TPL/M/60" or name)."""
+        profiles = self._compounds.get(_key(compound), [])
+        if machine:
+            profiles = [p for p in profiles if self.matches_machine(p, machine)]
+        return profiles
+
+    @staticmethod
+    def matches_machine(profile: TemperatureProfile, machine: str) -> bool:
+        """
+        Whether `machine` names the profile's extruder: by machine number when
+        one is given ("TPL/M/60", "Rosendahl TPL/M/60", "M/60", "60"),
+        otherwise by name ("ROSENDAHL", "Rosendahl line 1").
+        """
+        ids = {_key(m) for m in profile.machine_ids}
+        named = {_key(m) for m in _MACHINE_ID.findall(machine)}
+        if named:
+            return bool(named & ids)
+        wanted = _key(machine)
+        number = wanted[1:] if wanted.startswith("M") else wanted
+        if number.isdigit():
+            return any(m.endswith(f"M{number}") for m in ids)
+        brand = _key(profile.machine.split()[0]) if profile.machine else ""
+        return bool(wanted) and (wanted in _key(profile.machine) or (bool(brand) and brand in wanted))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "ddr_rows": len(self.ddr_rows),
+            "temperature_profiles": len(self.profiles),
+            "compounds": len(self._compounds),
+        }
@@ -0,0 +1,178 @@
+"""
+KB Tokenizer
+============
+Shared tokenizer for chunking, BM25 indexing and the query path.
+
+Operators ask about exact codes and values, so plain `lower().split()`
+loses exactly the tokens that matter ("TPL/TD/28", "0.35mm", "Z3,",
+"ETFE:"). This pipeline:
+
+- splits off punctuation ("Z3," -> "z3", "ETFE:" -> "etfe"), except
+  thousands separators inside numbers ("1,200" -> "1200"; value lists
+  like "320,330,340" still split)
+- keeps document codes whole, with "-"/"_" folded to "/" ("TPL-TD-28" ->
+  "tpl/td/28"), and also emits their parts ("tpl", "td", "28")
+- keeps alphanumeric IDs whole ("Z3", "PA11", "M60")
+- separates numbers from units and normalizes both ("0.350mm" -> "0.35",
+  "mm"; "250°C" / "250 deg C" -> "250", "degc"; "0.3-0.35" -> "0.3", "0.35")
+
+Patterns are precompiled and token output is memoized per whitespace word,
+so a corpus with a technical vocabulary tokenizes at close to str.split()
+speed (`python bench_kb.py tokenize`).
+"""
+
+import re
+from itertools import chain
+from typing import Iterable, List, Tuple
+
+# Bump when token output changes; persisted sparse indexes are rebuilt on mismatch
+TOKENIZER_VERSION = 3
+
+_DEGREE_RE = re.compile(r"°\s*c\b|\bdeg(?:ree)?s?\s*(?:c\b|celsius\b)|\bcelsius\b")
+
+_TOKEN_RE = re.compile(
+    r"(?P<code>[a-z]{2,}(?:[/\-_][a-z0-9]{1,6}){2,})"     # TPL/TD/28, TPL-WI-P-15
+    r"|(?P<alnum>[a-z]+\d[a-z0-9]*)"                        # Z3, PA11, M60
+    r"|(?P<num>\d+(?:\.\d+)?|\.\d+)(?P<unit>[a-z%]+(?:/[a-z]+)?)?"  # 0.35mm, 20kv, 5m/min
+    r"|(?P<word>[a-z]+)"
+)
+_CODE_SEP_RE = re.compile(r"[\-_]")
+# A standalone number written with digit-group commas: "1,200", "12,500,000".
+# A 3-digit lead group or a further value after it means a list ("320,330,340")
+_GROUPED_NUMBER_RE = re.compile(r"(?<![a-z0-9.,])[1-9]\d?(?:,\d{3})+(?!,?\d)")
+_WHITESPACE_RE = re.compile(r"\S+")
+
+UNIT_ALIASES = {
+    "millimeter": "mm", "millimeters": "mm", "millimetre": "mm", "millimetres": "mm",
+    "kilovolt": "kv", "kilovolts": "kv",
+    "mpm": "m/min",
+    "percent": "%",
+}
+
+
+def _normalize_number(num: str) -> str:
+    if "." in num:
+        num = num.rstrip("0").rstrip(".")
+        if num.startswith("."):
+            num = "0" + num
+    return num or "0"
+
+
+def _tokenize_word(text: str) -> Tuple[str, ...]:
+    if "°" in text:
+        text = _DEGREE_RE.sub("degc", text)
+    if "," in text:
+        text = _GROUPED_NUMBER_RE.sub(lambda m: m.group().replace(",", ""), text)
+    tokens: List[str] = []
+    append = tokens.append
+    for code, alnum, num, unit, word in _TOKEN_RE.findall(text):
+        if word:
+            append(UNIT_ALIASES.get(word, word))
+        elif num:
+            append(_normalize_number(num))
+            if unit:
+                append(UNIT_ALIASES.get(unit, unit))
+        elif alnum:
+            append(alnum)
+        else:
+            code = _CODE_SEP_RE.sub("/", code)
+            append(code)
+            tokens.extend(code.split("/"))
+    return tuple(tokens)
+
+
+class _WordCache(dict):
+    """Whitespace word -> tokens; misses fall through to the regex."""
+    max_entries = 500_000
+
+    def __missing__(self, word: str) -> Tuple[str, ...]:
+        if len(self) >= self.max_entries:
+            self.clear()
+        tokens = self[word] = _tokenize_word(word)
+        return tokens
+
+
+_word_cache = _WordCache()
+
+
+def tokenize(text: str) -> List[str]:
+    """Normalized search tokens for BM25 indexing and queries."""
+    text = text.lower()
+    # "deg C" spans two words; "°C" is handled per word
+    if "deg" in text or "celsius" in text:
+        text = _DEGREE_RE.sub("degc", text)
+    return list(chain.from_iterable(map(_word_cache.__getitem__, text.split())))
+
+
+def tokenize_many(texts: Iterable[str]) -> List[List[str]]:
+    """Tokenize a corpus (BM25 build)."""
+    return [tokenize(text) for text in texts]
+
+
+def split_words(text: str) -> List[str]:
+    """
+    Whitespace words with original spelling, for chunk boundaries.
+    Codes and values like "TPL/TD/28" or "0.35mm" are never cut in half.
+    """
+    return _WHITESPACE_RE.findall(text)
+
+
+# ============================================================
+# MODEL TOKEN COUNTS
+# ============================================================
+# Embedding / LLM token counts (cl100k_base, used by text-embedding-3-*).
+# tiktoken is optional; without it counts are a conservative chars/2 estimate
+# (numeric tables run well under 4 chars/token).
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + 1) // 2
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens model tokens."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 2]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+class _WordTokenCounts(dict):
+    """Whitespace word -> model tokens with its leading space (as it appears mid-text)."""
+    max_entries = 500_000
+
+    def __missing__(self, word: str) -> int:
+        if len(self) >= self.max_entries:
+            self.clear()
+        count = self[word] = count_tokens(" " + word)
+        return count
+
+
+_word_token_counts = _WordTokenCounts()
+
+
+def count_word_tokens(words: Iterable[str]) -> List[int]:
+    """
+    Per-word model token counts, memoized. cl100k pre-splits text at word
+    boundaries, so these sum to the count of the space-joined words.
+    """
+    return list(map(_word_token_counts.__getitem__, words))
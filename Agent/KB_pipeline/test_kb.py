@@ -12,19 +12,19 @@ Usage:
 
 import asyncio
 import sys
-import openai
 from pathlib import Path
 
 # Add parent dir to path if running as script
 # sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from kb_common import get_async_openai_client
 from kb_search import kb_searcher as kb_manager
 
 
 async def generate_answer(query: str, context: str, sources: list) -> str:
     """Synthesize answer using strict prompt."""
     try:
-        client = openai.OpenAI()
+        client = get_async_openai_client()
         
         system_prompt = """You are a knowledgeable assistant that provides COMPLETE and ACCURATE answers based on provided context.
 
@@ -36,7 +36,7 @@ async def generate_answer(query: str, context: str, sources: list) -> str:
 """
         user_prompt = f"""CONTEXT:\n{context[:15000]}\n\n---\n\nQUESTION: {query}\n\nProvide a structured answer based ONLY on the context."""
 
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -0,0 +1,46 @@
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# KB_pipeline modules import each other as top-level modules when run from this directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# The OpenAI clients refuse to construct without a key; tests never reach the API
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from kb_common import DocumentChunk, HybridSearchEngine
+from kb_index import IndexStore, StoredIndex
+
+DIM = 16
+
+
+def build_index() -> dict:
+    """A small index dict: 4 parents of 4 children each, random embeddings."""
+    rng = np.random.default_rng(0)
+    index = {"documents": {"doc0": {"doc_id": "doc0", "filename": "test.docx", "summary": ""}},
+             "chunks": {}, "images": {}, "embeddings": {}}
+    for p in range(4):
+        parent_id = f"doc0_p{p}"
+        index["chunks"][parent_id] = DocumentChunk(parent_id, "doc0", "test.docx", f"parent {p} ETFE zone die").__dict__
+        for c in range(4):
+            emb = rng.standard_normal(DIM).tolist()
+            chunk = DocumentChunk(f"{parent_id}_c{c}", "doc0", "test.docx", f"ETFE zone {p} die {c}",
+                                  embedding=emb, is_parent=False, parent_id=parent_id)
+            index["chunks"][chunk.chunk_id] = chunk.__dict__
+            index["embeddings"][chunk.chunk_id] = emb
+    return index
+
+
+def save_index(store_dir: Path, index: dict) -> int:
+    engine = HybridSearchEngine()
+    engine.build_bm25_index([DocumentChunk(**c) for c in index["chunks"].values()])
+    return IndexStore(store_dir).save(StoredIndex.from_index_dict(index, sparse=engine.sparse_index))
+
+
+@pytest.fixture
+def store_dir(tmp_path) -> Path:
+    """A small saved index (see build_index)."""
+    save_index(tmp_path, build_index())
+    return tmp_path
@@ -0,0 +1,42 @@
+import asyncio
+import gc
+
+import pytest
+
+from kb_batch import MicroBatcher
+
+
+def test_batches_survive_garbage_collection():
+    async def main():
+        async def double(items):
+            await asyncio.sleep(0.01)
+            gc.collect()
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(double, window_ms=1)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+        assert results == [0, 2, 4, 6, 8]
+        assert batcher.stats()["batches"] == 1
+        assert not batcher._tasks
+
+    asyncio.run(main())
+
+
+def test_close_cancels_batches_in_flight():
+    async def main():
+        started = asyncio.Event()
+
+        async def slow(items):
+            started.set()
+            await asyncio.sleep(10)
+            return items
+
+        batcher = MicroBatcher(slow, window_ms=1)
+        waiter = asyncio.ensure_future(batcher.submit(1))
+        await started.wait()
+        await batcher.close()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert not batcher._tasks
+
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+from kb_cache import EmbeddingCache, SemanticResultCache
+
+
+def test_embedding_cache_persists_in_background(tmp_path):
+    path = tmp_path / "query_cache.sqlite"
+    cache = EmbeddingCache(path=path)
+    for i in range(300):
+        cache.put(f"query {i}", "model", [float(i), 1.0])
+    # The in-memory entry is there before the writer has run
+    assert cache.get("QUERY 7", "model") == [7.0, 1.0]
+    cache.flush()
+
+    reopened = EmbeddingCache(path=path)
+    assert reopened.get("query 299", "model") == [299.0, 1.0]
+    assert reopened.stats()["hits"] == 1
+
+
+def test_embedding_cache_loads_newest_entries_on_open(tmp_path):
+    path = tmp_path / "query_cache.sqlite"
+    cache = EmbeddingCache(ttl_seconds=None, path=path)
+    cache._db_put_many([(("model", f"query {i}"), (1000.0 + i, [float(i)])) for i in range(20)])
+
+    # Loaded up front: lookups are served from memory only
+    reopened = EmbeddingCache(max_entries=5, ttl_seconds=None, path=path)
+    assert reopened.stats()["entries"] == 5
+    reopened._db = None
+    assert reopened.get("query 19", "model") == [19.0]
+    assert reopened.get("query 0", "model") is None
+
+
+def test_result_cache_requires_matching_key_terms():
+    cache = SemanticResultCache()
+    embedding = [1.0, 0.0, 0.0]
+    cache.put("DDR die for 0.35 mm wire", embedding, 1, "result-0.35", top_k=5)
+    assert cache.get("DDR die for 0.35mm wire?", embedding, 1, top_k=5) == "result-0.35"
+    assert cache.get("DDR die for 0.40 mm wire", embedding, 1, top_k=5) is None
+
+    cache.put("ETFE zone temperatures", embedding, 1, "result-etfe", top_k=5)
+    assert cache.get("ECTFE zone temperatures", embedding, 1, top_k=5) is None
+    assert cache.get("ETFE zone temperature", embedding, 1, top_k=5) == "result-etfe"
@@ -0,0 +1,43 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+import kb_client
+from kb_client import KnowledgeBaseClient
+from kb_common import QueryResult
+
+
+class FakeSearcher:
+    def __init__(self):
+        self.deadlines = []
+
+    async def query(self, text, top_k, include_images, deadline_ms):
+        self.deadlines.append(deadline_ms)
+        return QueryResult(text="local", sources=[])
+
+
+def _run_with_slow_service(delay: float, deadline_ms: float):
+    client = KnowledgeBaseClient(url="http://kb-service.invalid")
+    searcher = FakeSearcher()
+
+    async def remote_query(*args):
+        await asyncio.sleep(delay)
+        raise asyncio.TimeoutError()
+
+    with mock.patch.object(client, "_remote_query", remote_query), \
+            mock.patch.object(kb_client, "kb_searcher", SimpleNamespace(loaded=True)), \
+            mock.patch.object(kb_client, "load_kb_searcher", return_value=searcher):
+        result = asyncio.run(client.query("ETFE die", deadline_ms=deadline_ms))
+    return result, searcher
+
+
+def test_fallback_gets_only_the_remaining_deadline():
+    result, searcher = _run_with_slow_service(0.1, 300)
+    assert result.text == "local"
+    assert 150 < searcher.deadlines[0] <= 200
+
+
+def test_fallback_returns_empty_partial_when_deadline_is_spent():
+    result, searcher = _run_with_slow_service(0.1, 50)
+    assert result.partial and not result.text
+    assert searcher.deadlines == []
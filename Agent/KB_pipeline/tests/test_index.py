@@ -0,0 +1,18 @@
+from conftest import build_index, save_index
+from kb_index import IndexStore
+
+
+def test_format3_parents_are_migrated_and_removed(tmp_path):
+    index = build_index()
+    # A format-3 store keeps parent texts as kb_store/parents/<id>.txt, not in the index
+    legacy_dir = tmp_path / "parents"
+    legacy_dir.mkdir()
+    (legacy_dir / "doc0_p0.txt").write_text("legacy parent text", encoding="utf-8")
+    index["chunks"]["doc0_p0"]["text"] = ""
+
+    save_index(tmp_path, index)
+
+    assert not legacy_dir.exists()
+    stored = IndexStore(tmp_path).load()
+    assert stored.parents.get("doc0_p0") == "legacy parent text"
+    assert stored.parents.get("doc0_p1") == "parent 1 ETFE zone die"
@@ -0,0 +1,9 @@
+import pytest
+
+from kb_parser import KnowledgeBaseParser
+
+
+def test_invalid_ann_mode_fails_before_ingest(tmp_path, monkeypatch):
+    monkeypatch.setenv("KB_ANN", "hnsw")
+    with pytest.raises(ValueError, match="Unknown ANN mode 'hnsw'"):
+        KnowledgeBaseParser(data_dir=str(tmp_path / "data"), store_dir=str(tmp_path / "store"))
@@ -0,0 +1,118 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+import kb_expand
+from conftest import DIM
+from kb_search import KnowledgeBaseSearcher
+
+
+class FakeChatClient:
+    """Stands in for the AsyncOpenAI client used by LLMQueryExpander; counts calls."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+        self.completed = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        self.completed += 1
+        message = SimpleNamespace(content="etfe die\nzone die")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def test_result_cache_hit_skips_expansion(store_dir):
+    searcher = KnowledgeBaseSearcher(store_dir=str(store_dir), expansion="llm", reload_interval=0)
+    embedding = np.random.default_rng(1).standard_normal(DIM).tolist()
+
+    async def aembed_request(texts):
+        return [embedding for _ in texts]
+
+    client = FakeChatClient()
+    with mock.patch.object(kb_expand, "get_async_openai_client", return_value=client), \
+            mock.patch.object(searcher.search_engine, "_aembed_request", aembed_request):
+        first = asyncio.run(searcher.query("ETFE die", include_images=False))
+        assert client.calls == 1
+        second = asyncio.run(searcher.query("ETFE die", include_images=False))
+
+    assert second is first
+    assert client.calls == 1
+    assert searcher.result_cache.stats()["hits"] == 1
+
+
+def test_paraphrase_cache_hit_cancels_expansion(store_dir):
+    searcher = KnowledgeBaseSearcher(store_dir=str(store_dir), expansion="llm", reload_interval=0)
+    embedding = np.random.default_rng(1).standard_normal(DIM).tolist()
+
+    async def aembed_request(texts):
+        await asyncio.sleep(0.01)
+        return [embedding for _ in texts]
+
+    client = FakeChatClient(delay=0.2)
+    with mock.patch.object(kb_expand, "get_async_openai_client", return_value=client), \
+            mock.patch.object(searcher.search_engine, "_aembed_request", aembed_request):
+        first = asyncio.run(searcher.query("ETFE die", include_images=False))
+        # Not a cached embedding: expansion starts alongside the embeddings call
+        second = asyncio.run(searcher.query("ETFE die?", include_images=False))
+
+    assert second is first
+    assert client.calls == 2
+    assert client.completed == 1
+
+
+def test_slow_embedding_does_not_use_up_expansion_budget(store_dir):
+    searcher = KnowledgeBaseSearcher(store_dir=str(store_dir), expansion="llm", reload_interval=0,
+                                     speculative_expansion=True, expansion_timeout_ms=150)
+    embedding = np.random.default_rng(1).standard_normal(DIM).tolist()
+
+    async def aembed_request(texts):
+        await asyncio.sleep(0.12)
+        return [embedding for _ in texts]
+
+    searched = []
+
+    async def search_variations(variations, top_k, snapshot=None):
+        searched.extend(variations)
+        return []
+
+    client = FakeChatClient(delay=0.08)
+    with mock.patch.object(kb_expand, "get_async_openai_client", return_value=client), \
+            mock.patch.object(searcher.search_engine, "_aembed_request", aembed_request), \
+            mock.patch.object(searcher, "_search_variations", search_variations):
+        asyncio.run(searcher.query("ETFE die", include_images=False))
+
+    # Embedding (120 ms) and expansion (80 ms) overlap, so the variations make the 150 ms budget
+    assert searched
+
+
+def test_collector_pauses_nest_across_threads():
+    import gc
+    import threading
+
+    from kb_search import _collector_paused
+
+    assert gc.isenabled()
+    first_in, second_out = threading.Event(), threading.Event()
+    seen = []
+
+    def reload_a():
+        with _collector_paused():
+            first_in.set()
+            second_out.wait()
+            seen.append(gc.isenabled())  # the other reload ending must not re-enable it
+
+    thread = threading.Thread(target=reload_a)
+    thread.start()
+    first_in.wait()
+    with _collector_paused():
+        assert not gc.isenabled()
+    second_out.set()
+    thread.join()
+
+    assert seen == [False]
+    assert gc.isenabled()
@@ -0,0 +1,21 @@
+from kb_tables import DDRRow, _parse_range
+
+
+def test_ddr_wire_range_formats_parsed_bounds():
+    low, high = _parse_range("0.35-4")
+    row = DDRRow(wire_size="0.35-4", wire_min=low, wire_max=high,
+                 die_id="1.2", nozzle_od="1.0", nozzle_id="0.5", thickness="0.25")
+    assert row.wire_range == "0.35-0.4"
+    single = DDRRow(wire_size="0.5", wire_min=0.5, wire_max=0.5,
+                    die_id="1.4", nozzle_od="1.1", nozzle_id="0.6", thickness="0.25")
+    assert single.wire_range == "0.5"
+
+
+def test_parse_range_restores_dropped_leading_zero_only_when_it_fits():
+    assert _parse_range("0.35-4") == (0.35, 0.4)
+    assert _parse_range("0.5-2") == (0.5, 2.0)
+    assert _parse_range("0.3 - 0.35") == (0.3, 0.35)
+
+
+def test_parse_range_rejects_inverted_ranges():
+    assert _parse_range("0.5-0.3") is None
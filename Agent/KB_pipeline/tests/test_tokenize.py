@@ -0,0 +1,23 @@
+from kb_tokenize import tokenize
+
+
+def test_thousands_separators_stay_in_one_number():
+    assert tokenize("Max length 1,200 m") == ["max", "length", "1200", "m"]
+    assert tokenize("1,000") == ["1000"]
+    assert tokenize("12,500,000 cycles") == ["12500000", "cycles"]
+    assert tokenize("1,200mm,") == ["1200", "mm"]
+
+
+def test_commas_between_values_still_split():
+    assert tokenize("Z3,Z4") == ["z3", "z4"]
+    assert tokenize("0.35,0.4") == ["0.35", "0.4"]
+    assert tokenize("1,2,3") == ["1", "2", "3"]
+    assert tokenize("10,20") == ["10", "20"]
+
+
+def test_value_lists_are_not_taken_for_grouped_numbers():
+    assert tokenize("320,330,340") == ["320", "330", "340"]
+    assert tokenize("Z1-Z5: 320,330,340,350") == ["z1", "z5", "320", "330", "340", "350"]
+    assert tokenize("zones 250,260,270") == ["zones", "250", "260", "270"]
+    assert tokenize("5,1,200") == ["5", "1", "200"]
+    assert tokenize("1,200,5") == ["1", "200", "5"]
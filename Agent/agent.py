@@ -31,8 +31,10 @@ from livekit.plugins import (
 
 from livekit.plugins.turn_detector.multilingual import MultilingualModel
 
-# KB Manager
-from KB_pipeline.kb_search import kb_searcher as kb_manager
+# KB Manager: the shared retrieval service when KB_SERVICE_URL is set, else the
+# in-process searcher (lazy: loaded in prewarm, not at import)
+from KB_pipeline.kb_client import kb_client as kb_manager
+from KB_pipeline.kb_tables import parse_size
 
 # -------------------------
 # ENV & LOGGING
@@ -119,6 +121,9 @@ async def send_overlay(layout_type: str, title: str, data: dict, context: str =
 # KNOWLEDGE BASE TOOL
 # -------------------------
 
+# Voice-turn latency budget for a lookup; slower searches return partial results
+KB_LOOKUP_DEADLINE_MS = int(os.getenv("KB_LOOKUP_DEADLINE_MS", "2500"))
+
 @llm.function_tool
 async def knowledge_lookup(
     query: str,
@@ -156,7 +161,7 @@ async def knowledge_lookup(
     try:
         enhanced_query = f"[{context_type}] {query}" if context_type != "general" else query
         
-        result = await kb_manager.query(enhanced_query, include_images=False)
+        result = await kb_manager.query(enhanced_query, include_images=False, deadline_ms=KB_LOOKUP_DEADLINE_MS)
         
         if not result.text:
             return f"No information found for query: {query}. Please rephrase or ask for related information."
@@ -165,6 +170,8 @@ async def knowledge_lookup(
         if result.sources:
             sources_str = ", ".join(result.sources[:3])
             response += f"\n\nReference: {sources_str}"
+        if result.partial:
+            response += "\n\nNote: Search hit its time limit, so these results may be incomplete."
         
         return response
         
@@ -172,6 +179,92 @@ async def knowledge_lookup(
         logger.error(f"Knowledge lookup error: {e}")
         return f"Error searching knowledge base: {str(e)}"
 
+# -------------------------
+# TABLE LOOKUP TOOLS (fast path: no embedding, no search)
+# -------------------------
+
+@llm.function_tool
+async def lookup_ddr(wire_size: str, thickness: str = "") -> str:
+    """
+    Look up die and nozzle for a wire size directly in the DDR chart (Chart-3).
+    Answers instantly from the chart's own rows - use this instead of knowledge_lookup
+    for die / nozzle / DDR questions about a wire size, then call show_ddr_table.
+    
+    Args:
+        wire_size: Wire size in mm (e.g., "0.35", "0.35mm", "0.3-0.35")
+        thickness: Insulation thickness in mm if the operator gave one (e.g., "0.25").
+                   Leave empty to get every thickness in the chart.
+    
+    Returns:
+        Die ID, nozzle OD / ID and thickness of the matching chart rows, with the chart reference.
+    """
+    try:
+        size = parse_size(wire_size)
+        if size is None:
+            return f"Could not read a wire size from '{wire_size}'. Ask the operator for the size in mm."
+        
+        tables = await kb_manager.tables()
+        rows = tables.ddr(size, parse_size(thickness) if thickness else None)
+        if not rows:
+            return (f"Wire size {wire_size} is not in the DDR chart. "
+                    f"Use knowledge_lookup with context_type \"tooling\" instead.")
+        
+        lines = [
+            f"Wire size {row.wire_range} mm, thickness {row.thickness} mm: Die ID {row.die_id}, "
+            f"Nozzle OD {row.nozzle_od}, Nozzle ID {row.nozzle_id}"
+            for row in rows
+        ]
+        return "\n".join(lines) + f"\n\nReference: {rows[0].citation}"
+        
+    except Exception as e:
+        logger.error(f"DDR lookup error: {e}")
+        return f"Error reading the DDR chart: {str(e)}"
+
+
+@llm.function_tool
+async def lookup_temperature_profile(compound: str = "", machine: str = "") -> str:
+    """
+    Look up zone temperature settings for a compound directly in TPL/TD/28.
+    Answers instantly from the sheet's own tables - use this instead of knowledge_lookup
+    for temperature settings of a compound, then call show_temperature_profile.
+    
+    Args:
+        compound: Compound (e.g., "ETFE", "PFA", "PA11", "ECTFE", "PVC").
+                  Leave empty to use the compound set with set_machine_context.
+        machine: Extruder name or number if known (e.g., "ROSENDAHL", "TPL/M/60").
+                 Leave empty to use the session machine, or to get every machine.
+    
+    Returns:
+        Zone, die and water settings per machine, with the TPL/TD/28 page reference.
+    """
+    try:
+        compound = compound or _session_context["compound_type"] or ""
+        if not compound:
+            return "Which compound? Ask the operator (e.g. ETFE, PFA, PA11)."
+        
+        tables = await kb_manager.tables()
+        profiles = tables.temperatures(compound)
+        if not profiles:
+            return (f"No TPL/TD/28 temperature table for {compound}. "
+                    f"Use knowledge_lookup with context_type \"temperature\" instead.")
+        
+        machine = machine or _session_context["machine_id"] or ""
+        on_machine = [p for p in profiles if machine and tables.matches_machine(p, machine)]
+        lines = []
+        if machine and not on_machine:
+            lines.append(f"No {compound.upper()} table for machine {machine}; settings for every machine:")
+        for p in on_machine or profiles:
+            name = " / ".join(p.compounds) + (f" {p.variant}" if p.variant else "")
+            where = f"{p.machine} ({', '.join(p.machine_ids)})" if p.machine_ids else p.machine
+            tolerance = f", tolerance {p.tolerance}" if p.tolerance else ""
+            settings = ", ".join(f"{label} {value}" for label, value in p.settings if value)
+            lines.append(f"{name} on {where}{tolerance}: {settings}. Reference: {p.citation}")
+        return "\n".join(lines)
+        
+    except Exception as e:
+        logger.error(f"Temperature lookup error: {e}")
+        return f"Error reading the temperature sheets: {str(e)}"
+
 # -------------------------
 # SESSION CONTEXT TOOL
 # -------------------------
@@ -226,7 +319,7 @@ async def show_ddr_table(
     """
     Display the DDR table with the matching row highlighted.
     Use this for die/nozzle/wire size queries - this is the Trust Moment visual.
-    The data comes from knowledge_lookup - call that first to get the values.
+    The data comes from lookup_ddr (or knowledge_lookup) - call that first to get the values.
     
     Args:
         wire_size: Wire size range (e.g., "0.3-0.35")
@@ -286,7 +379,7 @@ async def show_temperature_profile(
     """
     Display temperature profile with all zones for a specific compound.
     Use this when operator asks about temperature settings for a material.
-    The temperature values should come from knowledge_lookup first.
+    The temperature values should come from lookup_temperature_profile (or knowledge_lookup) first.
     
     Args:
         compound: Compound type (e.g., "PFA", "ETFE", "PA11")
@@ -510,6 +603,8 @@ class ThermopadsSupervisor(Agent):
             tools=[
                 # Knowledge Base
                 knowledge_lookup,
+                lookup_ddr,
+                lookup_temperature_profile,
                 # Session Context
                 set_machine_context,
                 # Thermopads-Specific Overlays
@@ -536,6 +631,9 @@ server = AgentServer()
 
 def prewarm(proc: JobProcess):
     proc.userdata["vad"] = silero.VAD.load()
+    # Load the KB while the process is idle so the first lookup of a call doesn't pay for it
+    # (nothing to load when lookups go to the retrieval service)
+    kb_manager.prewarm()
 
 server.setup_fnc = prewarm
 
@@ -587,6 +685,7 @@ async def entrypoint(ctx: JobContext):
         usage_collector.collect(ev.metrics)
 
     ctx.add_shutdown_callback(lambda: logger.info(f"Usage Summary: {usage_collector.get_summary()}"))
+    ctx.add_shutdown_callback(kb_manager.close)
 
     # Connect components
     await avatar.start(session, room=ctx.room)